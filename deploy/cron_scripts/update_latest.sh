@@ -15,15 +15,52 @@ OUT_DIR="/afs/sipb.mit.edu/project/hydrant/web_scripts/hydrant"
 
 cd "$REPO_DIR"
 
-# -q means quietly; don't report anything in stdout or stderr.
-# make sure we're in the right branch:
-git checkout -q -f deploy
-git pull -q
-
-# The scripts machine we use has Python 3.8, so use that.
-# This updates $OUT_FILE.
-python3.8 -m scrapers
-OUT_FILE="$REPO_DIR/public/*.json"
-
-# Copy $OUT_FILE to the output directory, so it can be served to the internet.
-cp $OUT_FILE "$OUT_DIR"
+# Only one update runs at a time, from the pull to the copy, since the hourly
+# trigger doesn't wait for the last update to finish. A trigger that finds one
+# running leaves $PENDING_FILE behind and exits, and the running one updates again
+# once it is done, so any number of triggers during an update lead to a single
+# follow-up. scrapers/runlock.py does the same for the scrapers on their own,
+# which also keeps manual runs from overlapping with this script.
+mkdir -p "$REPO_DIR/scrapers/.cache"
+LOCK_FILE="$REPO_DIR/scrapers/.cache/update.lock"
+PENDING_FILE="$REPO_DIR/scrapers/.cache/update.pending"
+
+update() {
+    # -q means quietly; don't report anything in stdout or stderr.
+    # make sure we're in the right branch:
+    git checkout -q -f deploy
+    git pull -q
+
+    # The scripts machine we use has Python 3.8, so use that.
+    # Sharding (--shard) isn't deployed yet, since the frontend doesn't read the
+    # shards; see scrapers/README.md.
+    # This updates $OUT_FILE.
+    python3.8 -m scrapers
+    OUT_FILE="$REPO_DIR/public/*.json"
+    # The precompressed copies of $OUT_FILE; there are no .br files without brotli.
+    shopt -s nullglob
+    COMPRESSED_FILES=("$REPO_DIR"/public/*.json.gz "$REPO_DIR"/public/*.json.br)
+
+    # Copy $OUT_FILE to the output directory, so it can be served to the internet.
+    # The scrapers only rewrite a file when its contents change, so -p keeps the
+    # modification times and -u skips the files that are already up to date.
+    cp -p -u $OUT_FILE "${COMPRESSED_FILES[@]}" "$OUT_DIR"
+}
+
+exec 9>"$LOCK_FILE"
+if ! flock -n 9; then
+    touch "$PENDING_FILE"
+    # The running update may have finished before it could see the request
+    flock -n 9 || exit 0
+fi
+while true; do
+    # This update starts after every request so far, so it satisfies them
+    rm -f "$PENDING_FILE"
+    update
+    # Checked after unlocking, so that a request made just before can't be
+    # missed: whoever made it either took the lock itself, or is seen here. If
+    # it took the lock, it does the follow-up, and this script stops.
+    flock -u 9
+    [ -e "$PENDING_FILE" ] || break
+    flock -n 9 || break
+done
@@ -3,36 +3,321 @@ This is the entry point. Run `python3 -m scrapers` to test this code.
 
 In production, there's a cron job that runs this script every hour.
 
+The independent scrapers run at the same time, and packaging starts once all of
+them are done. Pass `--serial` to run them one at a time instead.
+
+The scrapers hand their results straight to packaging, and save them as JSON files
+in the background, so that packaging can also be run on its own later. Pass
+`--no-checkpoints` to skip saving them.
+
+Pass `--watch` to skip scraping, and instead repackage whenever an override file
+changes, see scrapers/watch.py.
+
+Pass `--only <stage>` or `--skip <stage>` to run some of the stages, with packaging
+falling back to the saved results of the others, and `--sem <sem_type>` to handle
+only one term. The scraper modules are imported when their stages start, so for
+example `--only package` doesn't import BeautifulSoup; the time spent importing
+them is printed at the end.
+
+Pass `--record <dir>` to save every response downloaded by the scrapers, and
+`--replay <dir>` to run them offline from those responses, see scrapers/fetch.py.
+So that replays are repeatable and leave the live files alone, a replay implies
+`--no-page-cache` (every catalog page is parsed from its response) and
+`--no-checkpoints`, and publishes to a new temporary directory instead of public/,
+along with its manifest and metrics. Pass `--output <dir>` to choose the directory.
+
+Pass `--profile` or `--trace-memory` to write a CPU or memory profile of each stage,
+see scrapers/profiling.py.
+
+Every run also writes a JSON manifest and a Prometheus textfile describing it, for
+monitoring; pass `--manifest <path>` or `--metrics <path>` to write them elsewhere,
+see scrapers/metrics.py.
+
+Only one run happens at a time: a run started while another is in progress exits
+straight away, and the one in progress runs once more when it finishes, see
+scrapers/runlock.py.
+
 Functions:
+* get_stages(shard, sems, page_cache)
 * run()
 """
 
-from .catalog import run as catalog_run
-from .cim import run as cim_run
-from .fireroad import run as fireroad_run
-from .locations import run as locations_run
-from .package import run as package_run
-from .pe import run as pe_run
+from __future__ import annotations
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Sequence
+from types import ModuleType
+from typing import Any
+
+from .fetch import evict_cache, set_fixtures
+from .metrics import MANIFEST_PATH, METRICS_PATH, record_stages, write_run_files
+from .pipeline import (
+    Stage,
+    print_timings,
+    run_stages,
+    select_stages,
+    set_checkpoints,
+    wait_for_checkpoints,
+)
+from .profiling import print_profile_summary, set_profiling
+from .runlock import acquire_run_lock, release_run_lock
+from .utils import SEM_TYPES
+
+# Set for the run started by release_run_lock() asking for a follow-up
+_FOLLOW_UP_VAR = "SCRAPERS_FOLLOW_UP"
+
+# How long it took to import each scraper module, in seconds
+_import_times: dict[str, float] = {}
+
+
+def _import(module: str) -> ModuleType:
+    """
+    Imports a scraper module, timing it the first time.
+
+    Args:
+        module (str): The name of the module, like "catalog"
+
+    Returns:
+        ModuleType: The module
+    """
+    start = time.perf_counter()
+    imported = importlib.import_module(f".{module}", __package__)
+    _import_times.setdefault(module, time.perf_counter() - start)
+    return imported
+
+
+def _lazy(module: str) -> Callable[..., Any]:
+    """
+    Gets the run() function of a scraper module, without importing the module
+    until it is called. That way, only the stages that run pay for the modules they
+    need, like BeautifulSoup for the catalog.
+
+    Args:
+        module (str): The name of the module, like "catalog"
+
+    Returns:
+        Callable[..., Any]: A function that imports the module and calls its run()
+    """
+
+    def run_module(*args: Any, **kwargs: Any) -> Any:
+        return _import(module).run(*args, **kwargs)
+
+    return run_module
+
+
+def get_stages(
+    shard: bool = False, sems: Sequence[str] = SEM_TYPES, page_cache: bool = True
+) -> tuple[Stage, ...]:
+    """
+    Lists the stages of the pipeline.
+
+    Args:
+        shard (bool): Whether packaging also writes the sharded layout
+        sems (Sequence[str]): The sem_types to scrape from Fireroad and package
+        page_cache (bool): Whether the catalog reuses the pages of earlier runs
+
+    Returns:
+        tuple[Stage, ...]: The stages, in the order they run with `--serial`
+    """
+    return (
+        # Parses all terms in a single pass over the Fireroad data
+        Stage(
+            "fireroad",
+            f"Update fireroad data ({', '.join(sems)})",
+            lambda: _lazy("fireroad")(*sems),
+        ),
+        Stage(
+            "catalog",
+            "Update catalog data",
+            lambda: _lazy("catalog")(use_page_cache=page_cache),
+        ),
+        Stage("cim", "Update CI-M data", _lazy("cim")),
+        Stage("locations", "Update locations data", _lazy("locations")),
+        Stage("pe", "Update PE data", _lazy("pe")),
+        Stage(
+            "package",
+            "Packaging",
+            lambda **results: _lazy("package")(shard=shard, sems=sems, **results),
+            ("fireroad", "catalog", "cim", "locations", "pe"),
+        ),
+    )
 
 
 def run():
     """
-    This function is the entry point. There are no arguments.
-    """
-    print("=== Update fireroad data (pre-semester) ===")
-    fireroad_run("presem")
-    print("=== Update fireroad data (semester) ===")
-    fireroad_run("sem")
-    print("=== Update catalog data ===")
-    catalog_run()
-    print("=== Update CI-M data ===")
-    cim_run()
-    print("=== Update locations data ===")
-    locations_run()
-    print("=== Update PE data ===")
-    pe_run()
-    print("=== Packaging ===")
-    package_run()
+    This function is the entry point. Run with `--help` for the options.
+    """
+    stage_names = [stage.name for stage in get_stages()]
+    parser = argparse.ArgumentParser(prog="python3 -m scrapers")
+    parser.add_argument(
+        "--serial",
+        action="store_true",
+        help="run the stages one at a time, in the original order",
+    )
+    parser.add_argument(
+        "--shard",
+        action="store_true",
+        help="also write each term as an index and one file per course",
+    )
+    parser.add_argument(
+        "--no-checkpoints",
+        action="store_true",
+        help="don't save the results of the scrapers for later runs (implied by "
+        "--replay)",
+    )
+    parser.add_argument(
+        "--no-page-cache",
+        action="store_true",
+        help="parse every catalog page again, and don't save them for later runs "
+        "(implied by --replay)",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="DIR",
+        help="publish the terms to DIR instead of public/ (with --replay, to a new "
+        "temporary directory by default)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="repackage the last results whenever an override file changes",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        choices=stage_names,
+        help="run only this stage (can be repeated); the others' last results are "
+        "used instead",
+    )
+    parser.add_argument(
+        "--skip",
+        action="append",
+        choices=stage_names,
+        default=[],
+        help="don't run this stage (can be repeated)",
+    )
+    parser.add_argument(
+        "--sem",
+        action="append",
+        choices=SEM_TYPES,
+        help="scrape and package only this sem_type (can be repeated)",
+    )
+    fixtures = parser.add_mutually_exclusive_group()
+    fixtures.add_argument(
+        "--record",
+        metavar="DIR",
+        help="save every downloaded response to a fixture directory",
+    )
+    fixtures.add_argument(
+        "--replay",
+        metavar="DIR",
+        help="use the responses in a fixture directory instead of the network",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile each stage with cProfile (implies --serial)",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="report the memory allocated by each stage (implies --serial)",
+    )
+    parser.add_argument(
+        "--manifest",
+        metavar="PATH",
+        help="where to write the JSON manifest of the run",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="where to write the metrics of the run, in the Prometheus text format",
+    )
+    args = parser.parse_args()
+
+    if args.watch:
+        _import("watch").watch(shard=args.shard)
+        return
+
+    follow_up = os.environ.pop(_FOLLOW_UP_VAR, "") == "1"
+    lock = acquire_run_lock(follow_up=follow_up)
+    if lock is None and follow_up:
+        print("Another run started since this one was asked for, so it isn't needed")
+        return
+    if lock is None:
+        print("Another run is in progress; it will run again once it finishes")
+        return
+    try:
+        _run_pipeline(args)
+    finally:
+        asked_again = release_run_lock(lock)
+    if asked_again:
+        print("=== Running again, as asked during this run ===", flush=True)
+        # A new process, so that nothing is left over from this run
+        os.execve(
+            sys.executable,
+            [sys.executable, "-m", __package__, *sys.argv[1:]],
+            {**os.environ, _FOLLOW_UP_VAR: "1"},
+        )
+
+
+def _run_pipeline(args: argparse.Namespace) -> None:
+    """
+    Runs the stages of the pipeline once.
+
+    Args:
+        args (argparse.Namespace): The command-line arguments
+    """
+    sems = [sem for sem in SEM_TYPES if args.sem is None or sem in args.sem]
+    page_cache, checkpoints = not args.no_page_cache, not args.no_checkpoints
+    manifest_path, metrics_path = MANIFEST_PATH, METRICS_PATH
+    output = args.output
+    if args.record:
+        set_fixtures("record", args.record)
+    elif args.replay:
+        set_fixtures("replay", args.replay)
+        # Nothing from earlier runs is reused, and nothing live is replaced
+        page_cache = checkpoints = False
+        if output is None:
+            output = tempfile.mkdtemp(prefix="hydrant-replay-")
+        manifest_path = os.path.join(output, os.path.basename(MANIFEST_PATH))
+        metrics_path = os.path.join(output, os.path.basename(METRICS_PATH))
+    if output is not None:
+        _import("package").set_output_dir(output)
+        print(f"Publishing to {output}")
+    stages = select_stages(
+        get_stages(args.shard, sems, page_cache), args.only, args.skip
+    )
+    set_checkpoints(checkpoints)
+    # Profiles of stages running at the same time would get mixed up
+    profiling = set_profiling(args.profile, args.trace_memory)
+    started = time.time()
+    try:
+        timings = run_stages(
+            record_stages(stages), serial=args.serial or bool(profiling)
+        )
+    finally:
+        wait_for_checkpoints()
+        print_profile_summary()
+        write_run_files(
+            started, args.manifest or manifest_path, args.metrics or metrics_path
+        )
+    print_timings(timings)
+    if _import_times:
+        print(
+            f"Imports: {sum(_import_times.values()):.2f} s ("
+            + ", ".join(f"{name} {secs:.2f} s" for name, secs in _import_times.items())
+            + ")"
+        )
+    if "fireroad" in timings:
+        hits, misses = _import("fireroad").section_cache_info()
+        print(f"Section parser cache: {hits} hits, {misses} misses")
+    evict_cache()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,582 @@
+"""
+Benchmarks the parsers of the scrapers, offline. Run `python3 -m scrapers.bench`.
+
+Each benchmark runs one parser over a list of inputs, scaled up 1x, 10x and 100x by
+repeating them, and reports how many inputs it handles per second and the peak
+memory it allocates. The inputs are recorded real-world ones where we have them:
+the PE CSV files in pe/, the results saved by the last scrape, and, with
+`--fixtures <dir>`, the responses recorded with `python3 -m scrapers --record <dir>`
+(see fetch.py). Otherwise, they are small synthetic ones.
+
+The results are saved as JSON (to `.cache/benchmarks.json` by default), and
+`--compare <old.json>` prints how each benchmark changed since an older run, so that
+a change to a parser can be reviewed with its numbers.
+
+Constants:
+    RESULTS_PATH: str
+
+Classes:
+    Benchmark
+    BenchmarkResult
+
+Functions:
+    get_benchmarks()
+    run_benchmarks(names, scales, repeat, fixtures)
+    compare_results(old, new)
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import contextlib
+import io
+import os
+import os.path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Iterable, Sequence
+from glob import glob
+from typing import Any, NamedTuple, Optional, TypedDict
+
+from bs4 import BeautifulSoup
+
+from . import catalog, cim, fireroad, jsonio, locations, package, pe
+from .fetch import FIXTURE_MANIFEST, record_fixture, set_fixtures
+from .utils import Term, read_csv
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), ".cache", "benchmarks.json")
+
+_SCHEDULES = (
+    "Lecture,32-123/TR/0/11/F/0/2;Recitation,2-147/MW/0/10,2-142/MW/0/11",
+    "Lecture,10-250/MWF/0/10;Lab,38-530/T/0/1-4",
+    "Lecture,4-370/TR/1/7-9 PM",
+    "Lecture,26-100/MW/0/2.30-4",
+    "Lecture,E25-111/TR/0/9.30-11;Recitation,4-149/F/0/10,4-149/F/0/11",
+    "Lecture,1-190/MWF/0/1;Design,N52-399/W/1/7-10 PM",
+)
+
+
+class Benchmark(NamedTuple):
+    """
+    A parser to benchmark.
+
+    Attributes:
+        name (str): The function that is benchmarked
+        load (Callable[[Optional[str]], tuple[list[Any], str]]): Gets the inputs,
+            given the fixture directory, if any; returns them and "recorded" or
+            "synthetic"
+        run (Callable[[list[Any]], Any]): Runs the parser over a list of inputs
+    """
+
+    name: str
+    load: Callable[[Optional[str]], tuple[list[Any], str]]
+    run: Callable[[list[Any]], Any]
+
+
+class BenchmarkResult(TypedDict):
+    """
+    The result of a benchmark at one scale.
+
+    Attributes:
+        name (str): The function that was benchmarked
+        input (str): "recorded" or "synthetic"
+        scale (int): How many times the inputs were repeated
+        items (int): The number of inputs
+        seconds (float): The best time to handle all of them
+        opsPerSec (float): Inputs handled per second
+        peakBytes (int): The most memory allocated at once while handling them
+    """
+
+    name: str
+    input: str
+    scale: int
+    items: int
+    seconds: float
+    opsPerSec: float
+    peakBytes: int
+
+
+@contextlib.contextmanager
+def _replaying(fixtures: Optional[str]):
+    """
+    Replays the responses in a fixture directory for the duration of a block.
+
+    Args:
+        fixtures (Optional[str]): The fixture directory, or None to do nothing
+    """
+    if fixtures is None:
+        yield
+        return
+    set_fixtures("replay", fixtures)
+    try:
+        yield
+    finally:
+        set_fixtures(None)
+
+
+def _recorded_urls(fixtures: Optional[str]) -> list[str]:
+    """
+    Lists the URLs recorded in a fixture directory.
+
+    Args:
+        fixtures (Optional[str]): The fixture directory, if any
+
+    Returns:
+        list[str]: The URLs, or nothing if there is no directory
+    """
+    if fixtures is None:
+        return []
+    manifest = jsonio.load(os.path.join(fixtures, FIXTURE_MANIFEST))
+    return sorted(manifest["responses"])
+
+
+def _synthetic_fixtures(bodies: dict[str, bytes]) -> str:
+    """
+    Records made-up responses to a temporary fixture directory, which is removed
+    when the process exits.
+
+    Args:
+        bodies (dict[str, bytes]): The body of each URL
+
+    Returns:
+        str: The fixture directory
+    """
+    directory = tempfile.mkdtemp(prefix="hydrant-bench-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    set_fixtures("record", directory)
+    try:
+        for url, body in bodies.items():
+            record_fixture(url, body)
+    finally:
+        set_fixtures(None)
+    return directory
+
+
+def _load_fireroad_courses(fixtures: Optional[str]) -> tuple[list[Any], str]:
+    """
+    Gets the courses of the Fireroad API.
+
+    Args:
+        fixtures (Optional[str]): The fixture directory, if any
+
+    Returns:
+        tuple[list[Any], str]: The courses, and where they came from
+    """
+    if fireroad.URL in _recorded_urls(fixtures):
+        with _replaying(fixtures):
+            return list(fireroad.iter_raw_data()), "recorded"
+    courses = []
+    for i in range(200):
+        course = {
+            "subject_id": f"{6 + i % 20}.{100 + i}",
+            "title": f"Synthetic Subject {i}",
+            "description": "Covers the fundamentals. " * 10,
+            "offered_fall": True,
+            "offered_IAP": False,
+            "offered_spring": i % 2 == 0,
+            "offered_summer": False,
+            "schedule": _SCHEDULES[i % len(_SCHEDULES)],
+            "lecture_units": 3,
+            "lab_units": 0,
+            "preparation_units": 9,
+            "level": "U",
+            "is_variable_units": False,
+            "instructors": ["A. Lecturer", "B. Lecturer"],
+            "prerequisites": "GIR:PHY1, 18.03",
+            "rating": 5.5,
+            "in_class_hours": 4.0,
+            "out_of_class_hours": 7.5,
+            "enrollment_number": 100,
+        }
+        # Like in Fireroad, most courses don't have these
+        if i % 5 == 0:
+            course["hass_attribute"] = "HASS-S"
+        if i % 7 == 0:
+            course["communication_requirement"] = "CI-H"
+        if i % 3 == 0:
+            course["gir_attribute"] = "REST"
+        courses.append(course)
+    return courses, "synthetic"
+
+
+def _load_schedules(fixtures: Optional[str]) -> tuple[list[Any], str]:
+    """
+    Gets the schedule strings of the Fireroad API.
+
+    Args:
+        fixtures (Optional[str]): The fixture directory, if any
+
+    Returns:
+        tuple[list[Any], str]: The schedules, and where they came from
+    """
+    courses, source = _load_fireroad_courses(fixtures)
+    return [course["schedule"] for course in courses if course.get("schedule")], source
+
+
+def _run_get_course_data(courses: list[Any]) -> None:
+    """
+    Parses courses from the Fireroad API for the fall term.
+
+    Args:
+        courses (list[Any]): The courses
+    """
+    out: dict[str, Any] = {}
+    for course in courses:
+        fireroad.get_course_data(out, course, Term.FA)
+
+
+def _load_catalog_pages(fixtures: Optional[str]) -> tuple[list[Any], str]:
+    """
+    Gets the catalog pages, as a fixture directory to replay them from and their
+    hrefs. Without recorded pages, synthetic ones are written to a temporary
+    directory.
+
+    Args:
+        fixtures (Optional[str]): The fixture directory, if any
+
+    Returns:
+        tuple[list[Any], str]: A (fixture directory, href) pair for each page, and
+        where they came from
+    """
+    prefix = f"{catalog.BASE_URL}/m"
+    hrefs = [
+        url[len(catalog.BASE_URL) + 1 :]
+        for url in _recorded_urls(fixtures)
+        if url.startswith(prefix)
+    ]
+    if fixtures is not None and hrefs:
+        return [(fixtures, href) for href in hrefs], "recorded"
+
+    bodies = {}
+    for page in range(5):
+        blocks = "".join(
+            f'<a name="6.{page}{i:02}"></a><p><b>6.{page}{i:02} Subject {i}</b>'
+            '<br><img src="/icns/fall.gif"><img src="/icns/under.gif">'
+            "<br>Prereq: 6.100A<br>Units: 3-0-9<br>Lecture: <i>TR11-12.30</i>"
+            "<br>Enrollment limited; preference to majors.</p>"
+            for i in range(40)
+        )
+        bodies[f"{prefix}{page}.html"] = (
+            '<html><body><table width="100%" border="0"><tr><td>'
+            f"{blocks}</td></tr></table></body></html>"
+        ).encode("utf-8")
+    directory = _synthetic_fixtures(bodies)
+    return [(directory, f"m{page}.html") for page in range(5)], "synthetic"
+
+
+def _run_scrape_courses_from_page(pages: list[Any]) -> None:
+    """
+    Scrapes catalog pages, replaying them from their fixture directory.
+
+    Args:
+        pages (list[Any]): The (fixture directory, href) pair of each page
+    """
+    courses: dict[str, Any] = {}
+    with _replaying(pages[0][0]), contextlib.redirect_stdout(io.StringIO()):
+        for _, href in pages:
+            catalog.scrape_courses_from_page(courses, href)
+
+
+def _load_cim_sections(fixtures: Optional[str]) -> tuple[list[Any], str]:
+    """
+    Gets the sections of the CI-M page.
+
+    Args:
+        fixtures (Optional[str]): The fixture directory, if any
+
+    Returns:
+        tuple[list[Any], str]: The sections, and where they came from
+    """
+    if cim.CIM_URL in _recorded_urls(fixtures):
+        with _replaying(fixtures):
+            return list(cim.get_sections()), "recorded"
+    html = "".join(
+        f"<div data-accordion-item><div class='ci-m__section'>"
+        f"<div class='ci-m__section-title'>Course {course}*</div>"
+        + "".join(
+            f"<span class='ci-m__subject-number'>{course}.{i:03}</span>"
+            for i in range(20)
+        )
+        + "</div></div>"
+        for course in range(1, 25)
+    )
+    soup = BeautifulSoup(html, "html.parser")
+    return soup.select("[data-accordion-item]"), "synthetic"
+
+
+def _load_pe_rows(fixtures: Optional[str]) -> tuple[list[Any], str]:
+    """
+    Gets the rows of the PE CSV files in pe/. The PE&W catalog, which the parser
+    looks descriptions up in, is loaded here, from the fixtures if it was recorded
+    and as an empty page otherwise.
+
+    Args:
+        fixtures (Optional[str]): The fixture directory, if any
+
+    Returns:
+        tuple[list[Any], str]: The rows, and where they came from
+    """
+    if pe.PE_CATALOG not in _recorded_urls(fixtures):
+        fixtures = _synthetic_fixtures({pe.PE_CATALOG: b"<html></html>"})
+    pe.get_pe_catalog_descriptions.cache_clear()
+    with _replaying(fixtures):
+        pe.get_pe_catalog_descriptions()
+
+    rows = []
+    for path in sorted(glob(os.path.join(os.path.dirname(__file__), "pe", "*.csv"))):
+        rows.extend(read_csv(path, pe.PEWFile))
+    return rows, "recorded"
+
+
+def _load_access_points(fixtures: Optional[str]) -> tuple[list[Any], str]:
+    """
+    Gets the access points of the locations data.
+
+    Args:
+        fixtures (Optional[str]): The fixture directory, if any
+
+    Returns:
+        tuple[list[Any], str]: The access points, and where they came from
+    """
+    if locations.LOCATIONS_URL in _recorded_urls(fixtures):
+        with _replaying(fixtures):
+            return list(locations.get_raw_data()), "recorded"
+    rows = [
+        {"FACILITY": str(i % 40), "x": str(-71.09 + i * 1e-5), "y": str(42.36)}
+        for i in range(400)
+    ]
+    return rows, "synthetic"
+
+
+def _load_merge_pairs(_: Optional[str]) -> tuple[list[Any], str]:
+    """
+    Gets pairs of Fireroad and catalog records to merge, from the results saved by
+    the last scrape if there are any.
+
+    Returns:
+        tuple[list[Any], str]: The pairs, and where they came from
+    """
+    try:
+        fireroad_sem = package.load_json_data("fireroad-sem.json")
+        catalog_data = package.load_json_data("catalog.json")
+    except (OSError, ValueError):
+        record = {"number": "6.100", "name": "Subject", "lectureUnits": 3}
+        return [(record, {"url": "", "final": True})] * 500, "synthetic"
+    pairs = [
+        (item, catalog_data[number])
+        for number, item in fireroad_sem.items()
+        if number in catalog_data
+    ]
+    return pairs, "recorded"
+
+
+def _run_merge_data(pairs: list[Any]) -> None:
+    """
+    Merges pairs of records, each under its own key.
+
+    Args:
+        pairs (list[Any]): The pairs of records
+    """
+    first = {str(i): pair[0] for i, pair in enumerate(pairs)}
+    second = {str(i): pair[1] for i, pair in enumerate(pairs)}
+    package.merge_data([first, second], first.keys())
+
+
+def get_benchmarks() -> list[Benchmark]:
+    """
+    Lists the benchmarks.
+
+    Returns:
+        list[Benchmark]: The benchmarks
+    """
+    return [
+        Benchmark(
+            "fireroad.get_course_data", _load_fireroad_courses, _run_get_course_data
+        ),
+        Benchmark(
+            "fireroad.parse_schedule",
+            _load_schedules,
+            lambda schedules: [fireroad.parse_schedule(s) for s in schedules],
+        ),
+        Benchmark(
+            "catalog.scrape_courses_from_page",
+            _load_catalog_pages,
+            _run_scrape_courses_from_page,
+        ),
+        Benchmark(
+            "cim.get_courses",
+            _load_cim_sections,
+            lambda sections: [cim.get_courses(section) for section in sections],
+        ),
+        Benchmark("pe.pe_rows_to_schema", _load_pe_rows, pe.pe_rows_to_schema),
+        Benchmark(
+            "locations.convert_data", _load_access_points, locations.convert_data
+        ),
+        Benchmark("package.merge_data", _load_merge_pairs, _run_merge_data),
+    ]
+
+
+def _reset_caches() -> None:
+    """
+    Clears the memoized parsers, so that every run starts cold.
+    """
+    # pylint: disable-next=protected-access
+    fireroad._parse_section_cached.cache_clear()
+    fireroad.parse_timeslot.cache_clear()
+
+
+def run_benchmarks(
+    names: Optional[Iterable[str]] = None,
+    scales: Sequence[int] = (1, 10, 100),
+    repeat: int = 3,
+    fixtures: Optional[str] = None,
+) -> list[BenchmarkResult]:
+    """
+    Runs the benchmarks.
+
+    >>> results = run_benchmarks(scales=(1,), repeat=1)
+    >>> [result["name"] for result in results]  # doctest: +NORMALIZE_WHITESPACE
+    ['fireroad.get_course_data', 'fireroad.parse_schedule',
+     'catalog.scrape_courses_from_page', 'cim.get_courses', 'pe.pe_rows_to_schema',
+     'locations.convert_data', 'package.merge_data']
+    >>> all(result["opsPerSec"] > 0 for result in results)
+    True
+
+    Args:
+        names (Optional[Iterable[str]]): The benchmarks to run, or None for all
+        scales (Sequence[int]): How many times to repeat the inputs
+        repeat (int): How many times to time each run; the best time is kept
+        fixtures (Optional[str]): The fixture directory of recorded responses
+
+    Returns:
+        list[BenchmarkResult]: The result of each benchmark at each scale
+    """
+    benchmarks = get_benchmarks()
+    if names is not None:
+        names = set(names)
+        benchmarks = [bench for bench in benchmarks if bench.name in names]
+
+    results: list[BenchmarkResult] = []
+    for bench in benchmarks:
+        with contextlib.redirect_stdout(io.StringIO()):
+            base, source = bench.load(fixtures)
+        for scale in scales:
+            items = base * scale
+            times = []
+            for _ in range(repeat):
+                _reset_caches()
+                start = time.perf_counter()
+                bench.run(items)
+                times.append(time.perf_counter() - start)
+
+            _reset_caches()
+            tracemalloc.start()
+            try:
+                bench.run(items)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            seconds = min(times)
+            results.append(
+                {
+                    "name": bench.name,
+                    "input": source,
+                    "scale": scale,
+                    "items": len(items),
+                    "seconds": seconds,
+                    "opsPerSec": len(items) / seconds if seconds else float("inf"),
+                    "peakBytes": peak,
+                }
+            )
+    return results
+
+
+def compare_results(
+    old: Iterable[BenchmarkResult], new: Iterable[BenchmarkResult]
+) -> list[str]:
+    """
+    Describes how the throughput of each benchmark changed between two runs.
+
+    >>> old = [{"name": "a", "scale": 1, "opsPerSec": 100.0, "peakBytes": 10}]
+    >>> new = [{"name": "a", "scale": 1, "opsPerSec": 150.0, "peakBytes": 20}]
+    >>> compare_results(old, new)
+    ['a x1: 1.50x ops/sec, 2.00x peak memory']
+
+    Args:
+        old (Iterable[BenchmarkResult]): The results of the older run
+        new (Iterable[BenchmarkResult]): The results of the newer run
+
+    Returns:
+        list[str]: A line for each benchmark and scale that is in both runs
+    """
+    old_by_key = {(result["name"], result["scale"]): result for result in old}
+    lines = []
+    for result in new:
+        before = old_by_key.get((result["name"], result["scale"]))
+        if before is None or not before["opsPerSec"] or not before["peakBytes"]:
+            continue
+        lines.append(
+            f"{result['name']} x{result['scale']}: "
+            f"{result['opsPerSec'] / before['opsPerSec']:.2f}x ops/sec, "
+            f"{result['peakBytes'] / before['peakBytes']:.2f}x peak memory"
+        )
+    return lines
+
+
+def _main() -> None:
+    """
+    Runs the benchmarks from the command line, and saves their results.
+    """
+    names = [bench.name for bench in get_benchmarks()]
+    parser = argparse.ArgumentParser(prog="python3 -m scrapers.bench")
+    parser.add_argument("names", nargs="*", help=f"any of {', '.join(names)}")
+    parser.add_argument(
+        "--scales", default="1,10,100", help="comma-separated input scales"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="timings per run")
+    parser.add_argument("--fixtures", help="a directory of recorded responses")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to save")
+    parser.add_argument("--compare", help="an older output to compare with")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(names)
+    if unknown:
+        parser.error(f"unknown benchmarks {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(
+        args.names or None,
+        [int(scale) for scale in args.scales.split(",")],
+        args.repeat,
+        args.fixtures,
+    )
+    for result in results:
+        print(
+            f"{result['name']:34} {result['input']:9} x{result['scale']:<4}"
+            f"{result['items']:>8} items {result['opsPerSec']:>12,.0f} ops/sec"
+            f"{result['peakBytes'] / 2**20:>9.1f} MiB peak"
+        )
+    if args.compare:
+        print(f"Compared with {args.compare}:")
+        for line in compare_results(jsonio.load(args.compare)["results"], results):
+            print(f"  {line}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    jsonio.dump(
+        {
+            "python": platform.python_version(),
+            "platform": sys.platform,
+            "date": time.strftime("%Y-%m-%d %H:%M"),
+            "results": results,
+        },
+        args.output,
+    )
+    print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -15,43 +15,104 @@ run() scrapes this data and writes it to catalog.json, in the format:
         }
     }
 
+Each page is scraped on its own: the results of the last successful scrape of every
+page are kept in PAGE_CACHE, which is saved every PAGE_CHECKPOINT_INTERVAL seconds
+during the crawl. A page that fails keeps its records from there, and is reported
+as stale, with how long ago it was last scraped. The cache also records whether the
+crawl that saved it got through every page. Only if it didn't, for example because
+the run crashed, does the next run skip the pages scraped in the last PAGE_MAX_AGE
+seconds; any other run downloads every page. The cache is
+thrown away whenever the parser changes, see PARSER_VERSION. Replays of recorded
+responses leave it out, so that every page is parsed from its response.
+
 Constants:
     BASE_URL: str
+    PAGE_CACHE: str
+    PARSER_VERSION: int
+    PAGE_MAX_AGE: float
+    PAGE_CHECKPOINT_INTERVAL: float
+    CRAWL_WORKERS: int
     LIMITED_REGEX: re.Pattern[str]
+    URL_REGEX: re.Pattern[str]
+    NOT_OFFERED_REGEX: re.Pattern[str]
+    NEW_REGEX: re.Pattern[str]
+
+Classes:
+    CatalogPage
+    BlockFeatures
 
 Functions:
-    is_not_offered_this_year(html)
-    is_not_offered_next_year(html)
-    is_repeat_allowed(html)
-    get_url(html)
-    has_final(html)
-    get_half(html)
-    is_limited(html)
-    is_new(html)
-    get_course_data(filtered_html)
+    extract_features(content)
+    is_not_offered_this_year(features, course_nums)
+    is_not_offered_next_year(features)
+    is_repeat_allowed(features)
+    get_url(features)
+    has_final(features)
+    get_half(features)
+    is_limited(features)
+    is_new(features)
+    get_course_data(features)
+    get_parser_stamp()
+    crawl(func, items)
     get_home_catalog_links()
+    get_subpage_links(initial_href)
     get_all_catalog_links(initial_hrefs)
     get_anchors_with_classname(element)
     get_classes_content(html)
+    parse_courses_from_page(body)
+    get_page(href, cached)
+    refresh_page(href, cached, resume)
+    load_page_cache()
+    save_page_cache(pages, complete)
+    print_stale_pages(stale, missing)
     scrape_courses_from_page(courses, href)
-    run()
+    run(use_page_cache)
 """
 
 from __future__ import annotations
 
-import json
+import hashlib
 import os.path
 import re
 import socket
-from collections.abc import Iterable, Mapping, MutableMapping
+import time
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator, Mapping, MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, TypedDict, TypeVar
 from urllib.error import URLError
-from urllib.request import urlopen
 
 from bs4 import BeautifulSoup, Tag
 from bs4.element import NavigableString
 
+from . import jsonio
+from .fetch import fetch, write_atomic
+from .pipeline import checkpoint
+from .profiling import profiling_enabled
+
 BASE_URL = "http://student.mit.edu/catalog"
 
+# Where the hash and courses of each page from the last scrape are kept
+PAGE_CACHE = os.path.join(os.path.dirname(__file__), ".cache", "catalog-pages.json")
+
+# Bump this when a change to the code parsing catalog pages changes its results, so
+# that the cached pages are parsed again. Changes to the regexes below are noticed
+# without it, see get_parser_stamp().
+PARSER_VERSION = 1
+
+# After a crawl that didn't finish, pages scraped less than this many seconds ago
+# aren't downloaded again, so that running again only fetches what it missed
+PAGE_MAX_AGE = 30 * 60
+
+# How often to save the pages scraped so far during a crawl, in seconds
+PAGE_CHECKPOINT_INTERVAL = 10.0
+
+# How many catalog pages to download at once (see also fetch.MAX_CONNECTIONS_PER_HOST)
+CRAWL_WORKERS = 8
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+
 # various limited/restricted/etc enrollment phrases in course descriptions
 # PLEASE use regex101.com to test changes before pushing to production!!!
 # text_mining.py also helps by finding test sentences from our entire database
@@ -74,14 +135,88 @@ LIMITED_REGEX = re.compile(
 )
 
 
+URL_REGEX = re.compile("https?://(?!whereis)")
+NOT_OFFERED_REGEX = re.compile(
+    "not offered regularly; consult department", re.IGNORECASE
+)
+NEW_REGEX = re.compile(r"\(New\)|\.S")
+
+
+class CatalogPage(TypedDict):
+    """
+    The result of scraping a catalog page, kept so that the page doesn't need to be
+    parsed again until it changes, and so that its courses can still be used when it
+    fails to download.
+    """
+
+    hash: str
+    courses: dict[str, dict[str, bool | int | str]]
+    # When the page was last scraped successfully, as a Unix time
+    scraped: float
+
+
+class BlockFeatures(TypedDict):
+    """
+    Everything the flags of a class are computed from, collected in a single walk
+    over the nodes of its block of the catalog page.
+    """
+
+    srcs: set[str]
+    bold: set[str]
+    strings: list[str]
+    text: str
+
+
+def extract_features(content: Iterable[Tag | NavigableString]) -> BlockFeatures:
+    """
+    Walks the nodes of a class's block once, collecting the `src` of every tag, the
+    text of every <b> tag, and every string (including comments).
+
+    The strings are also joined with newlines into a single text. None of the
+    patterns we look for can match a newline, so a pattern matches the text if and
+    only if it matches one of the strings.
+
+    >>> html = BeautifulSoup('<img src="/icns/repeat.gif"><b>6.1:</b> x', "lxml")
+    >>> features = extract_features(html.body.contents)
+    >>> features["srcs"], features["bold"], features["text"]
+    ({'/icns/repeat.gif'}, {'6.1:'}, '6.1:\\n x')
+
+    Args:
+        content (Iterable[Tag | NavigableString]): the top-level nodes of the block
+
+    Returns:
+        BlockFeatures: the features of the block
+    """
+    srcs: set[str] = set()
+    bold: set[str] = set()
+    strings: list[str] = []
+
+    for element in content:
+        nodes = [element] if isinstance(element, NavigableString) else []
+        if isinstance(element, Tag):
+            nodes.append(element)
+            nodes.extend(element.descendants)
+        for node in nodes:
+            if isinstance(node, NavigableString):
+                strings.append(node)
+            elif isinstance(node, Tag):
+                src = node.get("src")
+                if isinstance(src, str):
+                    srcs.add(src)
+                if node.name == "b" and node.string is not None:
+                    bold.add(node.string)
+
+    return {"srcs": srcs, "bold": bold, "strings": strings, "text": "\n".join(strings)}
+
+
 def is_not_offered_this_year(
-    html: BeautifulSoup, course_nums: list[str]
+    features: BlockFeatures, course_nums: list[str]
 ) -> dict[str, bool]:
     """
     Checks if the class is not offered this year.
 
     Args:
-        html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
         course_nums (list[str]): the course numbers associated with the class
     Returns:
         dict[str, bool]: A dictionary mapping course numbers to
@@ -91,20 +226,16 @@ def is_not_offered_this_year(
     multi = len(course_nums) > 1
     results: dict[str, bool] = {}
 
-    icon_not_offered = html.find(None, attrs={"src": "/icns/nooffer.gif"})
-    not_offered_regularly = html.find(
-        string=re.compile("not offered regularly; consult department", re.IGNORECASE)
-    )
+    icon_not_offered = "/icns/nooffer.gif" in features["srcs"]
+    not_offered_regularly = NOT_OFFERED_REGEX.search(features["text"])
 
-    possible_not_offered = bool(icon_not_offered) or bool(not_offered_regularly)
+    possible_not_offered = icon_not_offered or bool(not_offered_regularly)
 
     for course_num in course_nums:
         if not multi:
             results[course_num] = possible_not_offered
         elif possible_not_offered:
-            schedule_info = bool(
-                html.find("b", string=f"{course_num}:")  # type: ignore
-            )
+            schedule_info = f"{course_num}:" in features["bold"]
             results[course_num] = not schedule_info
         else:
             results[course_num] = False
@@ -112,127 +243,169 @@ def is_not_offered_this_year(
     return results
 
 
-def is_not_offered_next_year(html: BeautifulSoup) -> bool:
+def is_not_offered_next_year(features: BlockFeatures) -> bool:
     """
     Checks if the class is not offered next year.
 
     Args:
-        html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
 
     Returns:
         bool: True if the class is not offered next year
     """
-    return bool(html.find(None, attrs={"src": "/icns/nonext.gif"}))
+    return "/icns/nonext.gif" in features["srcs"]
 
 
-def is_repeat_allowed(html: BeautifulSoup):
+def is_repeat_allowed(features: BlockFeatures) -> bool:
     """
     Checks if you're allowed to retake the class for credit.
 
     Args:
-        html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
 
     Returns:
         bool: Whether you're allowed to retake the class for credit
     """
-    return bool(html.find(None, attrs={"src": "/icns/repeat.gif"}))
+    return "/icns/repeat.gif" in features["srcs"]
 
 
-def get_url(html: BeautifulSoup) -> str:
+def get_url(features: BlockFeatures) -> str:
     """
-    Finds a URL on the webpage, if it exists.
+    Finds a URL in the class's block, if it exists.
 
     Args:
-        html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
 
     Returns:
-        str: Some URL on the webpage, or an empty string if there isn't one
+        str: The first string on the webpage containing a URL, or an empty string
+            if there isn't one
     """
-    url = html.find(string=re.compile("https?://(?!whereis)"))
-    if url:
-        return url.string
-    return ""
+    if not URL_REGEX.search(features["text"]):
+        return ""
+    return next(
+        str(string) for string in features["strings"] if URL_REGEX.search(string)
+    )
 
 
-def has_final(html: BeautifulSoup) -> bool:
+def has_final(features: BlockFeatures) -> bool:
     """
     Checks if the class has a final
 
     Args:
-        html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
 
     Returns:
         bool: Whether the class has a final
     """
-    return bool(html.find(string="+final"))
+    return "+final" in features["strings"]
 
 
-def get_half(html: BeautifulSoup) -> int | bool:
+def get_half(features: BlockFeatures) -> int | bool:
     """
     Checks if the class is a half-semester course.
 
     Args:
-        html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
 
     Returns:
         int | bool: 1 if the class is in the first half of the term,
             2 if the class is in the second half of the term, False if it is not a half
             semester course
     """
-    if html.find(string=re.compile("; first half of term")):
+    if "; first half of term" in features["text"]:
         return 1
-    if html.find(string=re.compile("; second half of term")):
+    if "; second half of term" in features["text"]:
         return 2
     return False
 
 
-def is_limited(html: BeautifulSoup) -> bool:
+def is_limited(features: BlockFeatures) -> bool:
     """
     Checks if enrollment in the class is limited.
 
     Args:
-        html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
 
     Returns:
         bool: True if enrollment in the class is limited
     """
-    return bool(html.find(string=LIMITED_REGEX))
+    return bool(LIMITED_REGEX.search(features["text"]))
 
 
-def is_new(html: BeautifulSoup) -> bool:
+def is_new(features: BlockFeatures) -> bool:
     """
     Checks if the subject is new.
 
     Args:
-        html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
 
     Returns:
         bool: True if the class is new
     """
-    return bool(html.find(string=re.compile(r"\(New\)|\.S")))
+    return bool(NEW_REGEX.search(features["text"]))
 
 
-def get_course_data(filtered_html: BeautifulSoup) -> dict[str, bool | int | str]:
+def get_course_data(features: BlockFeatures) -> dict[str, bool | int | str]:
     """
-    Gets the metadata about a class from the filtered HTML.
+    Gets the metadata about a class from the features of its block.
 
     Args:
-        filtered_html (BeautifulSoup): the input webpage
+        features (BlockFeatures): the features of the class's block
 
     Returns:
         dict[str, bool | int | str]: metadata about that particular class
     """
     return {
-        "nonext": is_not_offered_next_year(filtered_html),
-        "repeat": is_repeat_allowed(filtered_html),
-        "url": get_url(filtered_html),
-        "final": has_final(filtered_html),
-        "half": get_half(filtered_html),
-        "limited": is_limited(filtered_html),
-        "new": is_new(filtered_html),
+        "nonext": is_not_offered_next_year(features),
+        "repeat": is_repeat_allowed(features),
+        "url": get_url(features),
+        "final": has_final(features),
+        "half": get_half(features),
+        "limited": is_limited(features),
+        "new": is_new(features),
     }
 
 
+def get_parser_stamp() -> str:
+    """
+    Identifies the parser that the courses of each page in PAGE_CACHE came from,
+    so that they aren't reused once it changes.
+
+    Returns:
+        str: A hash of PARSER_VERSION and the regexes used to parse pages
+    """
+    patterns = [
+        regex.pattern
+        for regex in (LIMITED_REGEX, URL_REGEX, NOT_OFFERED_REGEX, NEW_REGEX)
+    ]
+    return hashlib.sha256(repr((PARSER_VERSION, patterns)).encode()).hexdigest()[:16]
+
+
+def crawl(func: Callable[[_T], _R], items: Iterable[_T]) -> Iterator[_R]:
+    """
+    Calls func on each item, CRAWL_WORKERS at a time, and yields the results in the
+    order of the items.
+
+    While profiling, the calls are made one at a time in the calling thread instead,
+    since cProfile only sees the thread that runs the stage.
+
+    >>> list(crawl(len, ["a", "bcd", ""]))
+    [1, 3, 0]
+
+    Args:
+        func (Callable[[_T], _R]): What to call on each item
+        items (Iterable[_T]): The items
+
+    Yields:
+        _R: What func returned for each item
+    """
+    if profiling_enabled():
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as executor:
+        yield from executor.map(func, items)
+
+
 def get_home_catalog_links() -> Iterable[str]:
     """
     Scrapes the home page of the catalog to get the
@@ -241,40 +414,51 @@ def get_home_catalog_links() -> Iterable[str]:
     Returns:
         Iterable[str]: relative links to major-specific subpages to scrape
     """
-    with urlopen(BASE_URL + "/index.cgi", timeout=3) as catalog_req:
-        html = BeautifulSoup(catalog_req.read(), "html.parser")
+    html = BeautifulSoup(fetch(BASE_URL + "/index.cgi", timeout=3), "html.parser")
     home_list = html.select_one("td[valign=top][align=left] > ul")
     assert home_list is not None
     return (str(a["href"]) for a in home_list.find_all("a", href=True))
 
 
-def get_all_catalog_links(initial_hrefs: Iterable[str]) -> list[str]:
+def get_subpage_links(initial_href: str) -> list[str]:
     """
-    Find all links from the headers before the subject listings
+    Find the links from the header of a single subpage, before the subject listings
 
     Args:
-        initial_hrefs (Iterable[str]): initial list of relative links to subpages
+        initial_href (str): relative link to the subpage
 
     Returns:
-        list[str]: A more complete list of relative links to subpages to scrape
+        list[str]: initial_href, followed by the relative links found on it
     """
-    hrefs: list[str] = []
-    for initial_href in initial_hrefs:
-        hrefs.append(initial_href)
-        with urlopen(f"{BASE_URL}/{initial_href}", timeout=10) as href_req:
-            html = BeautifulSoup(href_req.read(), "html.parser")
+    hrefs = [initial_href]
+    html = BeautifulSoup(fetch(f"{BASE_URL}/{initial_href}", timeout=10), "html.parser")
 
-        content_mini = html.find("div", id="contentmini")
-        if not content_mini:
-            continue
+    content_mini = html.find("div", id="contentmini")
+    if not content_mini:
+        return hrefs
 
-        # Links should be in the only table in the #contentmini div
-        tables = content_mini.find_all("table")
-        for table in tables:
-            hrefs.extend([str(ele["href"]) for ele in table.find_all("a", href=True)])
+    # Links should be in the only table in the #contentmini div
+    tables = content_mini.find_all("table")
+    for table in tables:
+        hrefs.extend([str(ele["href"]) for ele in table.find_all("a", href=True)])
     return hrefs
 
 
+def get_all_catalog_links(initial_hrefs: Iterable[str]) -> list[str]:
+    """
+    Find all links from the headers before the subject listings. The subpages are
+    downloaded concurrently, but the links are returned in the same order as if they
+    were downloaded one at a time.
+
+    Args:
+        initial_hrefs (Iterable[str]): initial list of relative links to subpages
+
+    Returns:
+        list[str]: A more complete list of relative links to subpages to scrape
+    """
+    return [href for hrefs in crawl(get_subpage_links, initial_hrefs) for href in hrefs]
+
+
 def get_anchors_with_classname(element: Tag | NavigableString) -> list[Tag] | None:
     """
     Returns the anchors with the class name if the element itself is one or
@@ -316,22 +500,19 @@ def get_classes_content(html: BeautifulSoup) -> Tag:
     return classes_content
 
 
-def scrape_courses_from_page(
-    courses: MutableMapping[str, Mapping[str, bool | int | str]], href: str
-) -> None:
+def parse_courses_from_page(body: bytes) -> dict[str, dict[str, bool | int | str]]:
     """
-    Fills courses with course data from the href
-
-    This function does NOT return a value. Instead, it modifies the `courses` variable.
+    Gets the course data from the contents of a catalog page
 
     Args:
-        courses (MutableMapping[str, Mapping[str, bool | int | str]]):
-            a dictionary to fill with course data
-        href (str): the relative link to the page to scrape
+        body (bytes): the HTML of the page
+
+    Returns:
+        dict[str, dict[str, bool | int | str]]: the data of each course on the page,
+            in the order they appear
     """
-    with urlopen(f"{BASE_URL}/{href}", timeout=10) as href_req:
-        # The "html.parser" parses pretty badly
-        html = BeautifulSoup(href_req.read(), "lxml")
+    # The "html.parser" parses pretty badly
+    html = BeautifulSoup(body, "lxml")
 
     classes_content = get_classes_content(html)
 
@@ -358,42 +539,231 @@ def scrape_courses_from_page(
             contents[-1].append(ele)
 
     assert len(course_nums_list) == len(contents)
+    courses: dict[str, dict[str, bool | int | str]] = {}
     for course_nums, content in zip(course_nums_list, contents):
-        filtered_html = BeautifulSoup()
-        filtered_html.extend(content)
+        features = extract_features(content)
 
         # see https://github.com/sipb/hydrant/issues/267
         for course_num, not_offered in is_not_offered_this_year(
-            filtered_html, course_nums
+            features, course_nums
         ).items():
             if not not_offered:
-                courses[course_num] = get_course_data(filtered_html)
+                courses[course_num] = get_course_data(features)
+    return courses
+
+
+def get_page(href: str, cached: CatalogPage | None = None) -> CatalogPage:
+    """
+    Downloads a catalog page and gets its course data. If the page is unchanged
+    since it was cached, the cached courses are reused, without parsing.
+
+    Args:
+        href (str): the relative link to the page to scrape
+        cached (CatalogPage | None): the result of the last scrape of this page
+
+    Raises:
+        URLError: If the page can't be downloaded, even from the HTTP cache
+        socket.timeout: If the download times out
+
+    Returns:
+        CatalogPage: the hash of the page and the data of its courses
+    """
+    # A page that fails keeps its cached courses, and is reported as stale by run()
+    body = fetch(f"{BASE_URL}/{href}", timeout=10, allow_stale=False)
+    digest = hashlib.sha256(body).hexdigest()
+    if cached is not None and cached["hash"] == digest:
+        return {**cached, "scraped": time.time()}
+
+    print(f"Scraping page: {href}")
+    return {
+        "hash": digest,
+        "courses": parse_courses_from_page(body),
+        "scraped": time.time(),
+    }
+
+
+def refresh_page(
+    href: str, cached: CatalogPage | None = None, resume: bool = False
+) -> tuple[CatalogPage | None, str]:
+    """
+    Brings a catalog page up to date, if it can be, without raising.
+
+    >>> recent: CatalogPage = {"hash": "", "courses": {}, "scraped": time.time()}
+    >>> refresh_page("m6a.html", recent, resume=True)[1]
+    'resumed'
+
+    Args:
+        href (str): the relative link to the page to scrape
+        cached (CatalogPage | None): the result of the last scrape of this page
+        resume (bool): whether this crawl resumes one that didn't finish, so that
+            a page scraped in the last PAGE_MAX_AGE seconds isn't downloaded again
+
+    Returns:
+        tuple[CatalogPage | None, str]: the page, and what happened to it:
+            "resumed" if it was scraped too recently to download again, "unchanged"
+            or "parsed" if it was downloaded, "stale" if it failed and the cached
+            page is returned, and "missing" if it failed and there is no cached page
+    """
+    if resume and cached is not None and time.time() - cached["scraped"] < PAGE_MAX_AGE:
+        return cached, "resumed"
+    try:
+        page = get_page(href, cached)
+    # A page whose layout changed fails an assertion in the parser
+    except (URLError, socket.timeout, AssertionError) as error:
+        print(f"Unable to scrape page {href}: {error!r}")
+        return cached, "missing" if cached is None else "stale"
+    unchanged = cached is not None and page["hash"] == cached["hash"]
+    return page, "unchanged" if unchanged else "parsed"
 
 
-def run() -> None:
+def load_page_cache() -> tuple[dict[str, CatalogPage], bool]:
+    """
+    Loads the results of the last scrape of each catalog page.
+
+    Returns:
+        tuple[dict[str, CatalogPage], bool]: the cached page for each href, which is
+            empty if there is no (valid) cache, or it was written by another
+            parser; and whether the crawl that saved them finished
+    """
+    try:
+        cache = jsonio.load(PAGE_CACHE)
+    except (OSError, ValueError):
+        return {}, True
+    if not isinstance(cache, dict) or cache.get("parser") != get_parser_stamp():
+        return {}, True
+    return cache["pages"], cache.get("complete", True)
+
+
+def save_page_cache(pages: dict[str, CatalogPage], complete: bool = True) -> None:
+    """
+    Saves the result of the scrape of each catalog page, for the next run.
+
+    Args:
+        pages (dict[str, CatalogPage]): the scraped page for each href
+        complete (bool): whether the crawl has finished, as opposed to being
+            saved along the way, in case it doesn't
+    """
+    cache = {"parser": get_parser_stamp(), "complete": complete, "pages": pages}
+    try:
+        write_atomic(PAGE_CACHE, jsonio.dumps(cache))
+    except OSError as error:
+        print(f"Unable to save catalog page cache: {error}")
+
+
+def scrape_courses_from_page(
+    courses: MutableMapping[str, Mapping[str, bool | int | str]], href: str
+) -> None:
+    """
+    Fills courses with course data from the href
+
+    This function does NOT return a value. Instead, it modifies the `courses` variable.
+
+    Args:
+        courses (MutableMapping[str, Mapping[str, bool | int | str]]):
+            a dictionary to fill with course data
+        href (str): the relative link to the page to scrape
+    """
+    courses.update(get_page(href)["courses"])
+
+
+def print_stale_pages(stale: Mapping[str, float], missing: Iterable[str]) -> None:
+    """
+    Reports the pages whose courses are out of date, because they failed to scrape.
+
+    >>> now = time.time()
+    >>> print_stale_pages({"m6a.html": now - 7200, "m18a.html": now - 90}, ["m2a.html"])
+    2 catalog pages are stale, 1 missing:
+      m6a.html: last scraped 2.0 h ago
+      m18a.html: last scraped 0.0 h ago
+      m2a.html: never scraped
+
+    Args:
+        stale (Mapping[str, float]): when each stale page was last scraped, as a
+            Unix time
+        missing (Iterable[str]): the pages that have never been scraped
+    """
+    missing = list(missing)
+    if not stale and not missing:
+        return
+    print(f"{len(stale)} catalog pages are stale, {len(missing)} missing:")
+    now = time.time()
+    for href, scraped in sorted(stale.items(), key=lambda item: item[1]):
+        print(f"  {href}: last scraped {(now - scraped) / 3600:.1f} h ago")
+    for href in missing:
+        print(f"  {href}: never scraped")
+
+
+def run(
+    use_page_cache: bool = True,
+) -> Optional[Mapping[str, Mapping[str, bool | int | str]]]:
     """
     The main function! This calls all the other functions in this file.
+
+    Args:
+        use_page_cache (bool): Whether to reuse the pages scraped by earlier runs,
+            and save this run's for later ones. Without it, every page is
+            downloaded and parsed, and PAGE_CACHE is left alone.
+
+    Returns:
+        Optional[Mapping[str, Mapping[str, bool | int | str]]]: The courses, or None
+        if the catalog couldn't be scraped
     """
     fname = os.path.join(os.path.dirname(__file__), "catalog.json")
 
+    page_cache, complete = load_page_cache() if use_page_cache else ({}, True)
     try:
-        home_hrefs = get_home_catalog_links()
-        all_hrefs = get_all_catalog_links(home_hrefs)
-        courses: MutableMapping[str, Mapping[str, bool | int | str]] = {}
-        for href in all_hrefs:
-            print(f"Scraping page: {href}")
-            scrape_courses_from_page(courses, href)
-    except (URLError, socket.timeout):
+        all_hrefs = get_all_catalog_links(get_home_catalog_links())
+    except (URLError, socket.timeout) as error:
+        all_hrefs = list(page_cache)
+        print(f"Unable to list catalog pages ({error!r}), rescraping the last ones")
+    if not all_hrefs:
         print("Unable to scrape course catalog data.")
         if not os.path.exists(fname):
-            with open(fname, "w", encoding="utf-8") as catalog_file:
-                json.dump({}, catalog_file)
-        return
+            write_atomic(fname, jsonio.dumps({}))
+        return None
 
-    print(f"Got {len(courses)} courses")
+    pages: dict[str, CatalogPage] = {}
+    outcomes: Counter[str] = Counter()
+    stale: dict[str, float] = {}
+    missing: list[str] = []
+    courses: MutableMapping[str, Mapping[str, bool | int | str]] = {}
+    last_saved = time.monotonic()
+    # Pages are scraped concurrently, but merged in order, so that later pages
+    # override earlier ones exactly as if they were scraped one at a time
+    for href, (page, outcome) in zip(
+        all_hrefs,
+        crawl(
+            lambda href: refresh_page(href, page_cache.get(href), not complete),
+            all_hrefs,
+        ),
+    ):
+        outcomes[outcome] += 1
+        if page is None:
+            missing.append(href)
+            continue
+        if outcome == "stale":
+            stale[href] = page["scraped"]
+        pages[href] = page
+        courses.update(page["courses"])
+        if use_page_cache and time.monotonic() - last_saved >= PAGE_CHECKPOINT_INTERVAL:
+            # Lets a run that follows a crash resume from here
+            save_page_cache({**page_cache, **pages}, complete=False)
+            last_saved = time.monotonic()
+
+    print(
+        f"Reparsed {outcomes['parsed']} pages, reused {outcomes['unchanged']} "
+        f"unchanged pages, skipped {outcomes['resumed']} recently scraped pages"
+    )
+    print_stale_pages(stale, missing)
+    if use_page_cache:
+        save_page_cache(pages)
+    if not courses:
+        print("Unable to scrape course catalog data.")
+        return None
 
-    with open(fname, "w", encoding="utf-8") as catalog_file:
-        json.dump(courses, catalog_file)
+    print(f"Got {len(courses)} courses")
+    checkpoint(courses, fname)
+    return courses
 
 
 if __name__ == "__main__":
@@ -23,15 +23,18 @@ Functions:
 
 from __future__ import annotations
 
-import json
 import os.path
 import socket
 from collections.abc import Iterable
+from typing import Optional
 from urllib.error import URLError
-from urllib.request import urlopen
 
 from bs4 import BeautifulSoup, Tag
 
+from . import jsonio
+from .fetch import fetch, write_atomic
+from .pipeline import checkpoint
+
 CIM_URL = (
     "https://registrar.mit.edu/registration-academics/"
     "academic-requirements/communication-requirement/ci-m-subjects/subject"
@@ -47,8 +50,7 @@ def get_sections() -> Iterable[Tag]:
             subjects
     """
     try:
-        with urlopen(CIM_URL, timeout=5) as cim_req:
-            soup = BeautifulSoup(cim_req.read().decode("utf-8"), "html.parser")
+        soup = BeautifulSoup(fetch(CIM_URL, timeout=5).decode("utf-8"), "html.parser")
     except (URLError, socket.timeout) as error:
         print(f"error in get_sections: {error}")
         raise
@@ -93,9 +95,13 @@ def get_courses(section: Tag) -> dict[str, set[str]]:
     return courses
 
 
-def run() -> None:
+def run() -> Optional[dict[str, dict[str, list[str]]]]:
     """
     The main entry point.
+
+    Returns:
+        Optional[dict[str, dict[str, list[str]]]]: The courses for which each subject
+        is a CI-M, or None if they couldn't be scraped
     """
 
     fname = os.path.join(os.path.dirname(__file__), "cim.json")
@@ -105,9 +111,8 @@ def run() -> None:
     except (URLError, socket.timeout) as e:
         print(f"Unable to scrape Registrar page for CI-M subjects: {e}")
         if not os.path.exists(fname):
-            with open(fname, "w", encoding="utf-8") as cim_file:
-                json.dump({}, cim_file)
-        return
+            write_atomic(fname, jsonio.dumps({}))
+        return None
 
     # This maps each course number to a set of CI-M subjects for that course
     courses: dict[str, set[str]] = {}
@@ -123,10 +128,10 @@ def run() -> None:
             for number in subj.replace("J", "").split("/"):
                 subjects.setdefault(number, {"cim": []})["cim"].append(course)
 
-    with open(fname, "w", encoding="utf-8") as cim_file:
-        json.dump(subjects, cim_file)
+    checkpoint(subjects, fname)
 
     print(f"Found {len(subjects)} CI-M subjects")
+    return subjects
 
 
 if __name__ == "__main__":
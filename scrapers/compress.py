@@ -0,0 +1,99 @@
+"""
+Writes precompressed copies of the term files in public/, so that the web server
+can send them as they are instead of compressing them on every request.
+
+Next to each term file, like `latest.json` or `f25.json`, we write `latest.json.gz`
+and, if the optional brotli package is installed, `latest.json.br`. The copies are
+given the same modification time as the file they were made from, and are only
+remade when that changes. MANIFEST lists the size of every file and its copies.
+
+Constants:
+    TERM_FILE_REGEX: re.Pattern
+    MANIFEST: str
+
+Functions:
+    compress_file(path)
+    compress_outputs(public_dir)
+"""
+
+from __future__ import annotations
+
+import gzip
+import os
+import os.path
+import re
+
+from . import jsonio
+from .fetch import write_atomic
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it we only write gzip copies
+    brotli = None  # pylint: disable=invalid-name
+
+TERM_FILE_REGEX = re.compile(r"^(latest|[fimsj]\d\d)\.json$")
+
+MANIFEST = "sizes.json"
+
+
+def compress_file(path: str) -> dict[str, int]:
+    """
+    Writes the compressed copies of a file, unless they are already up to date.
+
+    Args:
+        path (str): The file to compress
+
+    Returns:
+        dict[str, int]: The size in bytes of the file ("json") and of each of its
+        compressed copies ("gz", "br")
+    """
+    mtime = os.stat(path).st_mtime_ns
+    encoders = {"gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoders["br"] = lambda data: brotli.compress(data, quality=11)
+    elif os.path.exists(f"{path}.br"):
+        # Left over from a run with brotli, and would soon be out of date
+        os.remove(f"{path}.br")
+
+    data = None
+    sizes = {"json": os.path.getsize(path)}
+    for suffix, encode in encoders.items():
+        out_path = f"{path}.{suffix}"
+        if not os.path.exists(out_path) or os.stat(out_path).st_mtime_ns != mtime:
+            if data is None:
+                with open(path, "rb") as file:
+                    data = file.read()
+            write_atomic(out_path, encode(data))
+            os.utime(out_path, ns=(mtime, mtime))
+        sizes[suffix] = os.path.getsize(out_path)
+    return sizes
+
+
+def compress_outputs(public_dir: str) -> dict[str, dict[str, int]]:
+    """
+    Writes the compressed copies of every term file in public_dir, and the manifest
+    of their sizes.
+
+    Args:
+        public_dir (str): The directory that holds the term files
+
+    Returns:
+        dict[str, dict[str, int]]: The sizes of each term file and its copies, as
+        returned by compress_file, by file name
+    """
+    sizes = {
+        name: compress_file(os.path.join(public_dir, name))
+        for name in sorted(os.listdir(public_dir))
+        if TERM_FILE_REGEX.match(name)
+    }
+
+    manifest_path = os.path.join(public_dir, MANIFEST)
+    encoded = jsonio.dumps(sizes)
+    try:
+        with open(manifest_path, "rb") as manifest_file:
+            unchanged = manifest_file.read() == encoded
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        write_atomic(manifest_path, encoded)
+    return sizes
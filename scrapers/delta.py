@@ -0,0 +1,197 @@
+"""
+Computes deltas between versions of a term file, so that clients that already hold
+a recent version can update it without downloading the whole file again.
+
+The packager keeps the last MAX_DELTA_VERSIONS versions of each term in
+`.cache/versions/<urlName>/`, and next to each term file writes `<term>.delta.json`:
+
+    {
+        "version": "<current version>",
+        "lastUpdated": "...",
+        "deltas": {"<older version>": <delta>, ...}
+    }
+
+A delta, as returned by diff_payloads(), has:
+
+* "added": the full record of each new class, by number
+* "removed": the numbers of the classes that are gone
+* "changed": for each other class that changed, the fields to "set" (with their
+  new values) and the fields to "unset"
+* "replaced": the new value of each other top-level field (termInfo, pe,
+  locations) that changed
+
+Constants:
+    HISTORY_DIR: str
+    MAX_DELTA_VERSIONS: int
+
+Functions:
+    diff_payloads(old, new)
+    apply_delta(old, delta)
+    write_deltas(path, payload, version, now, history_dir)
+"""
+
+from __future__ import annotations
+
+import os
+import os.path
+from typing import Any
+
+from . import jsonio
+from .fetch import write_atomic
+
+HISTORY_DIR = os.path.join(os.path.dirname(__file__), ".cache", "versions")
+
+# A day of hourly updates
+MAX_DELTA_VERSIONS = 24
+
+
+def diff_payloads(old: dict[str, Any], new: dict[str, Any]) -> dict[str, Any]:
+    """
+    Computes the delta that turns one version of a term into another.
+
+    >>> old = {"classes": {"a": {"x": 1, "y": 2}, "b": {}}, "pe": {}}
+    >>> new = {"classes": {"a": {"x": 3}, "c": {"z": 4}}, "pe": {"1": {}}}
+    >>> diff_payloads(old, new)  # doctest: +NORMALIZE_WHITESPACE
+    {'added': {'c': {'z': 4}}, 'removed': ['b'],
+     'changed': {'a': {'set': {'x': 3}, 'unset': ['y']}}, 'replaced': {'pe': {'1': {}}}}
+
+    Args:
+        old (dict[str, Any]): The older version, with its classes under "classes"
+        new (dict[str, Any]): The newer version
+
+    Returns:
+        dict[str, Any]: The delta, in the format described above
+    """
+    old_classes, new_classes = old["classes"], new["classes"]
+    changed = {}
+    for number, item in new_classes.items():
+        old_item = old_classes.get(number)
+        if old_item is None or old_item == item:
+            continue
+        changed[number] = {
+            "set": {
+                key: value
+                for key, value in item.items()
+                if key not in old_item or old_item[key] != value
+            },
+            "unset": [key for key in old_item if key not in item],
+        }
+
+    return {
+        "added": {
+            number: item
+            for number, item in new_classes.items()
+            if number not in old_classes
+        },
+        "removed": [number for number in old_classes if number not in new_classes],
+        "changed": changed,
+        "replaced": {
+            key: value
+            for key, value in new.items()
+            if key != "classes" and old.get(key) != value
+        },
+    }
+
+
+def apply_delta(old: dict[str, Any], delta: dict[str, Any]) -> dict[str, Any]:
+    """
+    Applies a delta from diff_payloads(), which is what clients do.
+
+    >>> old = {"classes": {"a": {"x": 1, "y": 2}, "b": {}}, "pe": {}}
+    >>> new = {"classes": {"a": {"x": 3}, "c": {"z": 4}}, "pe": {"1": {}}}
+    >>> apply_delta(old, diff_payloads(old, new)) == new
+    True
+
+    Args:
+        old (dict[str, Any]): The older version, which is not modified
+        delta (dict[str, Any]): The delta from that version
+
+    Returns:
+        dict[str, Any]: The newer version
+    """
+    classes = {
+        number: item
+        for number, item in old["classes"].items()
+        if number not in delta["removed"]
+    }
+    for number, change in delta["changed"].items():
+        item = {**classes[number], **change["set"]}
+        for key in change["unset"]:
+            del item[key]
+        classes[number] = item
+    classes.update(delta["added"])
+    return {**old, **delta["replaced"], "classes": classes}
+
+
+def write_deltas(
+    path: str,
+    payload: dict[str, Any],
+    version: str,
+    now: str,
+    history_dir: str = HISTORY_DIR,
+) -> int:
+    """
+    Adds a version of a term to its history, and writes the deltas from each older
+    version in the history to `<term>.delta.json`. Versions beyond the most recent
+    MAX_DELTA_VERSIONS are forgotten.
+
+    The history is kept by the urlName of the term, not the name of the file, so
+    when latest.json moves on to a new term, the versions of the old one aren't
+    diffed against it. A delta that would be larger than the term file itself is
+    left out, since downloading the file is cheaper.
+
+    >>> import tempfile
+    >>> history, out = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> path = os.path.join(out, "latest.json")
+    >>> classes = {str(number): {"name": "x" * 10} for number in range(10)}
+    >>> f25 = {"termInfo": {"urlName": "f25"}, "classes": classes}
+    >>> write_deltas(path, f25, "a", "", history)
+    0
+    >>> write_deltas(path, {**f25, "pe": {}}, "b", "", history)
+    1
+    >>> s26 = {"termInfo": {"urlName": "s26"}, "classes": {}}
+    >>> write_deltas(path, s26, "c", "", history)
+    0
+
+    Args:
+        path (str): The term file, e.g. `public/latest.json`
+        payload (dict[str, Any]): The termInfo, classes, pe and locations of the term
+        version (str): The content version of the payload
+        now (str): The time of this update
+        history_dir (str): Where the older versions of every term are kept
+
+    Returns:
+        int: The number of deltas written
+    """
+    term = os.path.splitext(os.path.basename(path))[0]
+    term_dir = os.path.join(history_dir, payload["termInfo"]["urlName"])
+    os.makedirs(term_dir, exist_ok=True)
+
+    # Round trip through JSON, so that it compares equal to the older versions
+    encoded = jsonio.dumps(payload)
+    payload = jsonio.loads(encoded)
+    write_atomic(os.path.join(term_dir, f"{version}.json"), encoded)
+
+    entries = sorted(
+        (entry for entry in os.scandir(term_dir) if entry.name != f"{version}.json"),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    deltas = {}
+    for entry in entries[:MAX_DELTA_VERSIONS]:
+        old_version = entry.name[: -len(".json")]
+        try:
+            delta = diff_payloads(jsonio.load(entry.path), payload)
+        except (OSError, ValueError) as error:
+            print(f"Unable to read version {old_version} of {term}: {error}")
+            continue
+        if len(jsonio.dumps(delta)) < len(encoded):
+            deltas[old_version] = delta
+    for entry in entries[MAX_DELTA_VERSIONS:]:
+        os.remove(entry.path)
+
+    write_atomic(
+        os.path.join(os.path.dirname(path), f"{term}.delta.json"),
+        jsonio.dumps({"version": version, "lastUpdated": now, "deltas": deltas}),
+    )
+    return len(deltas)
@@ -20,10 +20,10 @@ from __future__ import annotations
 import re
 from pprint import pprint
 from typing import Any, Dict, List, Literal, Optional, Tuple
-from urllib.request import Request, urlopen
 
 from bs4 import BeautifulSoup, Tag
 
+from scrapers.fetch import fetch
 from scrapers.fireroad import parse_section, parse_timeslot
 from scrapers.utils import EVE_TIMES, TIMES
 
@@ -193,13 +193,11 @@ def get_rows() -> list[Tag]:
     Returns:
     * list[Tag]: BeautifulSoup tags for each detected 6.S### subject
     """
-    request = Request(URL)
-    request.add_unredirected_header(
-        "User-Agent", "hydrant-scrapers (https://github.com/sipb/hydrant)"
-    )
-
-    with urlopen(request, timeout=15) as response:
-        page_html = response.read().decode("utf-8")
+    page_html = fetch(
+        URL,
+        timeout=15,
+        headers={"User-Agent": "hydrant-scrapers (https://github.com/sipb/hydrant)"},
+    ).decode("utf-8")
 
     soup = BeautifulSoup(page_html, features="lxml")
     page_text = soup.get_text(" ", strip=True)
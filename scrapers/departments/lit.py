@@ -12,8 +12,8 @@ from collections.abc import Mapping, MutableMapping
 from scrapers.fireroad import (
     CourseValues,
     get_course_data,
-    get_raw_data,
     get_term_info,
+    iter_raw_data,
     url_name_to_term,
 )
 
@@ -76,11 +76,10 @@ def make_lit_schedule(
 
 def run():
     """Gets all classes for 21L along with their human-readable schedule."""
-    data = get_raw_data()
     courses: MutableMapping[str, Mapping[str, CourseValues]] = {}
     term = url_name_to_term(get_term_info("sem")["urlName"])
 
-    for course in data:
+    for course in iter_raw_data():
         get_course_data(courses, course, term)
 
     lit_courses: list[str] = []
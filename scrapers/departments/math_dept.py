@@ -17,10 +17,10 @@ from __future__ import annotations
 
 from collections.abc import Iterable, Sequence
 from pprint import pprint
-from urllib.request import urlopen
 
 from bs4 import BeautifulSoup, Tag
 
+from scrapers.fetch import fetch
 from scrapers.fireroad import parse_section, parse_timeslot
 
 
@@ -113,8 +113,8 @@ def get_rows() -> list[Tag]:
     Returns:
         bs4.element.ResultSet: The rows of the table listing classes
     """
-    with urlopen("https://math.mit.edu/academics/classes.html", timeout=1) as response:
-        soup = BeautifulSoup(response.read().decode("utf-8"), features="lxml")
+    body = fetch("https://math.mit.edu/academics/classes.html", timeout=1)
+    soup = BeautifulSoup(body.decode("utf-8"), features="lxml")
     course_list = soup.find("ul", {"class": "course-list"})
     assert course_list is not None
 
@@ -0,0 +1,1000 @@
+"""
+All of the scrapers download their data through fetch(), which keeps a persistent
+on-disk HTTP cache in `.cache/http/`.
+
+Each response is stored with its ETag and Last-Modified headers. The next request
+for the same URL sends them back as If-None-Match and If-Modified-Since, and if the
+server answers 304 Not Modified, the body is served from disk instead. Entries that
+haven't been used for a while, or that don't fit in the size budget, are removed by
+evict_cache().
+
+Connections are kept alive and reused by later requests to the same host from the
+same thread, and at most MAX_CONNECTIONS_PER_HOST requests to a host are in flight
+at once, so callers can safely download from many threads.
+
+For reproducible runs without the network, every response can be recorded to a
+fixture directory, and later replayed from it instead of downloading anything; see
+set_fixtures(). The directory holds a body per URL and FIXTURE_MANIFEST, which maps
+each URL to its body and carries the FIXTURE_FORMAT it was written with. Setting
+the SCRAPERS_RECORD or SCRAPERS_REPLAY environment variable to a directory does the
+same, for scripts like those in departments/.
+
+Failed downloads are retried, and each server gets a circuit breaker and a deadline,
+so that one slow or broken server can't stall the whole run:
+
+* A download that times out, can't connect, or gets a 429 or 5xx response is tried
+  up to MAX_ATTEMPTS times, waiting a random time of up to RETRY_BASE_DELAY, then
+  twice that, and so on (at most RETRY_MAX_DELAY) in between. Once part of a body
+  has been handed to the caller, the download can't be retried.
+* After BREAKER_THRESHOLD such failures in a row, the breaker of the server opens:
+  for BREAKER_COOLDOWN seconds, its URLs aren't downloaded at all. Then a single
+  download is let through, which closes the breaker if it succeeds.
+* SOURCE_DEADLINE seconds after the first download from a server, its URLs aren't
+  downloaded anymore, a download still in progress stops at its next chunk, and no
+  retry waits past that point. Reads time out by then too, but never in less than
+  MIN_TIMEOUT seconds.
+
+A URL that can't be downloaded for any of these reasons is served from the cache
+instead, if it was ever downloaded, so a run finishes on time with stale data for
+that URL rather than none. Otherwise, or if the caller passes allow_stale=False
+because it keeps its own older results, the last error is raised.
+
+What is downloaded from each server (the number of requests, the bytes received,
+the statuses and cache hits, and when the last download succeeded) is counted, for
+the run manifest; see get_fetch_stats().
+
+Constants:
+    CACHE_DIR: str
+    MAX_CACHE_BYTES: int
+    MAX_CACHE_AGE: float
+    MAX_CONNECTIONS_PER_HOST: int
+    MAX_REDIRECTS: int
+    CHUNK_SIZE: int
+    USER_AGENT: str
+    FIXTURE_FORMAT: int
+    FIXTURE_MANIFEST: str
+    MAX_ATTEMPTS: int
+    RETRY_BASE_DELAY: float
+    RETRY_MAX_DELAY: float
+    BREAKER_THRESHOLD: int
+    BREAKER_COOLDOWN: float
+    SOURCE_DEADLINE: float
+    MIN_TIMEOUT: float
+
+Classes:
+    SourceStats
+
+Functions:
+    fetch_chunks(url, timeout, headers, allow_stale)
+    fetch(url, timeout, headers, allow_stale)
+    get_fetch_stats()
+    set_fixtures(mode, directory)
+    record_fixture(url, data)
+    evict_cache(max_bytes, max_age)
+    write_atomic(path, data)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import http.client
+import os
+import os.path
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
+from typing import Any, Optional, TypedDict
+from urllib.error import HTTPError, URLError
+from urllib.parse import SplitResult, urljoin, urlsplit
+
+from . import jsonio
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache", "http")
+
+# Evict the least recently used entries once the cache is larger than this
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# Evict entries that haven't been used in this many seconds
+MAX_CACHE_AGE = 30 * 24 * 60 * 60
+
+# Be polite: no more than this many simultaneous requests to any one server
+MAX_CONNECTIONS_PER_HOST = 4
+
+MAX_REDIRECTS = 5
+
+# How much of a body to read at a time when streaming it
+CHUNK_SIZE = 64 * 1024
+
+# The same default as urllib.request
+USER_AGENT = f"Python-urllib/{sys.version_info[0]}.{sys.version_info[1]}"
+
+# Bump this when the layout of fixture directories changes
+FIXTURE_FORMAT = 1
+
+FIXTURE_MANIFEST = "manifest.json"
+
+# How many times to try a download that fails in a way that might not last
+MAX_ATTEMPTS = 3
+
+# The longest wait before the first retry, in seconds, doubled for each later one
+RETRY_BASE_DELAY = 0.5
+
+RETRY_MAX_DELAY = 8.0
+
+# Stop downloading from a server after this many failures in a row...
+BREAKER_THRESHOLD = 5
+
+# ...for this many seconds
+BREAKER_COOLDOWN = 60.0
+
+# Stop downloading from a server this many seconds after the first download from it
+SOURCE_DEADLINE = 300.0
+
+# The shortest timeout for a read, even close to the deadline, since a timeout of
+# zero would make the socket non-blocking, and a negative one isn't allowed
+MIN_TIMEOUT = 1.0
+
+# The process umask, which can only be read by setting it
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+_connections = threading.local()
+_host_slots: dict[str, threading.BoundedSemaphore] = {}
+_host_slots_lock = threading.Lock()
+
+# "record" or "replay" when using fixtures, and the directory and manifest used
+_fixture_mode: Optional[str] = None  # pylint: disable=invalid-name
+_fixture_dir = ""  # pylint: disable=invalid-name
+_fixture_manifest: dict[str, Any] = {}
+_fixture_lock = threading.Lock()
+
+
+class SourceStats(TypedDict):
+    """
+    What was downloaded from a server during this run.
+
+    Attributes:
+        requests (int): The number of downloads started, counting each retry
+        bytes (int): The bytes received from the server, not counting bodies
+            served from the cache
+        cacheHits (int): The number of 304 Not Modified responses, whose bodies
+            were served from the cache
+        errors (int): The number of downloads that failed
+        retries (int): The number of downloads that were tried again
+        staleHits (int): The number of URLs served from the cache because they
+            couldn't be downloaded
+        statuses (dict[str, int]): The number of final responses with each HTTP
+            status
+        lastSuccess (Optional[float]): When the last successful download finished,
+            as a Unix time
+    """
+
+    requests: int
+    bytes: int
+    cacheHits: int
+    errors: int
+    retries: int
+    staleHits: int
+    statuses: dict[str, int]
+    lastSuccess: Optional[float]
+
+
+class _Breaker(TypedDict):
+    """
+    The circuit breaker and deadline of a server.
+
+    Attributes:
+        failures (int): The number of failures in a row
+        opened (Optional[float]): When the breaker opened, on the monotonic clock,
+            or None if it is closed
+        deadline (float): When to stop downloading from the server, on the
+            monotonic clock
+    """
+
+    failures: int
+    opened: Optional[float]
+    deadline: float
+
+
+_stats: dict[str, SourceStats] = {}
+_breakers: dict[str, _Breaker] = {}
+_stats_lock = threading.Lock()
+
+
+def _cache_path(url: str, suffix: str) -> str:
+    """
+    Finds where the cache entry for a URL is stored.
+
+    Args:
+        url (str): The URL of the entry
+        suffix (str): ".body" for the response body, ".json" for its metadata
+
+    Returns:
+        str: The path to the file
+    """
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, key + suffix)
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    Writes data to path, so that readers never see a partially written file. The
+    file gets the usual permissions for a new file, not the private ones that
+    tempfile uses.
+
+    Args:
+        path (str): The file to write
+        data (bytes): The contents of the file
+    """
+    # So that a bare file name, like `run.json`, has a directory to make
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _load_entry(url: str) -> Optional[dict[str, Any]]:
+    """
+    Loads the metadata of the cache entry for a URL, if there is a usable one.
+
+    Args:
+        url (str): The URL of the entry
+
+    Returns:
+        Optional[dict[str, Any]]: The metadata, or None if there is no entry
+    """
+    try:
+        meta = jsonio.load(_cache_path(url, ".json"))
+    except (OSError, ValueError):
+        return None
+    if meta.get("url") != url or not os.path.isfile(_cache_path(url, ".body")):
+        return None
+    return meta
+
+
+def _entry_meta(url: str, headers: Mapping[str, str]) -> dict[str, Any]:
+    """
+    Builds the metadata of a cache entry from the headers of a response.
+
+    Args:
+        url (str): The URL that was requested
+        headers (Mapping[str, str]): The headers of the response
+
+    Returns:
+        dict[str, Any]: The metadata to store next to the body
+    """
+    return {
+        "url": url,
+        "etag": headers.get("ETag"),
+        "lastModified": headers.get("Last-Modified"),
+        "stored": time.time(),
+    }
+
+
+@contextmanager
+def _cache_writer(
+    url: str, headers: Mapping[str, str]
+) -> Iterator[Callable[[bytes], None]]:
+    """
+    Stores a response in the cache, as it is being downloaded. The entry is only
+    replaced once the whole body has been written without an error. Errors writing
+    the cache are printed and otherwise ignored, since caching is only an
+    optimization.
+
+    Args:
+        url (str): The URL that was requested
+        headers (Mapping[str, str]): The headers of the response
+
+    Yields:
+        Callable[[bytes], None]: A function to call with each chunk of the body
+    """
+    errors: list[OSError] = []
+    tmp_path = ""
+    tmp_file = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        tmp_file = os.fdopen(fd, "wb")
+    except OSError as error:
+        errors.append(error)
+
+    def write(chunk: bytes) -> None:
+        if tmp_file is not None and not errors:
+            try:
+                tmp_file.write(chunk)
+            except OSError as error:
+                errors.append(error)
+
+    downloaded = False
+    try:
+        yield write
+        downloaded = True
+        if tmp_file is not None:
+            tmp_file.close()
+        if errors:
+            raise errors[0]
+        # The body goes first, so the metadata never points at a missing body
+        os.replace(tmp_path, _cache_path(url, ".body"))
+        write_atomic(
+            _cache_path(url, ".json"),
+            jsonio.dumps(_entry_meta(url, headers)),
+        )
+    except OSError as error:
+        if not downloaded:
+            # The download itself failed, which is for the caller to handle
+            raise
+        print(f"Unable to cache {url}: {error}")
+    finally:
+        if tmp_file is not None:
+            tmp_file.close()
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _read_cached_chunks(url: str) -> Iterator[bytes]:
+    """
+    Reads the cached body for a URL, and marks the entry as recently used.
+
+    Args:
+        url (str): The URL of the entry
+
+    Yields:
+        bytes: The cached body, a chunk at a time
+    """
+    body_path = _cache_path(url, ".body")
+    os.utime(body_path)
+    with open(body_path, "rb") as body_file:
+        yield from iter(lambda: body_file.read(CHUNK_SIZE), b"")
+
+
+def _host_slot(netloc: str) -> threading.BoundedSemaphore:
+    """
+    Gets the semaphore limiting the number of simultaneous requests to a host.
+
+    Args:
+        netloc (str): The host (and port) of the server
+
+    Returns:
+        threading.BoundedSemaphore: The semaphore for that host
+    """
+    with _host_slots_lock:
+        if netloc not in _host_slots:
+            _host_slots[netloc] = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+        return _host_slots[netloc]
+
+
+def _get_connection(
+    scheme: str, netloc: str, timeout: float
+) -> http.client.HTTPConnection:
+    """
+    Gets this thread's keep-alive connection to a server, opening one if needed.
+
+    Args:
+        scheme (str): "http" or "https"
+        netloc (str): The host (and port) of the server
+        timeout (float): The timeout for requests, in seconds
+
+    Returns:
+        http.client.HTTPConnection: The connection
+    """
+    pool: dict[tuple[str, str], http.client.HTTPConnection]
+    pool = getattr(_connections, "pool", None)
+    if pool is None:
+        pool = _connections.pool = {}
+    conn = pool.get((scheme, netloc))
+    if conn is None:
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(netloc, timeout=timeout)
+        elif scheme == "http":
+            conn = http.client.HTTPConnection(netloc, timeout=timeout)
+        else:
+            raise URLError(f"unknown url type: {scheme}")
+        pool[(scheme, netloc)] = conn
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+    return conn
+
+
+def _send(
+    parts: SplitResult, headers: Mapping[str, str], timeout: float
+) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+    """
+    Sends a single GET request over a pooled connection, without reading the body
+    of the response. If the server has closed an idle connection, it is reopened
+    once.
+
+    Args:
+        parts (SplitResult): The URL to request
+        headers (Mapping[str, str]): The headers to send
+        timeout (float): The timeout for the request, in seconds
+
+    Raises:
+        URLError: If there is a protocol error.
+        socket.timeout: If the request times out.
+
+    Returns:
+        tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+            The connection, and the response waiting to be read from it
+    """
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+
+    for attempt in range(2):
+        conn = _get_connection(parts.scheme, parts.netloc, timeout)
+        reused = conn.sock is not None
+        try:
+            conn.request("GET", path, headers=dict(headers))
+            return conn, conn.getresponse()
+        except socket.timeout:
+            conn.close()
+            raise
+        except (OSError, http.client.HTTPException) as error:
+            conn.close()
+            # The server may have dropped the idle connection, so try a new one
+            if reused and attempt == 0:
+                continue
+            raise URLError(error) from error
+    raise AssertionError("unreachable")
+
+
+def _release(
+    conn: http.client.HTTPConnection, response: http.client.HTTPResponse
+) -> None:
+    """
+    Gets a connection ready for the next request, closing it unless the response was
+    read to the end and the server is keeping the connection alive.
+
+    Args:
+        conn (http.client.HTTPConnection): The connection
+        response (http.client.HTTPResponse): The last response on the connection
+    """
+    if not response.isclosed() or response.will_close:
+        conn.close()
+
+
+@contextmanager
+def _open(
+    url: str, headers: Mapping[str, str], timeout: float
+) -> Iterator[http.client.HTTPResponse]:
+    """
+    Sends a GET request, following redirects.
+
+    Args:
+        url (str): The URL to request
+        headers (Mapping[str, str]): The headers to send
+        timeout (float): The timeout for each request, in seconds
+
+    Raises:
+        URLError: If there is a protocol error, or the server returns an error.
+        socket.timeout: If the request times out.
+
+    Yields:
+        http.client.HTTPResponse: The final response, with a status of 200 or 304,
+            whose body is still to be read
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        with _host_slot(parts.netloc):
+            conn, response = _send(parts, headers, timeout)
+            try:
+                location = response.getheader("Location")
+                if response.status in (301, 302, 303, 307, 308) and location:
+                    response.read()
+                    url = urljoin(url, location)
+                    continue
+                if response.status not in (200, 304):
+                    raise HTTPError(
+                        url, response.status, response.reason, response.headers, None
+                    )
+                yield response
+                return
+            except (OSError, http.client.HTTPException) as error:
+                if isinstance(error, (socket.timeout, URLError)):
+                    raise
+                raise URLError(error) from error
+            finally:
+                _release(conn, response)
+    raise URLError(f"Too many redirects for {url}")
+
+
+def set_fixtures(mode: Optional[str], directory: str = "") -> None:
+    """
+    Starts recording every response to a fixture directory, or replaying them from
+    one, or (with a mode of None) goes back to using the network.
+
+    Recording into a directory that already has fixtures keeps the ones that aren't
+    downloaded again. When replaying, a URL that wasn't recorded raises URLError,
+    like a failed download.
+
+    Args:
+        mode (Optional[str]): "record", "replay", or None
+        directory (str): The fixture directory
+
+    Raises:
+        ValueError: If the mode is unknown, or the fixtures to replay are missing or
+            were written in another format
+    """
+    global _fixture_mode, _fixture_dir, _fixture_manifest  # pylint: disable=global-statement
+    if mode not in (None, "record", "replay"):
+        raise ValueError(f"Unknown fixture mode {mode}")
+    manifest: dict[str, Any] = {"format": FIXTURE_FORMAT, "responses": {}}
+    if mode is not None:
+        try:
+            manifest = jsonio.load(os.path.join(directory, FIXTURE_MANIFEST))
+        except (OSError, ValueError) as error:
+            if mode == "replay":
+                raise ValueError(f"No fixtures in {directory}: {error}") from error
+            manifest = {"format": FIXTURE_FORMAT, "responses": {}}
+        if manifest.get("format") != FIXTURE_FORMAT:
+            if mode == "replay":
+                raise ValueError(
+                    f"Fixtures in {directory} have format {manifest.get('format')}, "
+                    f"not {FIXTURE_FORMAT}"
+                )
+            manifest = {"format": FIXTURE_FORMAT, "responses": {}}
+    with _fixture_lock:
+        _fixture_mode, _fixture_dir, _fixture_manifest = mode, directory, manifest
+
+
+def _replay_chunks(url: str) -> Iterator[bytes]:
+    """
+    Reads the recorded body for a URL.
+
+    Args:
+        url (str): The URL that was recorded
+
+    Raises:
+        URLError: If the URL wasn't recorded
+
+    Yields:
+        bytes: The recorded body, a chunk at a time
+    """
+    entry = _fixture_manifest["responses"].get(url)
+    if entry is None:
+        raise URLError(f"No recorded response for {url}")
+    with open(os.path.join(_fixture_dir, entry["file"]), "rb") as body_file:
+        yield from iter(lambda: body_file.read(CHUNK_SIZE), b"")
+
+
+def _record_chunks(url: str, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Passes a body through, recording it once it has been read to the end.
+
+    Args:
+        url (str): The URL that was downloaded
+        chunks (Iterator[bytes]): The body, a chunk at a time
+
+    Yields:
+        bytes: The same chunks
+    """
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+
+    record_fixture(url, b"".join(body))
+
+
+def record_fixture(url: str, data: bytes) -> None:
+    """
+    Adds a response to the fixture directory being recorded to.
+
+    Args:
+        url (str): The URL of the response
+        data (bytes): The body of the response
+    """
+    assert _fixture_mode == "record", "Not recording fixtures"
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest() + ".body"
+    write_atomic(os.path.join(_fixture_dir, name), data)
+    with _fixture_lock:
+        _fixture_manifest["responses"][url] = {
+            "file": name,
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+        write_atomic(
+            os.path.join(_fixture_dir, FIXTURE_MANIFEST),
+            jsonio.dumps(_fixture_manifest, sort_keys=True),
+        )
+
+
+def fetch_chunks(
+    url: str,
+    timeout: float,
+    headers: Mapping[str, str] | None = None,
+    allow_stale: bool = True,
+) -> Iterator[bytes]:
+    """
+    Downloads the body at a URL, revalidating against the on-disk cache, and yields
+    it a chunk at a time as it arrives, so it never has to be held in memory. When
+    replaying fixtures, the recorded body is yielded instead. Failures are retried,
+    or served from the cache, as described at the top of this module.
+
+    The body is only cached (and recorded) if it is read to the end. Errors may be
+    raised while iterating, not just when the first chunk is requested.
+
+    Args:
+        url (str): The URL to download
+        timeout (float): The timeout for each read, in seconds
+        headers (Mapping[str, str] | None): Extra headers to send
+        allow_stale (bool): Whether to serve the cached body if the download fails
+
+    Raises:
+        URLError: If there is a protocol error, or the server returns an error.
+        socket.timeout: If the request times out.
+
+    Yields:
+        bytes: The body of the response, a chunk at a time
+    """
+    if _fixture_mode == "replay":
+        return _replay_chunks(url)
+    chunks = _resilient_chunks(url, timeout, headers, allow_stale)
+    if _fixture_mode == "record":
+        return _record_chunks(url, chunks)
+    return chunks
+
+
+def _download_chunks(
+    url: str,
+    timeout: float,
+    headers: Mapping[str, str] | None = None,
+    deadline: Optional[float] = None,
+) -> Iterator[bytes]:
+    """
+    Downloads the body at a URL, revalidating against the on-disk cache.
+
+    Args:
+        url (str): The URL to download
+        timeout (float): The timeout for each read, in seconds
+        headers (Mapping[str, str] | None): Extra headers to send
+        deadline (Optional[float]): When to give up on the body, as a time.monotonic()
+            time, checked after each chunk
+
+    Raises:
+        URLError: If there is a protocol error, or the server returns an error.
+        socket.timeout: If the request times out, or the deadline passes.
+
+    Yields:
+        bytes: The body of the response, a chunk at a time
+    """
+    request_headers = {"User-Agent": USER_AGENT, **(headers or {})}
+    entry = _load_entry(url)
+    if entry is not None:
+        if entry["etag"]:
+            request_headers["If-None-Match"] = entry["etag"]
+        if entry["lastModified"]:
+            request_headers["If-Modified-Since"] = entry["lastModified"]
+
+    source = urlsplit(url).netloc
+    status: Optional[int] = None
+    received = 0
+    try:
+        with _open(url, request_headers, timeout) as response:
+            status = response.status
+            if response.status == 304:
+                if entry is None:
+                    raise URLError(f"Unexpected 304 Not Modified for {url}")
+                yield from _read_cached_chunks(url)
+            else:
+                with _cache_writer(url, response.headers) as write_cache:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                        if deadline is not None and time.monotonic() >= deadline:
+                            raise socket.timeout(f"Deadline passed downloading {url}")
+                        received += len(chunk)
+                        write_cache(chunk)
+                        yield chunk
+    except OSError as error:
+        if isinstance(error, HTTPError):
+            status = error.code
+        _count_download(source, status, received, False)
+        raise
+    _count_download(source, status, received, True)
+
+
+def _source_stats(source: str) -> SourceStats:
+    """
+    Gets the stats of a server, which must be done holding _stats_lock.
+
+    Args:
+        source (str): The host (and port) of the server
+
+    Returns:
+        SourceStats: Its stats, to update in place
+    """
+    return _stats.setdefault(
+        source,
+        {
+            "requests": 0,
+            "bytes": 0,
+            "cacheHits": 0,
+            "errors": 0,
+            "retries": 0,
+            "staleHits": 0,
+            "statuses": {},
+            "lastSuccess": None,
+        },
+    )
+
+
+def _count_download(
+    source: str, status: Optional[int], received: int, succeeded: bool
+) -> None:
+    """
+    Adds a download to the stats of its server.
+
+    Args:
+        source (str): The host (and port) of the server
+        status (Optional[int]): The status of the final response, if there was one
+        received (int): The bytes of the body received from the server
+        succeeded (bool): Whether the whole body was read
+    """
+    with _stats_lock:
+        stats = _source_stats(source)
+        stats["requests"] += 1
+        stats["bytes"] += received
+        if status is not None:
+            stats["statuses"][str(status)] = stats["statuses"].get(str(status), 0) + 1
+        if succeeded:
+            if status == 304:
+                stats["cacheHits"] += 1
+            stats["lastSuccess"] = time.time()
+        else:
+            stats["errors"] += 1
+
+
+def _is_transient(error: OSError) -> bool:
+    """
+    Checks whether a failed download might succeed if it is tried again.
+
+    >>> _is_transient(socket.timeout("timed out"))
+    True
+    >>> _is_transient(HTTPError("https://example.com", 503, "", {}, None))
+    True
+    >>> _is_transient(HTTPError("https://example.com", 404, "", {}, None))
+    False
+
+    Args:
+        error (OSError): What the download raised
+
+    Returns:
+        bool: Whether the error might not last, like a timeout or a 5xx response
+    """
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    return True
+
+
+def _may_download(source: str) -> bool:
+    """
+    Checks whether a server may be downloaded from, starting its deadline on the
+    first download, and letting a single download through once its breaker has
+    been open for BREAKER_COOLDOWN seconds.
+
+    Args:
+        source (str): The host (and port) of the server
+
+    Returns:
+        bool: False if its breaker is open, or its deadline has passed
+    """
+    now = time.monotonic()
+    with _stats_lock:
+        breaker = _breakers.setdefault(
+            source,
+            {"failures": 0, "opened": None, "deadline": now + SOURCE_DEADLINE},
+        )
+        if now >= breaker["deadline"]:
+            return False
+        if breaker["opened"] is not None:
+            if now - breaker["opened"] < BREAKER_COOLDOWN:
+                return False
+            # One more failure opens the breaker again
+            breaker["opened"] = None
+            breaker["failures"] = BREAKER_THRESHOLD - 1
+        return True
+
+
+def _time_left(source: str) -> float:
+    """
+    Finds how long a server may still be downloaded from.
+
+    Args:
+        source (str): The host (and port) of the server, which _may_download()
+            has been called for
+
+    Returns:
+        float: The seconds until its deadline
+    """
+    with _stats_lock:
+        return _breakers[source]["deadline"] - time.monotonic()
+
+
+def _record_outcome(source: str, succeeded: bool) -> None:
+    """
+    Updates the breaker of a server after a download, opening it after
+    BREAKER_THRESHOLD failures in a row.
+
+    Args:
+        source (str): The host (and port) of the server
+        succeeded (bool): Whether the download succeeded
+    """
+    with _stats_lock:
+        breaker = _breakers[source]
+        if succeeded:
+            breaker["failures"] = 0
+            return
+        breaker["failures"] += 1
+        opened = breaker["failures"] >= BREAKER_THRESHOLD and breaker["opened"] is None
+        if opened:
+            breaker["opened"] = time.monotonic()
+    if opened:
+        print(
+            f"Too many failures from {source}, not downloading from it for "
+            f"{BREAKER_COOLDOWN:.0f} s"
+        )
+
+
+def _resilient_chunks(
+    url: str,
+    timeout: float,
+    headers: Mapping[str, str] | None = None,
+    allow_stale: bool = True,
+) -> Iterator[bytes]:
+    """
+    Downloads the body at a URL, retrying failures that might not last, and falling
+    back on the cache when the server can't be downloaded from.
+
+    Args:
+        url (str): The URL to download
+        timeout (float): The timeout for each read, in seconds
+        headers (Mapping[str, str] | None): Extra headers to send
+        allow_stale (bool): Whether to serve the cached body if the download fails
+
+    Raises:
+        URLError: If the download fails and the URL isn't cached, or the server
+            returns an error that isn't worth retrying.
+        socket.timeout: If the request times out and the URL isn't cached.
+
+    Yields:
+        bytes: The body of the response, a chunk at a time
+    """
+    source = urlsplit(url).netloc
+    error: Optional[OSError] = None
+    for attempt in range(MAX_ATTEMPTS):
+        if not _may_download(source):
+            break
+        if attempt:
+            with _stats_lock:
+                _source_stats(source)["retries"] += 1
+        started = False
+        time_left = _time_left(source)
+        try:
+            for chunk in _download_chunks(
+                url,
+                max(MIN_TIMEOUT, min(timeout, time_left)),
+                headers,
+                time.monotonic() + time_left,
+            ):
+                started = True
+                yield chunk
+        except OSError as download_error:
+            if not _is_transient(download_error):
+                raise
+            _record_outcome(source, False)
+            if started:
+                # Part of the body was already handed over
+                raise
+            error = download_error
+            delay = random.uniform(
+                0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)
+            )
+            if attempt + 1 == MAX_ATTEMPTS or delay >= _time_left(source):
+                break
+            time.sleep(delay)
+            continue
+        _record_outcome(source, True)
+        return
+
+    if allow_stale and _load_entry(url) is not None:
+        with _stats_lock:
+            _source_stats(source)["staleHits"] += 1
+        yield from _read_cached_chunks(url)
+        return
+    if error is None:
+        error = URLError(f"Not downloading {url}: {source} keeps failing or is late")
+    raise error
+
+
+def get_fetch_stats() -> dict[str, SourceStats]:
+    """
+    Gets what has been downloaded from each server so far. Replayed fixtures aren't
+    counted, and neither are downloads that were abandoned before the end of the
+    body.
+
+    Returns:
+        dict[str, SourceStats]: A copy of the stats, by host (and port)
+    """
+    with _stats_lock:
+        return {
+            source: {**stats, "statuses": dict(stats["statuses"])}
+            for source, stats in _stats.items()
+        }
+
+
+def fetch(
+    url: str,
+    timeout: float,
+    headers: Mapping[str, str] | None = None,
+    allow_stale: bool = True,
+) -> bytes:
+    """
+    Downloads the body at a URL, revalidating against the on-disk cache.
+
+    Args:
+        url (str): The URL to download
+        timeout (float): The timeout for each read, in seconds
+        headers (Mapping[str, str] | None): Extra headers to send
+        allow_stale (bool): Whether to serve the cached body if the download fails
+
+    Raises:
+        URLError: If there is a protocol error, or the server returns an error.
+        socket.timeout: If the request times out.
+
+    Returns:
+        bytes: The body of the response
+    """
+    return b"".join(fetch_chunks(url, timeout, headers, allow_stale))
+
+
+def evict_cache(
+    max_bytes: int = MAX_CACHE_BYTES, max_age: float = MAX_CACHE_AGE
+) -> None:
+    """
+    Removes cache entries that haven't been used in max_age seconds, and then the
+    least recently used entries until the cache is at most max_bytes large.
+
+    Args:
+        max_bytes (int): The size budget of the cache, in bytes
+        max_age (float): How long an unused entry is kept, in seconds
+    """
+    try:
+        with os.scandir(CACHE_DIR) as entries:
+            bodies = [
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for entry in entries
+                if entry.is_file() and entry.name.endswith(".body")
+            ]
+    except FileNotFoundError:
+        return
+
+    now = time.time()
+    total = sum(size for _, size, _ in bodies)
+    # Most recently used last, so the oldest entries are evicted first
+    for mtime, size, body_path in sorted(bodies):
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        for path in (body_path, body_path[: -len(".body")] + ".json"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+if os.environ.get("SCRAPERS_REPLAY"):
+    set_fixtures("replay", os.environ["SCRAPERS_REPLAY"])
+elif os.environ.get("SCRAPERS_RECORD"):
+    set_fixtures("record", os.environ["SCRAPERS_RECORD"])
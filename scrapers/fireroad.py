@@ -11,34 +11,40 @@ schedule for the latest term.
 Functions:
     parse_timeslot(day, slot, pm)
     parse_section(section)
+    section_cache_info()
     parse_schedule(course)
     parse_quarter_info(course)
     parse_attributes(course)
     parse_terms(course)
     parse_prereqs(course)
+    parse_term_schedule(course, term)
+    parse_units(course)
+    parse_details(course)
+    get_course_data_by_term(courses_by_term, course)
     get_course_data(courses, course, term)
-    get_raw_data()
-    run(sem_term)
+    iter_raw_data()
+    run(*sem_terms)
 """
 
 from __future__ import annotations
 
-import json
 import os.path
 import socket
-from collections.abc import Mapping, MutableMapping
+from collections.abc import Iterator, Mapping, MutableMapping
 from functools import lru_cache
-from typing import Any, Literal, Union
+from typing import Literal, Union
 from urllib.error import URLError
-from urllib.request import urlopen
 
+from . import jsonio
+from .fetch import fetch_chunks, write_atomic
+from .pipeline import checkpoint
 from .utils import (
     GIR_REWRITE,
     MONTHS,
     Term,
     find_timeslot,
     get_term_info,
-    grouper,
+    iter_json_array,
     url_name_to_term,
 )
 
@@ -47,8 +53,9 @@ URL = "https://fireroad.mit.edu/courses/all?full=true"
 CourseValues = Union[bool, float, int, "list[str]", str]
 
 
+@lru_cache(maxsize=None)
 def parse_timeslot(day: str, slot: str, time_is_pm: bool) -> tuple[int, int]:
-    """Parses a timeslot.
+    """Parses a timeslot. Results are memoized.
 
     Args:
         day (str): The day as a string
@@ -101,6 +108,9 @@ def parse_timeslot(day: str, slot: str, time_is_pm: bool) -> tuple[int, int]:
 def parse_section(section: str) -> tuple[list[tuple[int, int]], str]:
     """Parses a section string.
 
+    The same section strings show up again and again (across courses, terms and the
+    PE data), so the parsed results are memoized; see section_cache_info().
+
     >>> parse_section("32-123/TR/0/11/F/0/2")
     ([(44, 2), (112, 2), (152, 2)], '32-123')
 
@@ -110,10 +120,32 @@ def parse_section(section: str) -> tuple[list[tuple[int, int]], str]:
     Returns:
         tuple[list[tuple[int, int]], str]: The parsed section.
     """
+    slots, place = _parse_section_cached(section)
+    # A fresh list, so that callers can't modify the memoized result
+    return list(slots), place
+
+
+@lru_cache(maxsize=None)
+def _parse_section_cached(section: str) -> tuple[tuple[tuple[int, int], ...], str]:
+    """
+    Helper function for parse_section, which does the actual parsing.
+
+    Args:
+        section (str): The section given as a string
+
+    Raises:
+        ValueError: If the section doesn't have a whole number of
+            (weekdays, is_pm_int, slot) groups.
+
+    Returns:
+        tuple[tuple[tuple[int, int], ...], str]: The parsed section.
+    """
     place, *infos = section.split("/")
     slots: list[tuple[int, int]] = []
 
-    for weekdays, is_pm_int, slot in grouper(infos, 3):
+    whole = len(infos) - len(infos) % 3
+    for i in range(0, whole, 3):
+        weekdays, is_pm_int, slot = infos[i : i + 3]
         for day in weekdays:
             # saturday
             if day == "S":
@@ -122,8 +154,22 @@ def parse_section(section: str) -> tuple[list[tuple[int, int]], str]:
             if day == "U":
                 continue
             slots.append(parse_timeslot(day, slot, bool(int(is_pm_int))))
+    if whole != len(infos):
+        # Same error as grouper
+        raise ValueError("Iterables have different lengths")
 
-    return slots, place
+    return tuple(slots), place
+
+
+def section_cache_info() -> tuple[int, int]:
+    """
+    Gets the counters of the memoized section parser.
+
+    Returns:
+        tuple[int, int]: The number of cache hits and misses so far
+    """
+    info = _parse_section_cached.cache_info()
+    return info.hits, info.misses
 
 
 def parse_schedule(schedule: str) -> dict[str, list[str] | bool]:
@@ -321,52 +367,20 @@ def parse_prereqs(
     return {"prereqs": prereqs}
 
 
-def get_course_data(
-    courses: MutableMapping[str, Mapping[str, CourseValues]],
-    course: Mapping[str, CourseValues],
-    term: Term,
-) -> bool:
+def parse_term_schedule(
+    course: Mapping[str, CourseValues], term: Term
+) -> dict[str, list[str] | bool]:
     """
-    Parses a course from the Fireroad API, and puts it in courses. Skips the
-    courses that are not offered in the current term. Returns False if skipped,
-    True otherwise. The `courses` variable is modified in place.
+    Parses the schedule of the course for the given term. If the course has no
+    schedule, or it can't be parsed, an empty schedule is returned instead.
 
     Args:
-        courses (MutableMapping[str, Mapping[str, CourseValues]]):
-            The list of courses.
-        course (Mapping[str, CourseValues]):
-            The course in particular.
-        term (Term): The current term (fall, IAP, or spring).
+        course (Mapping[str, CourseValues]): The course object.
+        term (Term): The current term (fall, IAP, spring, or summer).
 
     Returns:
-        bool: Whether the course was entered into courses.
+        dict[str, list[str] | bool]: The parsed schedule
     """
-    course_code: str = course["subject_id"]  # type: ignore
-    course_num, course_class = course_code.split(".")
-    raw_class: dict[
-        str,
-        str
-        | bool
-        | float
-        | int
-        | dict[str, tuple[int, int]]
-        | list[str]
-        | dict[str, list[str] | bool],
-    ] = {
-        "number": course_code,
-        "course": course_num,
-        "subject": course_class,
-    }
-
-    # terms, prereqs
-    raw_class.update(parse_terms(course))
-    raw_class.update(parse_prereqs(course))
-
-    if term.name not in raw_class["terms"]:  # type: ignore
-        return False
-
-    has_schedule = True
-
     # tba, sectionKinds, lectureSections, recitationSections, labSections,
     # designSections, lectureRawSections, recitationRawSections, labRawSections,
     # designRawSections
@@ -374,144 +388,264 @@ def get_course_data(
         if any(f"schedule_{t.value}" in course for t in Term):
             # This course has schedule information by term,
             # so look up the one for this term
-            raw_class.update(
-                parse_schedule(course[f"schedule_{term.value}"])  # type: ignore
-            )
-        else:
-            # Fall back to general quarter information
-            raw_class.update(parse_schedule(course["schedule"]))  # type: ignore
+            return parse_schedule(course[f"schedule_{term.value}"])  # type: ignore
+        # Fall back to general quarter information
+        return parse_schedule(course["schedule"])  # type: ignore
     except KeyError:
-        has_schedule = False
+        pass
     except (ValueError, AssertionError) as val_err:
         # if we can't parse the schedule, warn
         # NOTE: parse_schedule will raise a ValueError
-        print(f"Can't parse schedule {course_code}: {val_err!r}")
-        has_schedule = False
-
-    if not has_schedule:
-        raw_class.update(
-            {
-                "tba": False,
-                "sectionKinds": [],
-                "lectureSections": [],
-                "recitationSections": [],
-                "labSections": [],
-                "designSections": [],
-                "lectureRawSections": [],
-                "recitationRawSections": [],
-                "labRawSections": [],
-                "designRawSections": [],
-            }
-        )
+        print(f"Can't parse schedule {course['subject_id']}: {val_err!r}")
+
+    return {
+        "tba": False,
+        "sectionKinds": [],
+        "lectureSections": [],
+        "recitationSections": [],
+        "labSections": [],
+        "designSections": [],
+        "lectureRawSections": [],
+        "recitationRawSections": [],
+        "labRawSections": [],
+        "designRawSections": [],
+    }
+
+
+def parse_units(course: Mapping[str, CourseValues]) -> dict[str, CourseValues]:
+    """
+    Parses the units and level of a course, and the courses it is the same as or
+    meets with.
+
+    Args:
+        course (Mapping[str, CourseValues]): The course to parse
+
+    Raises:
+        KeyError: If the course has no units or level
+
+    Returns:
+        dict[str, CourseValues]: lectureUnits, labUnits, preparationUnits, level,
+        isVariableUnits, same, meets
+    """
+    units: dict[str, CourseValues] = {
+        "lectureUnits": course["lecture_units"],
+        "labUnits": course["lab_units"],
+        "preparationUnits": course["preparation_units"],
+        "level": course["level"],
+        "isVariableUnits": course["is_variable_units"],
+        "same": ", ".join(course.get("joint_subjects", [])),  # type: ignore
+        "meets": ", ".join(course.get("meets_with_subjects", [])),  # type: ignore
+    }
+    # This should be the case with variable-units classes, but just to make
+    # sure.
+    if units["isVariableUnits"]:
+        assert units["lectureUnits"] == 0
+        assert units["labUnits"] == 0
+        assert units["preparationUnits"] == 0
+    return units
+
+
+def parse_details(course: Mapping[str, CourseValues]) -> dict[str, CourseValues]:
+    """
+    Parses the description of a course, and its evaluation stats.
+
+    Args:
+        course (Mapping[str, CourseValues]): The course to parse
+
+    Returns:
+        dict[str, CourseValues]: description, name, inCharge, virtualStatus,
+        oldNumber (if it has one), rating, hours, size
+    """
+    details: dict[str, CourseValues] = {
+        "description": course.get("description", ""),
+        "name": course.get("title", ""),
+        "inCharge": ",".join(course.get("instructors", [])),  # type: ignore
+        "virtualStatus": course.get("virtual_status", "") == "Virtual",
+    }
+    if "old_id" in course:
+        details["oldNumber"] = course["old_id"]
+
+    # nonext, repeat, url, final, half, limited are from catalog.json, not here
+
+    details["rating"] = course.get("rating", 0)
+    details["hours"] = course.get("in_class_hours", 0) + course.get(
+        "out_of_class_hours", 0
+    )  # type: ignore
+    details["size"] = course.get("enrollment_number", 0)
+    return details
+
+
+def get_course_data_by_term(
+    courses_by_term: Mapping[Term, MutableMapping[str, Mapping[str, CourseValues]]],
+    course: Mapping[str, CourseValues],
+) -> list[Term]:
+    """
+    Parses a course from the Fireroad API, and puts it in the courses of every term
+    in courses_by_term it is offered in. The parts of the course that don't depend
+    on the term are only parsed once. The mappings in `courses_by_term` are
+    modified in place.
+
+    Args:
+        courses_by_term
+            (Mapping[Term, MutableMapping[str, Mapping[str, CourseValues]]]):
+            The list of courses for each term.
+        course (Mapping[str, CourseValues]):
+            The course in particular.
+
+    Returns:
+        list[Term]: The terms whose courses the course was entered into.
+    """
+    course_code: str = course["subject_id"]  # type: ignore
+    course_num, course_class = course_code.split(".")
+
+    # terms, prereqs
+    terms = parse_terms(course)
+    offered = [term for term in courses_by_term if term.name in terms["terms"]]
+    if not offered:
+        return []
+    prereqs = parse_prereqs(course)
+
+    schedules = {term: parse_term_schedule(course, term) for term in offered}
 
     # hassH, hassA, hassS, hassE, cih, cihw, rest, lab, partLab
-    raw_class.update(parse_attributes(course))
+    attributes = parse_attributes(course)
     try:
-        raw_class.update(
-            {
-                "lectureUnits": course["lecture_units"],
-                "labUnits": course["lab_units"],
-                "preparationUnits": course["preparation_units"],
-                "level": course["level"],
-                "isVariableUnits": course["is_variable_units"],
-                "same": ", ".join(course.get("joint_subjects", [])),  # type: ignore
-                "meets": ", ".join(
-                    course.get("meets_with_subjects", [])  # type: ignore
-                ),
-            }
-        )
+        units = parse_units(course)
     except KeyError as key_err:
         print(f"Can't parse {course_code}: {key_err!r}")
-        return False
-    # This should be the case with variable-units classes, but just to make
-    # sure.
-    if raw_class["isVariableUnits"]:
-        assert raw_class["lectureUnits"] == 0
-        assert raw_class["labUnits"] == 0
-        assert raw_class["preparationUnits"] == 0
-
-    # Get quarter info if available
-    raw_class.update(parse_quarter_info(course, term))
-
-    raw_class.update(
-        {
-            "description": course.get("description", ""),
-            "name": course.get("title", ""),
-            "inCharge": ",".join(course.get("instructors", [])),  # type: ignore
-            "virtualStatus": course.get("virtual_status", "") == "Virtual",
+        return []
+    details = parse_details(course)
+
+    for term in offered:
+        raw_class: dict[
+            str,
+            str
+            | bool
+            | float
+            | int
+            | dict[str, tuple[int, int]]
+            | list[str]
+            | dict[str, list[str] | bool],
+        ] = {
+            "number": course_code,
+            "course": course_num,
+            "subject": course_class,
         }
-    )
+        raw_class.update(terms)
+        raw_class.update(prereqs)
+        raw_class.update(schedules[term])
+        raw_class.update(attributes)
+        raw_class.update(units)
 
-    # nonext, repeat, url, final, half, limited are from catalog.json, not here
+        # Get quarter info if available
+        raw_class.update(parse_quarter_info(course, term))
 
-    if "old_id" in course:
-        raw_class["oldNumber"] = course["old_id"]
-
-    raw_class.update(
-        {
-            "rating": course.get("rating", 0),
-            "hours": course.get("in_class_hours", 0)
-            + course.get("out_of_class_hours", 0),  # type: ignore
-            "size": course.get("enrollment_number", 0),
-        }
-    )
+        raw_class.update(details)
 
-    courses[course_code] = raw_class  # type: ignore
-    return True
+        courses_by_term[term][course_code] = raw_class  # type: ignore
 
+    return offered
 
-@lru_cache(maxsize=None)
-def get_raw_data() -> Any:
+
+def get_course_data(
+    courses: MutableMapping[str, Mapping[str, CourseValues]],
+    course: Mapping[str, CourseValues],
+    term: Term,
+) -> bool:
+    """
+    Parses a course from the Fireroad API, and puts it in courses. Skips the
+    courses that are not offered in the current term. Returns False if skipped,
+    True otherwise. The `courses` variable is modified in place.
+
+    Args:
+        courses (MutableMapping[str, Mapping[str, CourseValues]]):
+            The list of courses.
+        course (Mapping[str, CourseValues]):
+            The course in particular.
+        term (Term): The current term (fall, IAP, or spring).
+
+    Returns:
+        bool: Whether the course was entered into courses.
     """
-    Obtains raw data directly from the Fireroad API.
+    return bool(get_course_data_by_term({term: courses}, course))
+
+
+def iter_raw_data() -> Iterator[Mapping[str, CourseValues]]:
+    """
+    Obtains raw data directly from the Fireroad API, decoding one course at a time
+    as it is downloaded, so that the whole payload is never held in memory.
     Helper function for run().
 
+    Raises:
+        URLError: If there is a protocol error, possibly midway through.
+        socket.timeout: If the request times out, possibly midway through.
+
     Returns:
-        Any: The raw data from the Fireroad API.
+        Iterator[Mapping[str, CourseValues]]: The raw courses from the Fireroad API.
     """
-    with urlopen(URL, timeout=15) as raw_data_req:
-        text = raw_data_req.read().decode("utf-8")
-    data = json.loads(text)
-    return data
+    return iter_json_array(fetch_chunks(URL, timeout=15))
 
 
-def run(sem_term: Literal["sem", "presem"]) -> None:
+def run(
+    *sem_terms: Literal["sem", "presem"],
+) -> dict[str, MutableMapping[str, Mapping[str, CourseValues]]]:
     """
-    The main entry point. All data is written to `fireroad.json`.
+    The main entry point. Data for each term is written to `fireroad-{sem_term}.json`.
     If sem_term = "sem", looks at semester term (fall/spring).
     If sem_term = "presem", looks at pre-semester term (summer/IAP)
 
+    All of the given terms are parsed in a single pass over the Fireroad data. If
+    no terms are given, both are.
+
     Args:
-        sem_term (Literal["sem", "presem"]): whether to look at the
+        *sem_terms (Literal["sem", "presem"]): whether to look at the
             semester or the pre-semester term.
+
+    Returns:
+        dict[str, MutableMapping[str, Mapping[str, CourseValues]]]: The courses of
+        each term, by sem_term, or nothing if the data couldn't be scraped
     """
-    fname = f"fireroad-{sem_term}.json"
-    fname = os.path.join(os.path.dirname(__file__), fname)
+    if not sem_terms:
+        sem_terms = ("presem", "sem")
+    fnames = {
+        sem_term: os.path.join(os.path.dirname(__file__), f"fireroad-{sem_term}.json")
+        for sem_term in sem_terms
+    }
 
+    terms = {
+        sem_term: url_name_to_term(get_term_info(sem_term)["urlName"])
+        for sem_term in sem_terms
+    }
+    courses_by_term: dict[Term, MutableMapping[str, Mapping[str, CourseValues]]] = {
+        term: {} for term in terms.values()
+    }
+
+    total = 0
+    included: dict[Term, int] = dict.fromkeys(courses_by_term, 0)
+
+    # The courses are parsed as they are downloaded, so errors can happen midway
     try:
-        data = get_raw_data()
+        for course in iter_raw_data():
+            total += 1
+            for term in get_course_data_by_term(courses_by_term, course):
+                included[term] += 1
     except (URLError, socket.timeout):
         print("Unable to scrape FireRoad data.")
-        if not os.path.exists(fname):
-            with open(fname, "w", encoding="utf-8") as fireroad_file:
-                json.dump({}, fireroad_file)
-        return
-
-    courses: MutableMapping[str, Mapping[str, CourseValues]] = {}
-    term = url_name_to_term(get_term_info(sem_term)["urlName"])
-    missing = 0
-
-    for course in data:
-        included = get_course_data(courses, course, term)
-        if not included:
-            missing += 1
-
-    with open(fname, "w", encoding="utf-8") as fireroad_file:
-        json.dump(courses, fireroad_file)
-    print(f"Got {len (courses)} courses")
-    print(f"Skipped {missing} courses that are not offered in the {term.value} term")
+        for fname in fnames.values():
+            if not os.path.exists(fname):
+                write_atomic(fname, jsonio.dumps({}))
+        return {}
+
+    for sem_term, term in terms.items():
+        courses = courses_by_term[term]
+        checkpoint(courses, fnames[sem_term])
+        print(f"{sem_term}: got {len(courses)} courses")
+        print(
+            f"{sem_term}: skipped {total - included[term]} courses that are not "
+            f"offered in the {term.value} term"
+        )
+    return {sem_term: courses_by_term[term] for sem_term, term in terms.items()}
 
 
 if __name__ == "__main__":
-    run("sem")
-    run("presem")
+    run("sem", "presem")
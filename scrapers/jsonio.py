@@ -0,0 +1,277 @@
+"""
+Reads and writes all of the JSON in the scrapers, using orjson when it is installed
+and the standard library otherwise.
+
+Whichever backend is used, dumps() gives the same bytes as
+`json.dumps(obj, separators=(",", ":"))`: orjson writes UTF-8, so anything outside
+of printable ASCII is escaped afterwards, like the standard library does. orjson
+also writes very large and very small floats differently (1e16 instead of 1e+16),
+so output that might contain one is redone with the standard library. (The one
+exception is NaN and the infinities, which aren't valid JSON anyway; orjson writes
+them as null.)
+
+Run `python3 -m scrapers.jsonio` to compare the two backends on the term files in
+public/.
+
+Constants:
+    BACKEND: str
+
+Functions:
+    dumps(obj, sort_keys)
+    loads(data)
+    load(path)
+    dump(obj, path)
+"""
+
+from __future__ import annotations
+
+import codecs
+import json
+import re
+import sys
+import time
+from glob import glob
+from os import path as os_path
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, without it we use the standard library
+    orjson = None  # pylint: disable=invalid-name
+
+BACKEND = "json" if orjson is None else "orjson"
+
+# Where orjson might have written a float unlike float.__repr__ does: one from 1e16
+# on, in exponent form, or one below 1e-4, which orjson writes as 0.0000...
+# These also match inside strings, see _has_odd_float(). Both start with a literal,
+# so that searching for them is fast.
+_EXPONENT_REGEX = re.compile(rb"e(?<=\de)[-\d]")
+_SMALL_FLOAT_REGEX = re.compile(rb"0\.0000")
+
+
+def _escape(error: UnicodeError) -> tuple[str, int]:
+    """
+    Escapes the characters that can't be encoded as ASCII, the same way json.dumps
+    does. This is registered as the "jsonio.escape" codec error handler.
+
+    Args:
+        error (UnicodeError): The error, for a run of non-ASCII characters
+
+    Returns:
+        tuple[str, int]: The \\u escapes of the characters, as surrogate pairs if
+        needed, and where to continue encoding
+    """
+    assert isinstance(error, UnicodeEncodeError)
+    escaped = []
+    for char in error.object[error.start : error.end]:
+        code = ord(char)
+        if code < 0x10000:
+            escaped.append(f"\\u{code:04x}")
+        else:
+            code -= 0x10000
+            escaped.append(
+                f"\\u{0xD800 | (code >> 10):04x}\\u{0xDC00 | (code & 0x3FF):04x}"
+            )
+    return "".join(escaped), error.end
+
+
+codecs.register_error("jsonio.escape", _escape)
+
+
+def _has_odd_float(data: bytes) -> bool:
+    """
+    Checks whether orjson output might have a float written unlike json.dumps
+    would. Matches of the regexes inside strings, like in hex IDs, are skipped,
+    unless they look like the start of a value.
+
+    >>> _has_odd_float(b'{"a":[1.5,2e16]}')
+    True
+    >>> _has_odd_float(b'{"a":"x-1e9","b":0.5}')
+    False
+
+    Args:
+        data (bytes): The output of orjson
+
+    Returns:
+        bool: Whether the output should be redone with the standard library
+    """
+    for regex in (_EXPONENT_REGEX, _SMALL_FLOAT_REGEX):
+        for match in regex.finditer(data):
+            start = match.start()
+            while start and data[start - 1] in b"0123456789.":
+                start -= 1
+            if start and data[start - 1] == ord("-"):
+                start -= 1
+            if start and data[start - 1] in b":,[":
+                return True
+    return False
+
+
+def _str_keys(obj: Any) -> Any:
+    """
+    Converts the keys of every object in obj to the strings they are written as.
+
+    >>> _str_keys({2: [{None: 1.5}], "a": {True: 0}})
+    {'2': [{'null': 1.5}], 'a': {'true': 0}}
+
+    Args:
+        obj (Any): The data to convert
+
+    Returns:
+        Any: A copy of obj, with only string keys
+    """
+    if isinstance(obj, dict):
+        return {
+            key if isinstance(key, str) else json.dumps(key): _str_keys(value)
+            for key, value in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [_str_keys(value) for value in obj]
+    return obj
+
+
+def _dumps_stdlib(obj: Any, sort_keys: bool = False) -> bytes:
+    """
+    Serializes obj with the standard library.
+
+    Args:
+        obj (Any): The data to serialize
+        sort_keys (bool): Whether to sort the keys of objects, as strings, like
+            orjson does
+
+    Returns:
+        bytes: The compact JSON encoding of obj
+    """
+    if sort_keys:
+        # Otherwise 2 would come before 10, and mixed keys couldn't be sorted
+        obj = _str_keys(obj)
+    return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys).encode("utf-8")
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """
+    Serializes obj to compact, ASCII-only JSON.
+
+    >>> dumps({"b": [1, 2.5, None], "a": "caf\\u00e9 \\U0001f600"}, sort_keys=True)
+    b'{"a":"caf\\\\u00e9 \\\\ud83d\\\\ude00","b":[1,2.5,null]}'
+    >>> dumps({"x": 0, 10: 1, 2: 2}, sort_keys=True)
+    b'{"10":1,"2":2,"x":0}'
+    >>> dumps([1e16, 2.5e-05])
+    b'[1e+16,2.5e-05]'
+
+    Args:
+        obj (Any): The data to serialize
+        sort_keys (bool): Whether to sort the keys of objects, which are compared
+            as the strings they are written as
+
+    Returns:
+        bytes: The same bytes as `json.dumps(obj, separators=(",", ":"))`
+    """
+    if orjson is None:
+        return _dumps_stdlib(obj, sort_keys)
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    try:
+        data = orjson.dumps(obj, option=option)
+    except TypeError:
+        # Things orjson can't do, like integers beyond 64 bits
+        return _dumps_stdlib(obj, sort_keys)
+    if _has_odd_float(data):
+        return _dumps_stdlib(obj, sort_keys)
+    if not data.isascii():
+        data = data.decode("utf-8").encode("ascii", "jsonio.escape")
+    # json.dumps also escapes DEL, the one ASCII character that isn't printable
+    return data.replace(b"\x7f", b"\\u007f")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Deserializes JSON.
+
+    >>> loads(b'{"a":[1,"\\\\u00e9"]}')
+    {'a': [1, '\\xe9']}
+
+    Args:
+        data (Union[bytes, str]): The JSON to deserialize
+
+    Returns:
+        Any: The data
+    """
+    if orjson is None:
+        return json.loads(data)
+    return orjson.loads(data)
+
+
+def load(path: str) -> Any:
+    """
+    Reads a JSON file.
+
+    Args:
+        path (str): The file to read
+
+    Returns:
+        Any: The data in the file
+    """
+    with open(path, "rb") as file:
+        return loads(file.read())
+
+
+def dump(obj: Any, path: str) -> None:
+    """
+    Writes a JSON file, in the format of dumps().
+
+    Args:
+        obj (Any): The data to write
+        path (str): The file to write
+    """
+    with open(path, "wb") as file:
+        file.write(dumps(obj))
+
+
+def _benchmark(paths: list[str], repeat: int = 3) -> None:
+    """
+    Times both backends on the given files, and checks that they give the same
+    bytes.
+
+    Args:
+        paths (list[str]): The JSON files to use
+        repeat (int): How many times to time each step; the best time is kept
+    """
+    if orjson is None:
+        print("orjson is not installed, so there is nothing to compare")
+        return
+
+    def best(func: Any, arg: Any) -> float:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(arg)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    totals = dict.fromkeys(
+        ("json load", "orjson load", "json dump", "orjson dump"), 0.0
+    )
+    for path in paths:
+        with open(path, "rb") as file:
+            data = file.read()
+        obj = json.loads(data)
+        if dumps(obj) != _dumps_stdlib(obj):
+            print(f"{path}: the backends give different bytes!")
+        totals["json load"] += best(json.loads, data)
+        totals["orjson load"] += best(orjson.loads, data)  # pylint: disable=no-member
+        totals["json dump"] += best(_dumps_stdlib, obj)
+        totals["orjson dump"] += best(dumps, obj)
+
+    print(f"{len(paths)} files, best of {repeat}:")
+    for step in ("load", "dump"):
+        stdlib, fast = totals[f"json {step}"], totals[f"orjson {step}"]
+        print(
+            f"{step}: json {stdlib:.3f} s, orjson {fast:.3f} s ({stdlib / fast:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    _benchmark(
+        sys.argv[1:]
+        or sorted(glob(os_path.join(os_path.dirname(__file__), "../public/*.json")))
+    )
@@ -23,14 +23,16 @@ Functions:
 
 from __future__ import annotations
 
-import json
 import os
 import socket
 import statistics
 from functools import lru_cache
-from typing import TypedDict
+from typing import Optional, TypedDict
 from urllib.error import URLError
 
+from scrapers import jsonio
+from scrapers.fetch import write_atomic
+from scrapers.pipeline import checkpoint
 from scrapers.utils import read_csv
 
 # pylint: disable=line-too-long
@@ -120,9 +122,13 @@ def convert_data(rows: list[AccessPoint]) -> dict[str, BuildingInfo]:
     return out
 
 
-def run():
+def run() -> Optional[dict[str, BuildingInfo]]:
     """
     The main entry point. All data are written to `locations.json`.
+
+    Returns:
+        Optional[dict[str, BuildingInfo]]: The buildings, or None if they couldn't be
+        scraped
     """
     fname = os.path.join(os.path.dirname(__file__), "locations.json")
 
@@ -131,16 +137,15 @@ def run():
     except (URLError, socket.timeout, UnicodeDecodeError) as e:
         print(f"Unable to scrape locations data: {e}")
         if not os.path.exists(fname):
-            with open(fname, "w", encoding="utf-8") as location_file:
-                json.dump({}, location_file)
-        return
+            write_atomic(fname, jsonio.dumps({}))
+        return None
 
     locations = convert_data(rows)
 
-    with open(fname, "w", encoding="utf-8") as locations_file:
-        json.dump(locations, locations_file)
+    checkpoint(locations, fname)
 
     print(f"Processed location data for {len(locations)} buildings")
+    return locations
 
 
 if __name__ == "__main__":
@@ -0,0 +1,460 @@
+"""
+Describes each run of the pipeline in files meant for machines, so that the hourly
+cron job can be graphed and alerted on without reading its output.
+
+Every run of `python3 -m scrapers` writes, even if a stage fails:
+
+* MANIFEST_PATH, a JSON manifest of the run: when it started and how long it took;
+  for each stage, how long it took, whether it returned data, and how many records;
+  for each server downloaded from, the requests, bytes, HTTP statuses, cache hits,
+  retries and stale responses (see fetch.get_fetch_stats()); and for each
+  published term file, its size, number of classes, modification time and SHA-256.
+* METRICS_PATH, the same numbers in the Prometheus text format, for the textfile
+  collector of node_exporter. Every metric starts with METRIC_PREFIX.
+
+A server that isn't downloaded from successfully keeps the lastSuccess it had in the
+previous manifest, so a source that keeps failing shows up as stale rather than
+disappearing.
+
+Constants:
+    MANIFEST_FORMAT: int
+    MANIFEST_PATH: str
+    METRICS_PATH: str
+    METRIC_PREFIX: str
+
+Classes:
+    StageRecord
+    OutputRecord
+
+Functions:
+    record_stages(stages)
+    count_records(result)
+    build_manifest(started, finished, previous)
+    format_metrics(manifest)
+    write_run_files(started, manifest_path, metrics_path)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import os.path
+import time
+from collections.abc import Iterable, Mapping
+from typing import Any, Dict, TypedDict, Union
+
+from . import jsonio
+from .fetch import get_fetch_stats, write_atomic
+from .pipeline import Stage
+
+# Bump this when the layout of the manifest changes
+MANIFEST_FORMAT = 1
+
+MANIFEST_PATH = os.path.join(os.path.dirname(__file__), ".cache", "run-manifest.json")
+
+METRICS_PATH = os.path.join(os.path.dirname(__file__), ".cache", "hydrant.prom")
+
+METRIC_PREFIX = "hydrant_scrapers_"
+
+# The number of records of a stage, by term (or quarter) if it has several
+Records = Union[int, Dict[str, int]]
+
+
+class StageRecord(TypedDict):
+    """
+    What happened to a stage during the run.
+
+    Attributes:
+        seconds (float): The wall time of the stage
+        ok (bool): Whether it finished and returned any data; scrapers that fail
+            to download return nothing, and packaging falls back on their last
+            results
+        records (Records): The number of records it returned, by term or quarter
+            for the stages that return several
+        error (str): The exception it raised, if any
+    """
+
+    seconds: float
+    ok: bool
+    records: Records
+    error: str
+
+
+class OutputRecord(TypedDict):
+    """
+    A term file published by packaging.
+
+    Attributes:
+        bytes (int): The size of the file
+        classes (int): The number of classes in it
+        modified (float): When it was last rewritten, as a Unix time
+        sha256 (str): The hex digest of its contents
+    """
+
+    bytes: int
+    classes: int
+    modified: float
+    sha256: str
+
+
+_stages: dict[str, StageRecord] = {}
+_outputs: dict[str, OutputRecord] = {}
+
+
+def count_records(result: Any) -> Records:
+    """
+    Counts the records returned by a stage. The scrapers return a record per
+    class (or building), or a mapping of those per term or quarter, and packaging
+    returns a payload per term, with its classes.
+
+    >>> count_records({"6.100": {"name": "Intro"}, "6.101": {"name": "Fundies"}})
+    2
+    >>> count_records({"sem": {"6.100": {"name": "Intro"}}, "presem": {}})
+    {'sem': 1, 'presem': 0}
+    >>> count_records({"sem": {"termInfo": {"urlName": "f26"}, "classes": {}}})
+    {'sem': 0}
+    >>> count_records(None)
+    0
+
+    Args:
+        result (Any): What the stage returned
+
+    Returns:
+        Records: The number of records
+    """
+    if not isinstance(result, Mapping):
+        return 0
+    groups = list(result.values())
+    if groups and all(isinstance(group, Mapping) for group in groups):
+        if all("classes" in group for group in groups):
+            return {str(key): len(group["classes"]) for key, group in result.items()}
+        if all(
+            isinstance(record, Mapping) for group in groups for record in group.values()
+        ):
+            return {str(key): len(group) for key, group in result.items()}
+    return len(result)
+
+
+def _describe_outputs(payloads: Mapping[str, Mapping[str, Any]]) -> None:
+    """
+    Records the term files that packaging published.
+
+    Args:
+        payloads (Mapping[str, Mapping[str, Any]]): What package.run() returned
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from .package import get_output_path
+
+    for sem, payload in payloads.items():
+        path = get_output_path(sem, payload["termInfo"]["urlName"]) + ".json"
+        try:
+            with open(path, "rb") as output_file:
+                data = output_file.read()
+            modified = os.stat(path).st_mtime
+        except OSError:
+            continue
+        _outputs[os.path.basename(path)] = {
+            "bytes": len(data),
+            "classes": len(payload["classes"]),
+            "modified": modified,
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+
+
+def _recorded(stage: Stage) -> Stage:
+    """
+    Wraps the function of a stage, so that what happens to it is recorded.
+
+    Args:
+        stage (Stage): The stage
+
+    Returns:
+        Stage: The same stage, with its function wrapped
+    """
+
+    def run_recorded(**kwargs: Any) -> Any:
+        record: StageRecord = {"seconds": 0.0, "ok": False, "records": 0, "error": ""}
+        _stages[stage.name] = record
+        start = time.perf_counter()
+        try:
+            result = stage.func(**kwargs)
+        except Exception as error:
+            record["error"] = repr(error)
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+        record["ok"] = bool(result)
+        record["records"] = count_records(result)
+        if stage.name == "package" and result:
+            _describe_outputs(result)
+        return result
+
+    return stage._replace(func=run_recorded)
+
+
+def record_stages(stages: Iterable[Stage]) -> list[Stage]:
+    """
+    Starts recording a run, for build_manifest().
+
+    Args:
+        stages (Iterable[Stage]): The stages that are about to run
+
+    Returns:
+        list[Stage]: The stages to run instead, which record what happens to them
+    """
+    _stages.clear()
+    _outputs.clear()
+    return [_recorded(stage) for stage in stages]
+
+
+def build_manifest(
+    started: float, finished: float, previous: Mapping[str, Any] | None = None
+) -> dict[str, Any]:
+    """
+    Describes the run recorded since record_stages().
+
+    Args:
+        started (float): When the run started, as a Unix time
+        finished (float): When it finished, as a Unix time
+        previous (Mapping[str, Any] | None): The manifest of the previous run, to
+            carry over the last successful download from each server
+
+    Returns:
+        dict[str, Any]: The manifest
+    """
+    sources = get_fetch_stats()
+    for source, old in ((previous or {}).get("sources") or {}).items():
+        if source not in sources:
+            # Not downloaded from this run, so nothing but the last success counts
+            counts = dict.fromkeys(
+                ("requests", "bytes", "cacheHits", "errors", "retries", "staleHits"), 0
+            )
+            sources[source] = {**old, **counts, "statuses": {}}  # type: ignore
+        elif sources[source]["lastSuccess"] is None:
+            sources[source]["lastSuccess"] = old.get("lastSuccess")
+
+    stages = {name: dict(record) for name, record in _stages.items()}
+    return {
+        "format": MANIFEST_FORMAT,
+        "started": started,
+        "finished": finished,
+        "seconds": finished - started,
+        "ok": bool(stages) and all(stage["ok"] for stage in stages.values()),
+        "stages": stages,
+        "sources": dict(sorted(sources.items())),
+        "outputs": dict(_outputs),
+    }
+
+
+def _escape(label: str) -> str:
+    """
+    Escapes the value of a label for the text format.
+
+    >>> print(_escape('say "hi"'))
+    say \\"hi\\"
+
+    Args:
+        label (str): The value
+
+    Returns:
+        str: The value, with backslashes, quotes and newlines escaped
+    """
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _sample(name: str, value: float, **labels: str) -> str:
+    """
+    Formats a sample of a metric.
+
+    >>> _sample("run_seconds", 1.5)
+    'hydrant_scrapers_run_seconds 1.5'
+    >>> _sample("source_bytes", 512, source="fireroad.mit.edu")
+    'hydrant_scrapers_source_bytes{source="fireroad.mit.edu"} 512'
+
+    Args:
+        name (str): The name of the metric, without METRIC_PREFIX
+        value (float): The value of the sample
+        **labels (str): The labels of the sample
+
+    Returns:
+        str: A line of the text format
+    """
+    if not labels:
+        return f"{METRIC_PREFIX}{name} {value}"
+    escaped = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+    return f"{METRIC_PREFIX}{name}{{{escaped}}} {value}"
+
+
+def format_metrics(manifest: Mapping[str, Any]) -> str:
+    """
+    Converts a manifest to the Prometheus text format. Every metric is a gauge
+    describing the last run, except the last success of each server, which is
+    carried over between runs.
+
+    >>> print(format_metrics({"started": 10.0, "seconds": 2.5, "ok": True,
+    ...     "stages": {"pe": {"seconds": 2.5, "ok": True, "records": {"3": 40}}},
+    ...     "sources": {}, "outputs": {}}), end="")
+    # HELP hydrant_scrapers_run_start_timestamp_seconds When the last run started
+    # TYPE hydrant_scrapers_run_start_timestamp_seconds gauge
+    hydrant_scrapers_run_start_timestamp_seconds 10.0
+    # HELP hydrant_scrapers_run_duration_seconds How long the last run took
+    # TYPE hydrant_scrapers_run_duration_seconds gauge
+    hydrant_scrapers_run_duration_seconds 2.5
+    # HELP hydrant_scrapers_run_success Whether every stage returned data
+    # TYPE hydrant_scrapers_run_success gauge
+    hydrant_scrapers_run_success 1
+    # HELP hydrant_scrapers_stage_duration_seconds How long each stage took
+    # TYPE hydrant_scrapers_stage_duration_seconds gauge
+    hydrant_scrapers_stage_duration_seconds{stage="pe"} 2.5
+    # HELP hydrant_scrapers_stage_success Whether each stage returned data
+    # TYPE hydrant_scrapers_stage_success gauge
+    hydrant_scrapers_stage_success{stage="pe"} 1
+    # HELP hydrant_scrapers_stage_records The records returned by each stage
+    # TYPE hydrant_scrapers_stage_records gauge
+    hydrant_scrapers_stage_records{stage="pe",group="3"} 40
+
+    Args:
+        manifest (Mapping[str, Any]): A manifest from build_manifest()
+
+    Returns:
+        str: The metrics, one per line
+    """
+    metrics: dict[str, tuple[str, list[str]]] = {}
+
+    def add(name: str, description: str, value: float, **labels: str) -> None:
+        metrics.setdefault(name, (description, []))[1].append(
+            _sample(name, value, **labels)
+        )
+
+    add("run_start_timestamp_seconds", "When the last run started", manifest["started"])
+    add("run_duration_seconds", "How long the last run took", manifest["seconds"])
+    add(
+        "run_success",
+        "Whether every stage returned data",
+        int(manifest["ok"]),
+    )
+    for stage, record in manifest["stages"].items():
+        add(
+            "stage_duration_seconds",
+            "How long each stage took",
+            record["seconds"],
+            stage=stage,
+        )
+        add(
+            "stage_success",
+            "Whether each stage returned data",
+            int(record["ok"]),
+            stage=stage,
+        )
+        description = "The records returned by each stage"
+        if isinstance(record["records"], Mapping):
+            for group, count in record["records"].items():
+                add("stage_records", description, count, stage=stage, group=group)
+        else:
+            add("stage_records", description, record["records"], stage=stage)
+    for source, stats in manifest["sources"].items():
+        add(
+            "source_requests",
+            "Downloads started from each server",
+            stats["requests"],
+            source=source,
+        )
+        add(
+            "source_bytes",
+            "Bytes received from each server",
+            stats["bytes"],
+            source=source,
+        )
+        add(
+            "source_cache_hits",
+            "Responses from each server that were served from the cache",
+            stats["cacheHits"],
+            source=source,
+        )
+        add(
+            "source_errors",
+            "Failed downloads from each server",
+            stats["errors"],
+            source=source,
+        )
+        add(
+            "source_retries",
+            "Downloads from each server that were tried again",
+            stats["retries"],
+            source=source,
+        )
+        add(
+            "source_stale_hits",
+            "URLs of each server served from the cache because they failed",
+            stats["staleHits"],
+            source=source,
+        )
+        for status, count in stats["statuses"].items():
+            add(
+                "source_responses",
+                "Responses from each server, by HTTP status",
+                count,
+                source=source,
+                status=status,
+            )
+        if stats["lastSuccess"] is not None:
+            add(
+                "source_last_success_timestamp_seconds",
+                "When a download from each server last succeeded",
+                stats["lastSuccess"],
+                source=source,
+            )
+    for name, output in manifest["outputs"].items():
+        add(
+            "output_bytes",
+            "The size of each published term file",
+            output["bytes"],
+            file=name,
+        )
+        add(
+            "output_classes",
+            "The classes in each published term file",
+            output["classes"],
+            file=name,
+        )
+        add(
+            "output_modified_timestamp_seconds",
+            "When each published term file last changed",
+            output["modified"],
+            file=name,
+        )
+
+    lines = []
+    for name, (description, samples) in metrics.items():
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {description}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+        lines.extend(samples)
+    return "".join(f"{line}\n" for line in lines)
+
+
+def write_run_files(
+    started: float,
+    manifest_path: str = MANIFEST_PATH,
+    metrics_path: str = METRICS_PATH,
+) -> None:
+    """
+    Writes the manifest and the metrics of the run recorded since record_stages(),
+    each replaced atomically, so the textfile collector never reads half a file.
+
+    Args:
+        started (float): When the run started, as a Unix time
+        manifest_path (str): Where to write the manifest
+        metrics_path (str): Where to write the metrics
+    """
+    try:
+        previous = jsonio.load(manifest_path)
+    except (OSError, ValueError):
+        previous = None
+    if previous is not None and previous.get("format") != MANIFEST_FORMAT:
+        previous = None
+    manifest = build_manifest(started, time.time(), previous)
+    try:
+        write_atomic(manifest_path, jsonio.dumps(manifest))
+        write_atomic(metrics_path, format_metrics(manifest).encode("utf-8"))
+    except OSError as error:
+        print(f"Unable to write run manifest: {error}")
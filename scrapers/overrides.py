@@ -0,0 +1,200 @@
+"""
+Loads the override files, like those in overrides.toml.d/, keeping the parsed
+contents of each file in `.cache/overrides.pickle` so that only the files that have
+changed are parsed again.
+
+A file counts as changed when its modification time or size does. Changed files are
+also checked against their JSON schema, if they have one and the optional jsonschema
+package is installed; any problems are remembered with the file, and reported every
+time it is loaded until it is fixed.
+
+Constants:
+    OVERRIDES_CACHE: str
+    SCHEMA_PATH: str
+
+Classes:
+    CachedFile
+
+Functions:
+    load_overrides(path, schema_path)
+"""
+
+from __future__ import annotations
+
+import os
+import os.path
+import pickle
+import sys
+from typing import Any, Optional, TypedDict
+
+from . import jsonio
+from .fetch import write_atomic
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+OVERRIDES_CACHE = os.path.join(os.path.dirname(__file__), ".cache", "overrides.pickle")
+
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(__file__), "overrides.toml.d", "override-schema.json"
+)
+
+# Bump this when the format of the cache changes
+_CACHE_VERSION = 1
+
+_cache: dict[str, CachedFile] = {}
+_cache_loaded = False  # pylint: disable=invalid-name
+
+
+class CachedFile(TypedDict):
+    """
+    The parsed contents of an override file, and what they were parsed from.
+
+    Attributes:
+        stamp (tuple[int, int]): The modification time (in ns) and size of the file
+        schema_stamp (Optional[tuple[int, int]]): The same for its schema, if any
+        data (dict[str, Any]): The contents of the file
+        errors (list[str]): The ways in which the contents don't match the schema
+    """
+
+    stamp: tuple[int, int]
+    schema_stamp: Optional[tuple[int, int]]
+    data: dict[str, Any]
+    errors: list[str]
+
+
+def _stamp(path: str) -> tuple[int, int]:
+    """
+    Gets what changes when a file does.
+
+    Args:
+        path (str): The file
+
+    Returns:
+        tuple[int, int]: Its modification time, in nanoseconds, and its size
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load_cache() -> None:
+    """
+    Reads the cache from disk, the first time it is needed.
+    """
+    global _cache_loaded  # pylint: disable=global-statement
+    if _cache_loaded:
+        return
+    _cache_loaded = True
+    try:
+        with open(OVERRIDES_CACHE, "rb") as cache_file:
+            version, files = pickle.load(cache_file)
+    # A truncated or outdated pickle can raise almost anything, and the cache is
+    # only an optimization, so any failure just means parsing every file again
+    except Exception:  # pylint: disable=broad-exception-caught
+        return
+    if version == _CACHE_VERSION:
+        _cache.update(files)
+
+
+def _validate(data: dict[str, Any], schema_path: str) -> list[str]:
+    """
+    Checks the contents of an override file against a JSON schema.
+
+    Args:
+        data (dict[str, Any]): The contents of the file
+        schema_path (str): The schema
+
+    Returns:
+        list[str]: A description of each problem, or nothing if the contents are
+        valid or jsonschema isn't installed
+    """
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        from jsonschema import Draft7Validator
+    except ImportError:
+        return []
+    validator = Draft7Validator(jsonio.load(schema_path))
+    return [
+        f"{'/'.join(map(str, error.absolute_path)) or '(root)'}: {error.message}"
+        for error in validator.iter_errors(data)
+    ]
+
+
+def _load_file(path: str, schema_path: Optional[str]) -> tuple[dict[str, Any], bool]:
+    """
+    Gets the contents of an override file, from the cache if it hasn't changed.
+
+    Args:
+        path (str): The file
+        schema_path (Optional[str]): The schema to check it against, if any
+
+    Returns:
+        tuple[dict[str, Any], bool]: The contents, and whether they were parsed
+        again
+    """
+    stamp = _stamp(path)
+    schema_stamp = _stamp(schema_path) if schema_path else None
+    cached = _cache.get(path)
+    parsed = (
+        cached is None
+        or cached["stamp"] != stamp
+        or cached["schema_stamp"] != schema_stamp
+    )
+    if parsed:
+        with open(path, "rb") as toml_file:
+            data = tomllib.load(toml_file)
+        cached = {
+            "stamp": stamp,
+            "schema_stamp": schema_stamp,
+            "data": data,
+            "errors": _validate(data, schema_path) if schema_path else [],
+        }
+        _cache[path] = cached
+    assert cached is not None
+    for error in cached["errors"]:
+        print(f"Invalid override in {path}: {error}")
+    return cached["data"], parsed
+
+
+def load_overrides(path: str, schema_path: Optional[str] = None) -> dict[str, Any]:
+    """
+    Loads an override file, or a directory of them, in which case the TOML files
+    directly inside it are merged in order of their names.
+
+    Args:
+        path (str): The file or directory to load
+        schema_path (Optional[str]): The JSON schema the files should follow, if any
+
+    Returns:
+        dict[str, Any]: The overrides, which are empty if the path doesn't exist
+    """
+    _load_cache()
+    path = os.path.abspath(path)
+    if os.path.isfile(path):
+        paths = [path]
+    elif os.path.isdir(path):
+        paths = sorted(
+            entry.path
+            for entry in os.scandir(path)
+            if entry.is_file() and entry.name.endswith(".toml")
+        )
+    else:
+        return {}
+
+    out: dict[str, Any] = {}
+    changed = False
+    for file_path in paths:
+        data, parsed = _load_file(file_path, schema_path)
+        out.update(data)
+        changed |= parsed
+
+    if changed:
+        try:
+            write_atomic(
+                OVERRIDES_CACHE, pickle.dumps((_CACHE_VERSION, _cache), protocol=4)
+            )
+        except OSError as error:
+            print(f"Unable to save override cache: {error}")
+    return out
@@ -2,34 +2,85 @@
 We combine the data from the Fireroad API and the data we scrape from the
 catalog, into the format specified by src/lib/rawClass.ts.
 
+Each output file carries a content version, a hash of everything in it except
+lastUpdated. A file is only rewritten when its version changes, so quiet hours leave
+the published files (and their modification times) untouched. Compressed copies of
+every term file are written by scrapers/compress.py, and deltas from its recent
+versions by scrapers/delta.py.
+
+With `shard=True`, each term is also written as a directory of smaller files: an
+index.json with a summary of every class, enough for list views, and one file of
+full records per course (6.json, 18.json, 21L.json, ...), so that clients only
+download the courses they look at. See write_shards() for the layout.
+
+The terms are published to public/, unless set_output_dir() says otherwise.
+
+Constants:
+    SECTION_KEYS: tuple[str, ...]
+    SUMMARY_KEYS: tuple[str, ...]
+
 Functions:
     load_json_data(json_path)
+    load_toml_data(toml_path, schema_path)
     merge_data(datasets, keys_to_keep)
     get_include(include_dirs)
+    add_section_masks(item, keys)
+    content_version(payload)
+    publish(path, payload)
+    summarize_class(item)
+    write_shards(out_dir, payload, now)
+    get_pe_data(url_name, pe)
+    set_output_dir(directory)
+    get_output_path(sem, url_name)
     run()
 """
 
 from __future__ import annotations
 
 import datetime
-import json
+import hashlib
 import os
 import os.path
-import sys
-from collections.abc import Iterable
-from typing import Any
-
+from collections.abc import Iterable, Mapping
+from typing import Any, Optional
+
+from scrapers import jsonio
+from scrapers.compress import compress_file, compress_outputs
+from scrapers.delta import HISTORY_DIR, write_deltas
+from scrapers.fetch import write_atomic
+from scrapers.overrides import SCHEMA_PATH, load_overrides
 from scrapers.pe import get_pe_quarters
-from scrapers.utils import get_term_info
-
-if sys.version_info >= (3, 11):
-    import tomllib
-else:
-    import tomli as tomllib
-
+from scrapers.utils import SEM_TYPES, get_term_info, timeslot_mask
 
 package_dir = os.path.dirname(__file__)
 
+# Where the terms are published, and where their older versions are kept
+_public_dir = os.path.join(package_dir, "..", "public")  # pylint: disable=invalid-name
+_history_dir = HISTORY_DIR  # pylint: disable=invalid-name
+
+# The fields of each class that hold its sections
+SECTION_KEYS = (
+    "lectureSections",
+    "recitationSections",
+    "labSections",
+    "designSections",
+)
+
+# The fields of each class that are kept in the index of a sharded term
+SUMMARY_KEYS = (
+    "number",
+    "course",
+    "name",
+    "lectureUnits",
+    "labUnits",
+    "preparationUnits",
+    "isVariableUnits",
+    "lectureSectionMasks",
+    "recitationSectionMasks",
+    "labSectionMasks",
+    "designSectionMasks",
+)
+
 
 def load_json_data(json_path: str) -> Any:
     """
@@ -42,38 +93,23 @@ def load_json_data(json_path: str) -> Any:
         Any: The data contained within the file
     """
     json_path = os.path.join(package_dir, json_path)
-    with open(json_path, mode="r", encoding="utf-8") as json_file:
-        return json.load(json_file)
+    return jsonio.load(json_path)
 
 
-def load_toml_data(toml_path: str) -> dict[str, Any]:
+def load_toml_data(toml_path: str, schema_path: Optional[str] = None) -> dict[str, Any]:
     """
     Loads data from the provided TOML file, or directory that consists exclusively of
-    TOML files
+    TOML files. Unchanged files are read from the override cache, see
+    scrapers/overrides.py.
 
     Args:
         toml_path (str): The file or directory to load from
+        schema_path (Optional[str]): The JSON schema to check the files against
 
     Returns:
         dict[str, Any]: The data contained within the directory
     """
-    toml_path = os.path.join(package_dir, toml_path)
-
-    if os.path.isfile(toml_path):
-        with open(toml_path, "rb") as toml_file:
-            return tomllib.load(toml_file)
-    elif os.path.isdir(toml_path):
-        # If the path is a directory, we load all TOML files in it
-        out = {}
-        with os.scandir(toml_path) as entries:
-            for entry in entries:
-                if entry.is_file() and entry.name.endswith(".toml"):
-                    with open(entry.path, "rb") as toml_file:
-                        out.update(tomllib.load(toml_file))
-        return out
-    else:
-        # Neither a file nor a directory exists as this path, so we return an empty dict
-        return {}
+    return load_overrides(os.path.join(package_dir, toml_path), schema_path)
 
 
 def merge_data(
@@ -121,26 +157,263 @@ def get_include(overrides: dict[str, dict[str, Any]]) -> set[str]:
     return classes
 
 
-# pylint: disable=too-many-locals
-def run() -> None:
+def add_section_masks(item: dict[str, Any], keys: Iterable[str]) -> None:
+    """
+    Adds a timeslot mask for each section of a class, next to its sections: the
+    masks for "lectureSections" go in "lectureSectionMasks", and so on.
+
+    >>> item = {"sections": [([(0, 2)], "W31"), ([(34, 1)], "W31")]}
+    >>> add_section_masks(item, ["sections"])
+    >>> [mask.lstrip("0") for mask in item["sectionMasks"]]
+    ['3', '400000000']
+
+    Args:
+        item (dict[str, Any]): The class to modify
+        keys (Iterable[str]): The fields of sections to mask
+    """
+    for key in keys:
+        if key in item:
+            item[f"{key[:-1]}Masks"] = [timeslot_mask(slots) for slots, _ in item[key]]
+
+
+def content_version(payload: dict[str, Any]) -> str:
+    """
+    Computes a version for the data, which only changes when the data does. The
+    order of keys doesn't matter.
+
+    >>> content_version({"a": 1, "b": [2]}) == content_version({"b": [2], "a": 1})
+    True
+    >>> content_version({"a": 1}) == content_version({"a": 2})
+    False
+
+    Args:
+        payload (dict[str, Any]): The data to version
+
+    Returns:
+        str: A short hex digest of the data
+    """
+    return hashlib.sha256(jsonio.dumps(payload, sort_keys=True)).hexdigest()[:16]
+
+
+def publish(path: str, payload: dict[str, Any]) -> bool:
+    """
+    Writes the payload to path, unless the file there already has the same version.
+    The write is atomic, so clients never see a partially written file.
+
+    Args:
+        path (str): The file to write
+        payload (dict[str, Any]): The data to write, including its "version"
+
+    Returns:
+        bool: Whether the file was written
+    """
+    try:
+        if jsonio.load(path).get("version") == payload["version"]:
+            return False
+    except (OSError, ValueError):
+        pass  # missing or unreadable, so write it again
+    write_atomic(path, jsonio.dumps(payload))
+    return True
+
+
+def summarize_class(item: dict[str, Any]) -> dict[str, Any]:
+    """
+    Keeps the fields of a class that list views need, for the index of a sharded
+    term.
+
+    >>> summarize_class({"number": "6.3900", "name": "Intro", "prereqs": "6.100A"})
+    {'number': '6.3900', 'name': 'Intro'}
+
+    Args:
+        item (dict[str, Any]): The full record of the class
+
+    Returns:
+        dict[str, Any]: The summary of the class
+    """
+    return {key: item[key] for key in SUMMARY_KEYS if key in item}
+
+
+def write_shards(out_dir: str, payload: dict[str, Any], now: str) -> int:
+    """
+    Writes a term as a directory of smaller files:
+
+    * `index.json` has the termInfo, a summary of every class (see
+      summarize_class), and the version of each of the other files
+    * `<course>.json`, e.g. `6.json`, has the full records of the classes of that
+      course, under "classes"
+    * `pe.json` and `locations.json` have the PE classes and the locations
+
+    Like the unsharded files, each file has a "version" and is only rewritten when
+    that changes. Files of courses that are no longer offered are removed.
+
+    Args:
+        out_dir (str): The directory to write to
+        payload (dict[str, Any]): The termInfo, classes, pe and locations of the term
+        now (str): The time of this update
+
+    Returns:
+        int: The number of files that were written
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    shards: dict[str, dict[str, Any]] = {
+        "pe": {"pe": payload["pe"]},
+        "locations": {"locations": payload["locations"]},
+    }
+    for number, item in payload["classes"].items():
+        course = item.get("course", number.split(".")[0])
+        shards.setdefault(course, {"classes": {}})["classes"][number] = item
+
+    versions = {name: content_version(shard) for name, shard in shards.items()}
+    index = {
+        "termInfo": payload["termInfo"],
+        "classes": {
+            number: summarize_class(item) for number, item in payload["classes"].items()
+        },
+        "shards": dict(versions),
+    }
+    shards["index"] = index
+    versions["index"] = content_version(index)
+
+    written = 0
+    for name, shard in shards.items():
+        path = os.path.join(out_dir, f"{name}.json")
+        written += publish(
+            path, {"version": versions[name], "lastUpdated": now, **shard}
+        )
+        compress_file(path)
+
+    for name in os.listdir(out_dir):
+        if name.split(".")[0] not in shards:
+            os.remove(os.path.join(out_dir, name))
+    return written
+
+
+def get_pe_data(
+    url_name: str, pe: Optional[Mapping[int, dict[str, Any]]] = None
+) -> dict[int, dict[str, Any]]:
+    """
+    Gets the PE classes of each quarter of a term, with their overrides applied.
+
+    Args:
+        url_name (str): The urlName of the term
+        pe (Optional[Mapping[int, dict[str, Any]]]): The result of pe.run(); the
+            quarters missing from it are read from the files it saved last time
+
+    Returns:
+        dict[int, dict[str, Any]]: The classes of each quarter that has data
+    """
+    pe_data = {}
+    for quarter in get_pe_quarters(url_name):
+        pe_file = f"pe-q{quarter}.json"
+        pe_overrides_file = os.path.join("pe", f"pe-q{quarter}-overrides.toml")
+        if pe and quarter in pe:
+            quarter_data = pe[quarter]
+        elif os.path.isfile(os.path.join(package_dir, pe_file)):
+            quarter_data = load_json_data(pe_file)
+        else:
+            continue
+        quarter_overrides = load_toml_data(pe_overrides_file)
+        pe_data[quarter] = merge_data(
+            datasets=[quarter_data, quarter_overrides],
+            keys_to_keep=set(quarter_data),
+        )
+        for pe_class in pe_data[quarter].values():
+            add_section_masks(pe_class, ("sections",))
+    return pe_data
+
+
+def set_output_dir(directory: Optional[str]) -> None:
+    """
+    Publishes the terms to another directory instead of public/, for runs that
+    shouldn't replace the live files, like replays of recorded responses. The
+    directory keeps its own history of versions, so its deltas don't depend on what
+    was published to public/.
+
+    Args:
+        directory (Optional[str]): Where to publish the terms, or None for public/
+    """
+    global _public_dir, _history_dir  # pylint: disable=global-statement
+    if directory is None:
+        _public_dir = os.path.join(package_dir, "..", "public")
+        _history_dir = HISTORY_DIR
+    else:
+        _public_dir = directory
+        _history_dir = os.path.join(directory, ".versions")
+
+
+def get_output_path(sem: str, url_name: str) -> str:
+    """
+    Finds where a term is published: latest.json for the current term, and a file
+    named after the term for the others.
+
+    >>> os.path.basename(get_output_path("presem", "i26"))
+    'i26'
+
+    Args:
+        sem (str): The sem_type of the term
+        url_name (str): The urlName of the term
+
+    Returns:
+        str: The path of its files, without the ".json"
+    """
+    return os.path.join(_public_dir, "latest" if sem == "sem" else url_name)
+
+
+# pylint: disable=too-many-locals,too-many-arguments
+def run(
+    shard: bool = False,
+    *,
+    sems: Iterable[str] = SEM_TYPES,
+    fireroad: Optional[Mapping[str, dict[str, Any]]] = None,
+    catalog: Optional[dict[str, Any]] = None,
+    cim: Optional[dict[str, Any]] = None,
+    locations: Optional[dict[str, Any]] = None,
+    pe: Optional[Mapping[int, dict[str, Any]]] = None,
+) -> dict[str, dict[str, Any]]:
     """
     The main entry point.
     Takes data from fireroad.json and catalog.json; outputs latest.json.
-    There are no arguments and no return value.
-    """
 
-    sem_types = ("presem", "sem")  # presem = summer/IAP, sem = fall/spring
+    When run as part of the pipeline, the results of the scrapers are passed in
+    directly. Anything that isn't, for example because its scraper failed, is read
+    from the file its scraper saved last time.
+
+    Args:
+        shard (bool): Whether to also write each term as a directory of smaller
+            files, see write_shards()
+        sems (Iterable[str]): The sem_types to package
+        fireroad (Optional[Mapping[str, dict[str, Any]]]): The result of
+            fireroad.run(), the courses of each sem_term
+        catalog (Optional[dict[str, Any]]): The result of catalog.run()
+        cim (Optional[dict[str, Any]]): The result of cim.run()
+        locations (Optional[dict[str, Any]]): The result of locations.run()
+        pe (Optional[Mapping[int, dict[str, Any]]]): The result of pe.run(), the
+            classes of each quarter
 
-    catalog = load_json_data("catalog.json")
-    cim = load_json_data("cim.json")
-    locations = load_json_data("locations.json")
-    overrides_all = load_toml_data("overrides.toml.d")
+    Returns:
+        dict[str, dict[str, Any]]: The termInfo, classes, pe and locations of each
+        term that was packaged, by sem_type
+    """
+    if catalog is None:
+        catalog = load_json_data("catalog.json")
+    if cim is None:
+        cim = load_json_data("cim.json")
+    if locations is None:
+        locations = load_json_data("locations.json")
+    overrides_all = load_toml_data("overrides.toml.d", SCHEMA_PATH)
 
     now = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d %H:%M")
 
-    for sem in sem_types:
-        fireroad_sem = load_json_data(f"fireroad-{sem}.json")
-        overrides_sem = load_toml_data(os.path.join("overrides.toml.d", sem))
+    payloads = {}
+    for sem in sems:
+        if fireroad and sem in fireroad:
+            fireroad_sem = fireroad[sem]
+        else:
+            fireroad_sem = load_json_data(f"fireroad-{sem}.json")
+        overrides_sem = load_toml_data(
+            os.path.join("overrides.toml.d", sem), SCHEMA_PATH
+        )
 
         # The key needs to be in BOTH fireroad and catalog to make it:
         # If it's not in Fireroad, it's not offered in this semester (fall, etc.).
@@ -151,42 +424,48 @@ def run() -> None:
             | get_include(overrides_all)
             | get_include(overrides_sem),
         )
+        for course in courses.values():
+            add_section_masks(course, SECTION_KEYS)
 
         term_info = get_term_info(sem)
         url_name = term_info["urlName"]
 
-        pe_data = {}
-        for quarter in get_pe_quarters(url_name):
-            pe_file = f"pe-q{quarter}.json"
-            pe_overrides_file = os.path.join("pe", f"pe-q{quarter}-overrides.toml")
-            if os.path.isfile(os.path.join(package_dir, pe_file)):
-                quarter_data = load_json_data(pe_file)
-                quarter_overrides = load_toml_data(pe_overrides_file)
-                pe_data[quarter] = merge_data(
-                    datasets=[quarter_data, quarter_overrides],
-                    keys_to_keep=set(quarter_data),
-                )
-
-        with open(
-            os.path.join(
-                package_dir, f"../public/{'latest' if sem == 'sem' else url_name}.json"
-            ),
-            mode="w",
-            encoding="utf-8",
-        ) as file:
-            json.dump(
-                {
-                    "termInfo": term_info,
-                    "lastUpdated": now,
-                    "classes": courses,
-                    "pe": pe_data,
-                    "locations": locations,
-                },
-                file,
-                separators=(",", ":"),
+        pe_data = get_pe_data(url_name, pe)
+
+        payload = {
+            "termInfo": term_info,
+            "classes": courses,
+            "pe": pe_data,
+            "locations": locations,
+        }
+        version = content_version(payload)
+        out_name = get_output_path(sem, url_name)
+        payloads[sem] = payload
+        written = publish(
+            f"{out_name}.json", {"version": version, "lastUpdated": now, **payload}
+        )
+        status = " (unchanged)"
+        if written:
+            deltas_written = write_deltas(
+                f"{out_name}.json", payload, version, now, _history_dir
             )
-
-        print(f"{url_name}: got {len(courses)} courses")
+            status = f", {deltas_written} deltas"
+        print(f"{url_name}: got {len(courses)} courses, version {version}{status}")
+        if shard:
+            shards_written = write_shards(out_name, payload, now)
+            print(f"{url_name}: wrote {shards_written} changed shards")
+
+    sizes = compress_outputs(_public_dir)
+    totals = {
+        kind: sum(file_sizes.get(kind, 0) for file_sizes in sizes.values())
+        for kind in ("json", "gz", "br")
+    }
+    print(
+        f"Compressed {len(sizes)} term files, {totals['json']} bytes: "
+        f"{totals['gz']} bytes gzip"
+        + (f", {totals['br']} bytes brotli" if totals["br"] else "")
+    )
+    return payloads
 
 
 if __name__ == "__main__":
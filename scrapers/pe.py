@@ -4,7 +4,6 @@ Adds information from PE&W subjects, as given by DAPER.
 
 from __future__ import annotations
 
-import json
 import os
 import socket
 import time as time_c
@@ -12,11 +11,10 @@ from datetime import date, time
 from functools import lru_cache
 from typing import Literal, Optional, TypedDict
 from urllib.error import URLError
-from urllib.request import Request, urlopen
-
-from bs4 import BeautifulSoup
 
+from scrapers.fetch import fetch
 from scrapers.fireroad import parse_section
+from scrapers.pipeline import checkpoint
 from scrapers.utils import Term, read_csv
 
 PE_CATALOG = (
@@ -415,10 +413,17 @@ def get_pe_catalog_descriptions() -> dict[str, str]:
         dict[str, str]: A dictionary mapping course numbers to their descriptions.
     """
 
-    request = Request(PE_CATALOG)
-    request.add_header("User-Agent", "Mozilla/5.0 (compatible; HydrantBot/1.0)")
-    with urlopen(request, timeout=15) as response:
-        soup = BeautifulSoup(response.read().decode("utf-8"), features="lxml")
+    body = fetch(
+        PE_CATALOG,
+        timeout=15,
+        headers={"User-Agent": "Mozilla/5.0 (compatible; HydrantBot/1.0)"},
+    )
+    # Imported here, so that packaging, which only needs get_pe_quarters(), doesn't
+    # pay for BeautifulSoup
+    # pylint: disable-next=import-outside-toplevel
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body.decode("utf-8"), features="lxml")
 
     accordions = soup.select("div.accordion")
     descriptions: dict[str, str] = {}
@@ -494,8 +499,7 @@ def run() -> dict[int, dict[str, PEWSchema]]:
         print(f"Processed PE data for quarter {quarter}: {len(quarter_data)} subjects")
         fname = os.path.join(os.path.dirname(__file__), f"pe-q{quarter}.json")
 
-        with open(fname, "w", encoding="utf-8") as pe_output_file:
-            json.dump(quarter_data, pe_output_file)
+        checkpoint(quarter_data, fname)
 
     return pe_data
 
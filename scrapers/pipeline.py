@@ -0,0 +1,273 @@
+"""
+Runs the scrapers as a graph of stages. A stage starts as soon as every stage it
+depends on has finished, so independent network-bound stages overlap.
+
+The result of each stage is handed directly to the stages that depend on it. The
+scrapers also save their results as JSON files, so that a stage can be run on its
+own later, but those checkpoints are written in the background by checkpoint().
+
+Classes:
+    Stage
+
+Functions:
+    order_stages(stages)
+    select_stages(stages, only, skip)
+    run_stages(stages, serial)
+    print_timings(timings)
+    checkpoint(obj, path)
+    set_checkpoints(enabled)
+    wait_for_checkpoints()
+"""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Callable, Collection, Iterable, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, NamedTuple, Optional
+
+from .fetch import write_atomic
+from .jsonio import dumps
+from .profiling import run_profiled
+
+_checkpoint_writer = ThreadPoolExecutor(max_workers=1)
+_checkpoints: list[tuple[str, Future[None]]] = []
+_checkpoints_enabled = True  # pylint: disable=invalid-name
+
+
+class Stage(NamedTuple):
+    """
+    A single step of the pipeline.
+
+    Attributes:
+        name (str): A short identifier, used for dependencies and reporting
+        title (str): A human-readable description, printed when the stage starts
+        func (Callable[..., Any]): The function that does the work. It is called
+            with the result of each stage it depends on, as a keyword argument
+            named after that stage.
+        deps (tuple[str, ...]): Names of stages that must finish first
+    """
+
+    name: str
+    title: str
+    func: Callable[..., Any]
+    deps: tuple[str, ...] = ()
+
+
+def order_stages(stages: Iterable[Stage]) -> list[Stage]:
+    """
+    Sorts stages so that every stage comes after its dependencies, keeping the
+    given order otherwise.
+
+    >>> stages = [Stage("b", "", print, ("a",)), Stage("a", "", print)]
+    >>> [stage.name for stage in order_stages(stages)]
+    ['a', 'b']
+
+    Args:
+        stages (Iterable[Stage]): The stages to sort
+
+    Raises:
+        ValueError: If a dependency is unknown, or the dependencies have a cycle
+
+    Returns:
+        list[Stage]: The stages, in an order where they can be run serially
+    """
+    remaining = list(stages)
+    names = {stage.name for stage in remaining}
+    for stage in remaining:
+        unknown = set(stage.deps) - names
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown {unknown}")
+
+    ordered: list[Stage] = []
+    done: set[str] = set()
+    while remaining:
+        ready = [stage for stage in remaining if done.issuperset(stage.deps)]
+        if not ready:
+            raise ValueError(f"Cycle between stages {[s.name for s in remaining]}")
+        stage = ready[0]
+        ordered.append(stage)
+        done.add(stage.name)
+        remaining.remove(stage)
+    return ordered
+
+
+def select_stages(
+    stages: Iterable[Stage],
+    only: Optional[Collection[str]] = None,
+    skip: Collection[str] = (),
+) -> list[Stage]:
+    """
+    Picks the stages to run. A stage whose dependencies were left out runs without
+    their results, and is expected to fall back to what they saved last time.
+
+    >>> stages = [Stage("a", "", print), Stage("b", "", print, ("a",))]
+    >>> [(stage.name, stage.deps) for stage in select_stages(stages, only=["b"])]
+    [('b', ())]
+    >>> [stage.name for stage in select_stages(stages, skip=["b"])]
+    ['a']
+
+    Args:
+        stages (Iterable[Stage]): All of the stages
+        only (Optional[Collection[str]]): The stages to run, or None for all of them
+        skip (Collection[str]): The stages not to run
+
+    Raises:
+        ValueError: If a stage name is unknown
+
+    Returns:
+        list[Stage]: The selected stages
+    """
+    stages = list(stages)
+    unknown = (set(only or ()) | set(skip)) - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown}")
+    selected = [
+        stage
+        for stage in stages
+        if (only is None or stage.name in only) and stage.name not in skip
+    ]
+    names = {stage.name for stage in selected}
+    return [
+        stage._replace(deps=tuple(dep for dep in stage.deps if dep in names))
+        for stage in selected
+    ]
+
+
+def _run_stage(stage: Stage, results: dict[str, Any]) -> tuple[float, Any]:
+    """
+    Runs a single stage.
+
+    Args:
+        stage (Stage): The stage to run
+        results (dict[str, Any]): The results of the stages that have finished,
+            including every stage this one depends on
+
+    Returns:
+        tuple[float, Any]: The wall time of the stage in seconds, and its result
+    """
+    print(f"=== {stage.title} ===")
+    start = time.perf_counter()
+    result = run_profiled(
+        stage.name, stage.func, {dep: results[dep] for dep in stage.deps}
+    )
+    return time.perf_counter() - start, result
+
+
+def run_stages(stages: Sequence[Stage], serial: bool = False) -> dict[str, float]:
+    """
+    Runs the stages, respecting their dependencies.
+
+    If serial is True, the stages run one after another in dependency order.
+    Otherwise, each stage runs in its own thread as soon as it is ready. If a stage
+    raises, the stages that depend on it are not started, the stages already running
+    are allowed to finish, and then the first exception is raised again.
+
+    >>> stages = [
+    ...     Stage("a", "A", lambda: 2),
+    ...     Stage("b", "B", lambda a: print(a + 1), ("a",)),
+    ... ]
+    >>> _ = run_stages(stages, serial=True)
+    === A ===
+    === B ===
+    3
+
+    Args:
+        stages (Sequence[Stage]): The stages to run
+        serial (bool): Whether to run the stages one at a time
+
+    Returns:
+        dict[str, float]: The wall time of each stage that ran, in seconds
+    """
+    ordered = order_stages(stages)
+    timings: dict[str, float] = {}
+    results: dict[str, Any] = {}
+
+    if serial:
+        for stage in ordered:
+            timings[stage.name], results[stage.name] = _run_stage(stage, results)
+        return timings
+
+    pending = list(ordered)
+    running: dict[Future[tuple[float, Any]], Stage] = {}
+    errors: list[BaseException] = []
+
+    with ThreadPoolExecutor(max_workers=len(ordered) or 1) as executor:
+        while pending or running:
+            if not errors:
+                ready = [
+                    stage for stage in pending if set(stage.deps).issubset(timings)
+                ]
+                for stage in ready:
+                    pending.remove(stage)
+                    running[executor.submit(_run_stage, stage, results)] = stage
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    timings[stage.name], results[stage.name] = future.result()
+                else:
+                    print(f"Stage {stage.name} failed: {error!r}")
+                    errors.append(error)
+
+    if errors:
+        raise errors[0]
+    return timings
+
+
+def print_timings(timings: dict[str, float]) -> None:
+    """
+    Prints the wall time of each stage.
+
+    >>> print_timings({"catalog": 12.5, "package": 0.25})
+    === Stage timings ===
+    catalog    12.50 s
+    package     0.25 s
+
+    Args:
+        timings (dict[str, float]): The wall time of each stage, in seconds
+    """
+    print("=== Stage timings ===")
+    width = max((len(name) for name in timings), default=0)
+    for name, seconds in timings.items():
+        print(f"{name:<{width}} {seconds:8.2f} s")
+
+
+def checkpoint(obj: Any, path: str) -> None:
+    """
+    Saves the result of a stage as a JSON file, in the background, unless
+    checkpoints are turned off. The file is replaced atomically once it is written.
+
+    Args:
+        obj (Any): The result to save
+        path (str): The file to save it to
+    """
+    if _checkpoints_enabled:
+        future = _checkpoint_writer.submit(lambda: write_atomic(path, dumps(obj)))
+        _checkpoints.append((path, future))
+
+
+def set_checkpoints(enabled: bool) -> None:
+    """
+    Turns checkpoints on or off. They are on by default.
+
+    Args:
+        enabled (bool): Whether checkpoint() saves anything
+    """
+    global _checkpoints_enabled  # pylint: disable=global-statement
+    _checkpoints_enabled = enabled
+
+
+def wait_for_checkpoints() -> None:
+    """
+    Waits until every checkpoint has been written, reporting any that failed.
+    """
+    while _checkpoints:
+        path, future = _checkpoints.pop(0)
+        error = future.exception()
+        if error is not None:
+            print(f"Unable to write checkpoint {path}: {error!r}")
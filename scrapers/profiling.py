@@ -0,0 +1,226 @@
+"""
+Profiles the stages of the pipeline, for when a run gets slow. Turned on with
+`python3 -m scrapers --profile` and `--trace-memory`.
+
+Each run gets its own directory under PROFILE_DIR, named after the time it started,
+with for each stage:
+
+* `<stage>.pstats`, from cProfile, to open with `python3 -m pstats` or snakeviz
+* `<stage>-memory.txt`, from tracemalloc: the peak memory of the stage, and the
+  TOP_ALLOCATIONS lines that allocated the most memory still held when it ended
+
+and `summary.txt`, the table printed by print_profile_summary().
+
+cProfile only sees the thread that runs the stage, and tracemalloc sees every
+thread, so stages should run one at a time while profiling, and code that would
+hand work to other threads should check profiling_enabled() and do it itself, like
+the catalog crawl does. Both slow the stages
+down, cProfile by up to about 2x, but not so much that a single cron run can't be
+profiled.
+
+Constants:
+    PROFILE_DIR: str
+    TOP_ALLOCATIONS: int
+
+Classes:
+    StageProfile
+
+Functions:
+    set_profiling(cpu, memory, directory)
+    profiling_enabled()
+    run_profiled(name, func, kwargs)
+    print_profile_summary()
+"""
+
+from __future__ import annotations
+
+import cProfile
+import os
+import os.path
+import pstats
+import time
+import tracemalloc
+from collections.abc import Callable, Mapping
+from typing import Any, Optional, TypedDict
+
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), ".cache", "profiles")
+
+TOP_ALLOCATIONS = 25
+
+_run_dir = ""  # pylint: disable=invalid-name
+_cpu = False  # pylint: disable=invalid-name
+_memory = False  # pylint: disable=invalid-name
+
+
+class StageProfile(TypedDict):
+    """
+    What profiling found about a stage.
+
+    Attributes:
+        stage (str): The name of the stage
+        seconds (float): The wall time of the stage, while profiled
+        top_function (str): The function that took the most time by itself, if
+            cProfile was on
+        peak_bytes (int): The peak memory allocated during the stage, if
+            tracemalloc was on
+        held_bytes (int): The memory allocated during the stage and still held at
+            the end of it, if tracemalloc was on
+    """
+
+    stage: str
+    seconds: float
+    top_function: str
+    peak_bytes: int
+    held_bytes: int
+
+
+_profiles: list[StageProfile] = []
+
+
+def set_profiling(cpu: bool, memory: bool, directory: Optional[str] = None) -> str:
+    """
+    Turns profiling on or off. It is off by default.
+
+    Args:
+        cpu (bool): Whether to profile each stage with cProfile
+        memory (bool): Whether to trace the allocations of each stage
+        directory (Optional[str]): Where to write the reports; by default, a new
+            directory under PROFILE_DIR
+
+    Returns:
+        str: The directory the reports are written to, or "" if profiling is off
+    """
+    global _run_dir, _cpu, _memory  # pylint: disable=global-statement
+    _cpu, _memory = cpu, memory
+    _run_dir = ""
+    if cpu or memory:
+        _run_dir = directory or os.path.join(
+            PROFILE_DIR, time.strftime("%Y%m%d-%H%M%S")
+        )
+        os.makedirs(_run_dir, exist_ok=True)
+    return _run_dir
+
+
+def profiling_enabled() -> bool:
+    """
+    Checks whether stages are profiled.
+
+    Returns:
+        bool: Whether either kind of profiling is on
+    """
+    return _cpu or _memory
+
+
+def _top_function(profiler: cProfile.Profile) -> str:
+    """
+    Finds the function that took the most time by itself.
+
+    Args:
+        profiler (cProfile.Profile): The profile of a stage
+
+    Returns:
+        str: The function, as `file:line(name)`, or "" if nothing was profiled
+    """
+    stats = pstats.Stats(profiler).stats  # type: ignore[attr-defined]
+    if not stats:
+        return ""
+    (path, line, name), _ = max(stats.items(), key=lambda item: item[1][2])
+    return f"{os.path.basename(path)}:{line}({name})"
+
+
+def _write_memory_report(
+    path: str, snapshot: tracemalloc.Snapshot, peak: int, held: int
+) -> None:
+    """
+    Writes the memory report of a stage.
+
+    Args:
+        path (str): The file to write
+        snapshot (tracemalloc.Snapshot): The allocations held at the end of the stage
+        peak (int): The peak memory allocated during the stage, in bytes
+        held (int): The memory still held at the end of the stage, in bytes
+    """
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    with open(path, "w", encoding="utf-8") as report:
+        report.write(
+            f"Peak: {peak / 2**20:.1f} MiB, still held at the end: "
+            f"{held / 2**20:.1f} MiB\n\n"
+            f"Top {TOP_ALLOCATIONS} lines by memory still held:\n"
+        )
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+            report.write(f"{stat}\n")
+
+
+def run_profiled(name: str, func: Callable[..., Any], kwargs: Mapping[str, Any]) -> Any:
+    """
+    Calls the function of a stage, profiling it if profiling is on, and writes its
+    reports.
+
+    Args:
+        name (str): The name of the stage
+        func (Callable[..., Any]): The function of the stage
+        kwargs (Mapping[str, Any]): The keyword arguments to call it with
+
+    Returns:
+        Any: What the function returns
+    """
+    if not profiling_enabled():
+        return func(**kwargs)
+
+    profiler = cProfile.Profile() if _cpu else None
+    if _memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            return profiler.runcall(func, **kwargs)
+        return func(**kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        profile: StageProfile = {
+            "stage": name,
+            "seconds": seconds,
+            "top_function": "",
+            "peak_bytes": 0,
+            "held_bytes": 0,
+        }
+        if _memory:
+            snapshot = tracemalloc.take_snapshot()
+            profile["held_bytes"], profile["peak_bytes"] = (
+                tracemalloc.get_traced_memory()
+            )
+            tracemalloc.stop()
+            _write_memory_report(
+                os.path.join(_run_dir, f"{name}-memory.txt"),
+                snapshot,
+                profile["peak_bytes"],
+                profile["held_bytes"],
+            )
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(_run_dir, f"{name}.pstats"))
+            profile["top_function"] = _top_function(profiler)
+        _profiles.append(profile)
+
+
+def print_profile_summary() -> None:
+    """
+    Prints a line for each profiled stage, and saves the same table as
+    `summary.txt` in the run directory.
+    """
+    if not _profiles:
+        return
+    width = max(len(profile["stage"]) for profile in _profiles)
+    lines = [f"=== Profiles, in {_run_dir} ==="]
+    for profile in _profiles:
+        line = f"{profile['stage']:<{width}} {profile['seconds']:8.2f} s"
+        if _memory:
+            line += (
+                f" {profile['peak_bytes'] / 2**20:8.1f} MiB peak"
+                f" {profile['held_bytes'] / 2**20:8.1f} MiB held"
+            )
+        if profile["top_function"]:
+            line += f"  top: {profile['top_function']}"
+        lines.append(line)
+    print("\n".join(lines))
+    with open(os.path.join(_run_dir, "summary.txt"), "w", encoding="utf-8") as file:
+        file.write("\n".join(lines[1:]) + "\n")
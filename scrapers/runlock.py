@@ -0,0 +1,144 @@
+"""
+Keeps runs of the pipeline from overlapping, since two runs would race on the
+results of the scrapers and on public/. The hourly cron job starts a run whether or
+not the last one has finished, for example when the catalog is slow.
+
+A run holds an exclusive lock on LOCK_PATH while it runs. A run started while
+another holds it doesn't wait: it leaves PENDING_PATH behind and exits. When the
+running one finishes, it sees that file and runs once more, so any number of
+triggers during a run are coalesced into a single follow-up run, which starts with
+fresh data. The lock is released by the operating system if a run dies, so a crash
+never leaves a stale lock.
+
+The running one only looks for PENDING_PATH after letting go of the lock, so that a
+request can't slip by unseen, which means a run started by that request may take
+the lock first. The follow-up then finds the lock taken, and exits without asking
+for another run, since the run holding the lock started after the request and
+already satisfies it. So there is never more than one follow-up.
+
+The cron job runs deploy/cron_scripts/update_latest.sh, which takes a lock of its
+own in the same way around the whole update, including pulling the code and
+copying the results, so this lock is what keeps manual runs from overlapping with
+it.
+
+Locking uses fcntl, so on Windows runs aren't coordinated at all.
+
+Constants:
+    LOCK_PATH: str
+    PENDING_PATH: str
+
+Functions:
+    acquire_run_lock(lock_path, pending_path, follow_up)
+    release_run_lock(lock, pending_path)
+"""
+
+from __future__ import annotations
+
+import os
+import os.path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where runs are left uncoordinated
+    fcntl = None  # type: ignore  # pylint: disable=invalid-name
+
+LOCK_PATH = os.path.join(os.path.dirname(__file__), ".cache", "run.lock")
+
+PENDING_PATH = os.path.join(os.path.dirname(__file__), ".cache", "run.pending")
+
+
+def _try_lock(fd: int) -> bool:
+    """
+    Takes the lock of an open file, without waiting.
+
+    Args:
+        fd (int): The file
+
+    Returns:
+        bool: Whether the lock was taken, as opposed to held by another process
+    """
+    assert fcntl is not None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def acquire_run_lock(
+    lock_path: str = LOCK_PATH,
+    pending_path: str = PENDING_PATH,
+    follow_up: bool = False,
+) -> Optional[int]:
+    """
+    Starts a run, unless another one is running, in which case it is asked to run
+    again once it finishes (unless this is a follow-up run).
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> paths = os.path.join(directory, "run.lock"), os.path.join(directory, "pending")
+    >>> lock = acquire_run_lock(*paths)
+    >>> acquire_run_lock(*paths) is None
+    True
+    >>> release_run_lock(lock, paths[1])
+    True
+    >>> release_run_lock(acquire_run_lock(*paths), paths[1])
+    False
+    >>> lock = acquire_run_lock(*paths)
+    >>> acquire_run_lock(*paths, follow_up=True) is None
+    True
+    >>> release_run_lock(lock, paths[1])
+    False
+
+    Args:
+        lock_path (str): The lock file
+        pending_path (str): The file asking the running run for a follow-up
+        follow_up (bool): Whether this run is the follow-up asked for during the
+            last one, which a run holding the lock already satisfies
+
+    Returns:
+        Optional[int]: The lock, to pass to release_run_lock() when the run is
+        done, or None if another run holds it
+    """
+    if fcntl is None:
+        return -1
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+    if not _try_lock(fd):
+        if follow_up:
+            os.close(fd)
+            return None
+        with open(pending_path, "wb"):
+            pass
+        # The other run may have finished before it could see the request
+        if not _try_lock(fd):
+            os.close(fd)
+            return None
+    # This run starts after every request so far, so it satisfies them
+    try:
+        os.unlink(pending_path)
+    except FileNotFoundError:
+        pass
+    return fd
+
+
+def release_run_lock(lock: int, pending_path: str = PENDING_PATH) -> bool:
+    """
+    Ends a run started by acquire_run_lock().
+
+    Args:
+        lock (int): What acquire_run_lock() returned
+        pending_path (str): The file asking for a follow-up run
+
+    Returns:
+        bool: Whether another run was asked for while this one was running, in
+        which case the caller should start it
+    """
+    if fcntl is None:
+        return False
+    fcntl.flock(lock, fcntl.LOCK_UN)
+    os.close(lock)
+    # Checked after unlocking, so that a request made just before can't be missed:
+    # whoever made it either took the lock itself, or is seen here
+    return os.path.exists(pending_path)
@@ -17,14 +17,16 @@ Constants:
 
 from __future__ import annotations
 
-import json
+import os.path
 from collections.abc import Mapping
 from typing import Iterable
 
 from nltk.tokenize import sent_tokenize, word_tokenize
 
+from scrapers import jsonio
+
 KEYWORDS = ["limited", "restricted", "enrollment", "preference", "priority"]
-FOLDER = "../public/"
+FOLDER = os.path.join(os.path.dirname(__file__), "../public/")
 FILEPATHS = ["f22.json", "f23.json", "f24.json", "i25.json", "s23.json", "s24.json"]
 
 
@@ -87,9 +89,8 @@ def get_my_data() -> list[str]:
     descriptions: list[str] = []
     for filepath in FILEPATHS:
         full_path = FOLDER + filepath
-        with open(full_path, "r", encoding="utf-8") as file:
-            rawdata = json.load(file)
-            descriptions.extend(get_description_list(rawdata))
+        rawdata = jsonio.load(full_path)
+        descriptions.extend(get_description_list(rawdata))
     return descriptions
 
 
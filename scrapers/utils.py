@@ -7,26 +7,43 @@ Constants:
     DAYS: dict[str, int]
     TIMES: dict[str, int]
     EVE_TIMES: dict[str, int]
+    TIMESLOT_TABLE: dict[tuple[str, str, bool], int]
+    MASK_WIDTH: int
+    SEM_TYPES: tuple[str, ...]
     Term: enum.EnumType
 
 Functions:
     find_timeslot(day, slot, pm)
+    timeslot_mask(slots)
     zip_strict(*iterables)
     grouper(iterable, n)
     get_term_info(sem_term)
     url_name_to_term(url_name)
+    iter_json_array(chunks)
 """
 
 from __future__ import annotations
 
+import codecs
 import csv
 import json
 import os.path
 from enum import Enum
 from itertools import zip_longest
-from typing import Any, Generator, Iterable, Literal, Union, get_args, get_origin
+from typing import (
+    Any,
+    Generator,
+    Iterable,
+    Iterator,
+    Literal,
+    Union,
+    get_args,
+    get_origin,
+)
 from urllib.parse import urlparse
-from urllib.request import urlopen
+
+from . import jsonio
+from .fetch import fetch
 
 GIR_REWRITE = {
     "GIR:CAL1": "Calculus I (GIR)",
@@ -99,6 +116,20 @@ EVE_TIMES = {
     "10.30": 33,
 }
 
+# Maps (day, slot, is_slot_pm) to the numeric code for the timeslot
+TIMESLOT_TABLE: dict[tuple[str, str, bool], int] = {
+    (day, slot, is_slot_pm): day_offset + slot_offset
+    for is_slot_pm, time_dict in ((False, TIMES), (True, EVE_TIMES))
+    for day, day_offset in DAYS.items()
+    for slot, slot_offset in time_dict.items()
+}
+
+# Number of hex digits in a timeslot mask, enough for one bit per slot of the week
+MASK_WIDTH = (len(DAYS) * TIMESLOTS + 3) // 4
+
+# presem = summer/IAP, sem = fall/spring
+SEM_TYPES = ("presem", "sem")
+
 MONTHS = {
     "jan": 1,
     "feb": 2,
@@ -142,10 +173,31 @@ def find_timeslot(day: str, slot: str, is_slot_pm: bool) -> int:
     Returns:
         int: A numeric code for the timeslot
     """
-    time_dict = EVE_TIMES if is_slot_pm else TIMES
-    if day not in DAYS or slot not in time_dict:  # error handling!
-        raise ValueError(f"Invalid timeslot {day}, {slot}, {is_slot_pm}")
-    return DAYS[day] + time_dict[slot]
+    try:
+        return TIMESLOT_TABLE[day, slot, is_slot_pm]
+    except KeyError:  # error handling!
+        raise ValueError(f"Invalid timeslot {day}, {slot}, {is_slot_pm}") from None
+
+
+def timeslot_mask(slots: Iterable[tuple[int, int]]) -> str:
+    """
+    Encodes the timeslots a section occupies as a bitmask, where bit i is set if
+    the section meets during slot i. Two sections conflict exactly when their
+    masks have a bit in common.
+
+    >>> timeslot_mask([(0, 2), (36, 1)])
+    '0000000000000000000000000000000001000000003'
+
+    Args:
+        slots (Iterable[tuple[int, int]]): The (start slot, length) of each meeting
+
+    Returns:
+        str: The mask as a hex string of MASK_WIDTH digits, most significant first
+    """
+    mask = 0
+    for start, length in slots:
+        mask |= ((1 << length) - 1) << start
+    return f"{mask:0{MASK_WIDTH}x}"
 
 
 def zip_strict(*iterables: Iterable[Any]) -> Generator[tuple[Any, ...], Any, None]:
@@ -205,8 +257,7 @@ def get_term_info(sem_term: Literal["sem", "presem"]) -> dict[str, Any]:
         Dict[str, Any]: the term info for the selected term from latestTerm.json.
     """
     fname = os.path.join(os.path.dirname(__file__), "../public/latestTerm.json")
-    with open(fname, encoding="utf-8") as latest_term_file:
-        term_info = json.load(latest_term_file)
+    term_info = jsonio.load(fname)
 
     if sem_term == "sem":
         return term_info["semester"]
@@ -241,6 +292,69 @@ def url_name_to_term(url_name: str) -> Term:
     raise ValueError(f"Invalid term {url_name[0]}")
 
 
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    Decodes a JSON array from UTF-8 chunks, yielding its elements one at a time,
+    so that neither the raw array nor the decoded list is ever held in memory.
+
+    >>> list(iter_json_array([b'[{"a": 1}, {"b": ', b'"\\xc3', b'\\xa9"}, 3', b"4]"]))
+    [{'a': 1}, {'b': '\\xe9'}, 34]
+
+    Args:
+        chunks (Iterable[bytes]): The encoded array, in chunks of any size
+
+    Raises:
+        ValueError: If the input is not a JSON array
+
+    Yields:
+        Any: Each element of the array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunk_iter = iter(chunks)
+    buffer = ""
+    pos = 0
+    exhausted = False
+    started = False
+
+    while True:
+        # Skip whitespace, and the punctuation between elements
+        while pos < len(buffer) and buffer[pos] in " \t\n\r,":
+            pos += 1
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                # Finish reading the input, so that the download is complete
+                for _ in chunk_iter:
+                    pass
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+            else:
+                # An element that runs to the end of the buffer, like a number,
+                # might continue in the next chunk
+                if end < len(buffer) or exhausted:
+                    yield element
+                    pos = end
+                    continue
+        elif exhausted:
+            raise ValueError("Unterminated JSON array")
+
+        # Read more input, dropping what has already been decoded
+        chunk = next(chunk_iter, None)
+        exhausted = chunk is None
+        buffer = buffer[pos:] + text_decoder.decode(chunk or b"", final=exhausted)
+        pos = 0
+
+
 def is_url(path_string: str) -> bool:
     """Check if the string has a URL-like scheme and network location."""
     try:
@@ -266,35 +380,41 @@ def read_csv(path: str, types_dict: type, encoding: str = "utf-8") -> list:
 
     assert hasattr(types_dict, "__annotations__"), "types_dict must be a TypedDict type"
 
-    data = []
     types = types_dict.__annotations__
-    cols = types.keys()
 
-    path_is_url = is_url(path)
-
-    if path_is_url:
-        with_open = urlopen(path, timeout=15)
-    else:
-        with_open = open(path, mode="r", newline="", encoding=encoding)
-
-    with with_open as csvfile:
-        reader = csv.DictReader(
-            csvfile
-            if not path_is_url
-            else csvfile.read().decode(encoding)[1:].splitlines()  # type: ignore
-        )
-        for row in reader:
-            cols_needed = [
-                col
-                for col in cols
-                if not (
-                    get_origin(types[col]) is Union
-                    and type(None) in get_args(types[col])
-                )
-            ]
-            assert (
-                set(cols_needed) - set(row.keys()) == set()
-            ), f"Missing columns in CSV file: {set(cols_needed) - set(row.keys())}"
-            data.append({col: row[col] for col in cols if col in row})  # type: ignore
+    if is_url(path):
+        # Skip the byte order mark at the start of the downloaded file
+        lines = fetch(path, timeout=15).decode(encoding)[1:].splitlines()
+        return _read_csv_rows(csv.DictReader(lines), types)
+
+    with open(path, mode="r", newline="", encoding=encoding) as csvfile:
+        return _read_csv_rows(csv.DictReader(csvfile), types)
+
+
+def _read_csv_rows(reader: csv.DictReader, types: dict[str, Any]) -> list:
+    """
+    Helper function for read_csv. Keeps only the columns in types from each row.
+
+    Args:
+        reader (csv.DictReader): The rows of the CSV file
+        types (dict[str, Any]): The annotations of the TypedDict type
+
+    Returns:
+        list: A list of dictionaries representing the parsed data
+    """
+    data = []
+    cols = types.keys()
+    for row in reader:
+        cols_needed = [
+            col
+            for col in cols
+            if not (
+                get_origin(types[col]) is Union and type(None) in get_args(types[col])
+            )
+        ]
+        assert (
+            set(cols_needed) - set(row.keys()) == set()
+        ), f"Missing columns in CSV file: {set(cols_needed) - set(row.keys())}"
+        data.append({col: row[col] for col in cols if col in row})
 
     return data
@@ -0,0 +1,216 @@
+"""
+Repackages whenever an override file changes, for trying out overrides without
+scraping everything again. Run `python3 -m scrapers --watch`.
+
+The results of the scrapers are read once from the files they saved last time, and
+kept in memory. Then the override files in overrides.toml.d/ and pe/ (and the saved
+results, in case the scrapers are run again) are checked every POLL_INTERVAL
+seconds. Each change repackages only the terms it affects, and prints which classes
+changed. Like a full run, it also writes the deltas and the compressed copies of
+the terms it rewrites, so public/ is never left half updated: a later run that
+finds the same version wouldn't write them again.
+
+Constants:
+    POLL_INTERVAL: float
+
+Functions:
+    get_watched_files()
+    affected_sems(path)
+    load_inputs()
+    print_changes(old, new)
+    watch(shard, interval)
+"""
+
+from __future__ import annotations
+
+import os
+import os.path
+import re
+import time
+from typing import Any
+
+from .delta import diff_payloads
+from .package import load_json_data, package_dir
+from .package import run as package_run
+from .pe import get_pe_quarters
+from .utils import SEM_TYPES, get_term_info
+
+POLL_INTERVAL = 0.5
+
+# The files saved by the scrapers, and the overrides of a PE quarter
+_INPUT_REGEX = re.compile(r"^(fireroad-\w+|catalog|cim|locations|pe-q\d+)\.json$")
+_PE_REGEX = re.compile(r"^pe-q(\d+)(?:-overrides\.toml|\.json)$")
+
+
+def get_watched_files() -> dict[str, tuple[int, int]]:
+    """
+    Lists the files that packaging reads, other than the term info.
+
+    Returns:
+        dict[str, tuple[int, int]]: The modification time (in ns) and size of each
+        file, by path relative to the scrapers directory
+    """
+    paths = [name for name in os.listdir(package_dir) if _INPUT_REGEX.match(name)]
+    for root, _, names in os.walk(os.path.join(package_dir, "overrides.toml.d")):
+        paths.extend(
+            os.path.relpath(os.path.join(root, name), package_dir)
+            for name in names
+            if name.endswith((".toml", ".json"))
+        )
+    paths.extend(
+        os.path.join("pe", name)
+        for name in os.listdir(os.path.join(package_dir, "pe"))
+        if name.endswith("-overrides.toml")
+    )
+
+    stamps = {}
+    for path in paths:
+        try:
+            stat = os.stat(os.path.join(package_dir, path))
+        except OSError:  # removed while listing
+            continue
+        stamps[path] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+
+def affected_sems(path: str) -> set[str]:
+    """
+    Works out which terms a file is used for.
+
+    >>> sorted(affected_sems(os.path.join("overrides.toml.d", "sem", "6.toml")))
+    ['sem']
+    >>> sorted(affected_sems(os.path.join("overrides.toml.d", "override-schema.json")))
+    ['presem', 'sem']
+    >>> sorted(affected_sems("fireroad-presem.json"))
+    ['presem']
+
+    Args:
+        path (str): The file, relative to the scrapers directory
+
+    Returns:
+        set[str]: The sem_types to repackage when the file changes
+    """
+    parts = path.split(os.sep)
+    if parts[0] == "overrides.toml.d" and len(parts) > 2 and parts[1] in SEM_TYPES:
+        return {parts[1]}
+    if parts[0].startswith("fireroad-"):
+        sem = parts[0][len("fireroad-") : -len(".json")]
+        return {sem} if sem in SEM_TYPES else set()
+    match = _PE_REGEX.match(parts[-1])
+    if match:
+        quarter = int(match.group(1))
+        return {
+            sem
+            for sem in SEM_TYPES
+            if quarter in get_pe_quarters(get_term_info(sem)["urlName"])
+        }
+    return set(SEM_TYPES)
+
+
+def load_inputs() -> dict[str, Any]:
+    """
+    Reads the results the scrapers saved last time.
+
+    Returns:
+        dict[str, Any]: The results, as keyword arguments for package.run()
+
+    Raises:
+        OSError: If one of the files doesn't exist, because a scraper never ran
+    """
+    pe = {}
+    for name in os.listdir(package_dir):
+        match = _PE_REGEX.match(name)
+        if match and name.endswith(".json"):
+            pe[int(match.group(1))] = load_json_data(name)
+    return {
+        "fireroad": {sem: load_json_data(f"fireroad-{sem}.json") for sem in SEM_TYPES},
+        "catalog": load_json_data("catalog.json"),
+        "cim": load_json_data("cim.json"),
+        "locations": load_json_data("locations.json"),
+        "pe": pe,
+    }
+
+
+def print_changes(old: dict[str, Any], new: dict[str, Any]) -> None:
+    """
+    Prints which classes changed between two versions of a term.
+
+    >>> old = {"termInfo": {"urlName": "f26"}, "classes": {"6.100": {"x": 1}}}
+    >>> new = {"termInfo": {"urlName": "f26"}, "classes": {"6.100": {"x": 2},
+    ...        "6.200": {}}}
+    >>> print_changes(old, new)
+    f26: 1 added, 0 removed, 1 changed
+      + 6.200
+      ~ 6.100: x
+
+    Args:
+        old (dict[str, Any]): The older version, as returned by package.run()
+        new (dict[str, Any]): The newer version
+    """
+    delta = diff_payloads(old, new)
+    print(
+        f"{new['termInfo']['urlName']}: {len(delta['added'])} added, "
+        f"{len(delta['removed'])} removed, {len(delta['changed'])} changed"
+    )
+    for number in sorted(delta["added"]):
+        print(f"  + {number}")
+    for number in sorted(delta["removed"]):
+        print(f"  - {number}")
+    for number, change in sorted(delta["changed"].items()):
+        print(f"  ~ {number}: {', '.join(sorted([*change['set'], *change['unset']]))}")
+    for key in sorted(delta["replaced"]):
+        print(f"  ~ {key}")
+
+
+def watch(shard: bool = False, interval: float = POLL_INTERVAL) -> None:
+    """
+    Packages once, then repackages whenever the watched files change, until
+    interrupted.
+
+    Args:
+        shard (bool): Whether packaging also writes the sharded layout
+        interval (float): How often to check the files, in seconds
+    """
+    try:
+        inputs = load_inputs()
+    except OSError as error:
+        print(f"{error}; run `python3 -m scrapers` once first")
+        return
+    stamps = get_watched_files()
+    payloads = package_run(shard, **inputs)
+    print(f"Watching {len(stamps)} files, press Ctrl+C to stop")
+
+    try:
+        while True:
+            time.sleep(interval)
+            new_stamps = get_watched_files()
+            changed = {
+                path
+                for path in stamps.keys() | new_stamps.keys()
+                if stamps.get(path) != new_stamps.get(path)
+            }
+            if not changed:
+                continue
+            stamps = new_stamps
+            print(f"Changed: {', '.join(sorted(changed))}")
+
+            start = time.perf_counter()
+            try:
+                if any(_INPUT_REGEX.match(path) for path in changed):
+                    inputs = load_inputs()
+                sems = set().union(*map(affected_sems, changed))
+                new_payloads = package_run(
+                    shard,
+                    sems=[sem for sem in SEM_TYPES if sem in sems],
+                    **inputs,
+                )
+            except (OSError, ValueError) as error:
+                # Such as a half-written file, or a TOML syntax error
+                print(f"Unable to repackage: {error}")
+                continue
+            for sem, payload in new_payloads.items():
+                print_changes(payloads[sem], payload)
+                payloads[sem] = payload
+            print(f"Repackaged in {time.perf_counter() - start:.2f} s")
+    except KeyboardInterrupt:
+        pass
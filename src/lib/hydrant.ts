@@ -9,6 +9,8 @@ import type { State } from "../lib/state";
 
 export interface SemesterData {
   classes: Record<string, RawClass>;
+  /** Changes only when the data does, unlike lastUpdated */
+  version?: string;
   lastUpdated: string;
   termInfo: TermInfo;
   pe?: Record<number, Record<string, RawPEClass>>;
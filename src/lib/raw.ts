@@ -21,6 +21,17 @@ export interface RawClass {
   labSections: RawSection[];
   /** Design timeslots and rooms */
   designSections: RawSection[];
+  /**
+   * Timeslot masks of the lecture sections, as hex strings where bit i is set
+   * if the section meets during slot i
+   */
+  lectureSectionMasks?: string[];
+  /** Timeslot masks of the recitation sections */
+  recitationSectionMasks?: string[];
+  /** Timeslot masks of the lab sections */
+  labSectionMasks?: string[];
+  /** Timeslot masks of the design sections */
+  designSectionMasks?: string[];
   /** Raw lecture times, e.g. T9.301-11 or TR1,F2 */
   lectureRawSections: string[];
   /** Raw recitation times, e.g. T9.301-11 or TR1,F2 */
@@ -210,6 +221,8 @@ export interface RawPEClass {
   sectionNumbers: string[];
   /** Timeslots and locations for each section */
   sections: RawSection[];
+  /** Timeslot masks for each section, as in RawClass */
+  sectionMasks?: string[];
   /** Raw (FireRoad format) section locations/times */
   rawSections: string[];
   /** Class size (for each section) */